@@ -0,0 +1,585 @@
+"""Benchmarks the latency of the dialogue pipeline with local stand-ins for OpenAI, ElevenLabs, and Azure.
+
+Runs the same DialogueOrchestrator, AICharacter, OpenAiManager, and ElevenLabsManager the app uses, headlessly,
+and reports p50/p95/p99 of prompt -> first token, prompt -> first audio, and prompt -> end of the character's turn
+for scenes with different numbers of characters all answering the same prompt.
+
+EG: python -m benchmarks.latency_benchmark --characters 1 2 4 8 --scenes 20 --scale 0.1
+
+With --barge-in the mic key is pressed as soon as the first character starts talking,
+and it reports how long the characters take to go quiet instead.
+"""
+
+from contextlib import redirect_stdout
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# ml imports pynput for the hotkeys, which needs a display unless it's told not to listen
+os.environ.setdefault("PYNPUT_BACKEND", "dummy")
+
+from benchmarks.stubs import (  # noqa: E402
+    LatencyRecorder,
+    StubAudioManager,
+    StubAzureConnectionsManager,
+    StubElevenLabs,
+    StubLatency,
+    StubOpenAI,
+)
+from ml.ai_character import AICharacter  # noqa: E402
+from ml.eleven_labs import ElevenLabsManager  # noqa: E402
+from ml.http_clients import SharedHttpClients  # noqa: E402
+from ml.metrics import MetricsRecorder  # noqa: E402
+from ml.orchestrator import DialogueOrchestrator  # noqa: E402
+from ml.state_handoff import StateHandoff  # noqa: E402
+from ml.utils import percentile  # noqa: E402
+
+METRICS = ["first_token", "first_audio", "turn_end"]
+PROMPT = "What should we do next?"
+
+
+class HeadlessApp:
+    """The parts of CommanderGPTApp the orchestrator uses, with stand-ins for every external service."""
+
+    def __init__(
+        self,
+        character_count: int,
+        tts: str,
+        latency: StubLatency,
+        recorder: LatencyRecorder,
+        work_directory: str,
+        activation_mode: str = "sequential",
+        hands_free: bool = False,
+        stable_partial_seconds: float = 0.4,
+        end_of_speech_seconds: float = 0.8,
+        first_token_deadline_seconds: float = 0,
+        tts_latency_budget_seconds: float = 0,
+    ):
+        """Creates the characters and stand-in libraries.
+
+        Args:
+            character_count (int): How many characters are in the scene.
+            tts (str): "elevenlabs" or "azure".
+            latency (StubLatency): The latency profile for the stand-ins.
+            recorder (LatencyRecorder): Where the stand-ins record each stage of a turn.
+            work_directory (str): Where chat histories and audio files are written.
+            activation_mode (str, optional): "sequential" or "ensemble". Defaults to "sequential".
+            hands_free (bool, optional): Whether the mic stops by itself once the user stops talking, with every character responding. Defaults to False.
+            stable_partial_seconds (float, optional): How long the transcript stays the same before the hands free mode responds to it speculatively. Defaults to 0.4.
+            end_of_speech_seconds (float, optional): How long the transcript stays the same before the hands free mode stops listening. Defaults to 0.8.
+            first_token_deadline_seconds (float, optional): How long each character waits for a first token before hedging with a second request, 0 never hedges. Defaults to 0.
+            tts_latency_budget_seconds (float, optional): The median time to first audio above which 11labs characters fail over to Azure, 0 never fails over. Defaults to 0.
+        """
+        # the stand-ins never connect anywhere
+        self.system_config = {
+            "activation_mode": activation_mode,
+            "http_clients": {"warm_up": False},
+            "tts_routing": {
+                "enabled": tts_latency_budget_seconds > 0,
+                "latency_budget_seconds": tts_latency_budget_seconds,
+            },
+            "hands_free": {
+                "enabled": hands_free,
+                "stable_partial_seconds": stable_partial_seconds,
+                "end_of_speech_seconds": end_of_speech_seconds,
+                "respond_with": [
+                    f"Character{index}" for index in range(character_count)
+                ],
+            },
+        }
+        self.token_config = {"openai_api_key": "benchmark"}
+        self.state_handoff = StateHandoff()
+        self.metrics = MetricsRecorder()
+        self.http_clients = SharedHttpClients()
+        self.mic_activation_key = "Key.home"
+        self.enable_screenshot_toggle_key = None
+        self.enable_twitch_integration = False
+        self.twitch_bot = None
+        self.twitch_digest_mode = False
+        self.subtitles = None
+        self.config_watcher = None
+        self.character_config_keys = {}
+
+        self.ai_characters = []
+        elevenlabs_voices = {}
+        azure_voices = {}
+        for index in range(character_count):
+            name = f"Character{index}"
+            config = {
+                "name": name,
+                "use_elevenlabs_voice": tts == "elevenlabs",
+                "elevenlabs_voice": f"Voice {index}",
+                "azure_voice_name": f"en-US-Voice{index}Neural",
+                "history": {"max_history_length_messages": 100},
+                "llm_deadlines": {
+                    "first_token_deadline_seconds": first_token_deadline_seconds
+                },
+                "visuals": {"images": {}},
+                "first_system_message": {
+                    "role": "system",
+                    "content": [f"You are {name}, answer briefly."],
+                },
+            }
+            ai_character = AICharacter(
+                commander_gpt=self,
+                config=config,
+                chat_history_filepath=os.path.join(
+                    work_directory, f"{name}_history.json"
+                ),
+            )
+            ai_character.openai_manager.client = StubOpenAI(name, latency, recorder)
+            elevenlabs_voices[ai_character.elevenlabs_voice] = name
+            azure_voices[ai_character.azure_voice_name] = name
+            self.ai_characters.append(ai_character)
+
+        for ai_character in self.ai_characters:
+            for other_ai_character in self.ai_characters:
+                if ai_character.name != other_ai_character.name:
+                    ai_character.other_ai_characters.append(other_ai_character)
+
+        self.audio_manager = StubAudioManager(latency, recorder)
+        self.elevenlabs_manager = ElevenLabsManager(
+            elevenlabs_api_key=None,
+            client=StubElevenLabs(elevenlabs_voices, latency, recorder),
+            audio_manager=self.audio_manager,
+            voice_names=list(elevenlabs_voices),
+            voice_cache_filepath=None,
+        )
+        self.speechtotext_manager = StubAzureConnectionsManager(
+            azure_voices, latency, recorder
+        )
+        self.speech_recognizer = self.speechtotext_manager
+
+
+async def run_scenes(
+    app: HeadlessApp,
+    orchestrator: DialogueOrchestrator,
+    recorder: LatencyRecorder,
+    scenes: int,
+    barge_in_after_seconds: float = None,
+    mic: str = None,
+    reaction_seconds: float = 0.3,
+):
+    """Prompts every character in the app, one scene at a time.
+
+    Args:
+        app (HeadlessApp): The app to drive.
+        orchestrator (DialogueOrchestrator): The orchestrator running the pipeline.
+        recorder (LatencyRecorder): Records each stage of the turns.
+        scenes (int): How many times to prompt the characters.
+        barge_in_after_seconds (float, optional): If given, the mic key is pressed once the first character starts talking,
+            and any audio starting within this many seconds afterwards is counted. Defaults to None.
+        mic (str, optional): "manual" or "hands-free" to say the prompt into the mic, timing the turns from when the user stopped talking.
+            Defaults to None, for prompts given straight away.
+        reaction_seconds (float, optional): How long after they stop talking the user presses the mic key in the "manual" mode. Defaults to 0.3.
+    """
+    main_task = asyncio.create_task(orchestrator.main(listen_for_keys=False))
+    # let the orchestrator create its queue
+    await asyncio.sleep(0)
+    names = [ai_character.name for ai_character in app.ai_characters]
+    for _ in range(scenes):
+        recorder.start_scene(names)
+        if mic is not None:
+            await talk_into_mic(app, orchestrator, recorder, mic, reaction_seconds)
+        else:
+            orchestrator.last_characters_response = PROMPT
+            for ai_character in app.ai_characters:
+                orchestrator.activate_character(ai_character)
+        if barge_in_after_seconds is not None:
+            await barge_in(app, orchestrator, recorder, barge_in_after_seconds)
+            recorder.finish_barge_in(len(names))
+        await orchestrator.activation_queue.join()
+        # let the last character finish talking before prompting again
+        turn_end = recorder.latest_mark("turn_end")
+        if turn_end is not None:
+            await asyncio.sleep(max(0.0, turn_end - time.monotonic()))
+        recorder.finish_scene(len(names))
+        app.state_handoff.apply_pending()
+    main_task.cancel()
+    try:
+        await main_task
+    except asyncio.CancelledError:
+        pass
+
+
+async def talk_into_mic(
+    app: HeadlessApp,
+    orchestrator: DialogueOrchestrator,
+    recorder: LatencyRecorder,
+    mic: str,
+    reaction_seconds: float,
+):
+    """Says the prompt into the mic, then has every character respond.
+
+    Args:
+        app (HeadlessApp): The app being driven.
+        orchestrator (DialogueOrchestrator): The orchestrator running the pipeline.
+        recorder (LatencyRecorder): Records each stage of the turns, timed from when the user stopped talking.
+        mic (str): "manual" to press the mic key again and then activate the characters, or "hands-free" to let the orchestrator notice.
+        reaction_seconds (float): How long after they stop talking the user presses the mic key in the "manual" mode.
+    """
+    speech_recognizer = app.speech_recognizer
+    await orchestrator.toggle_mic()
+    while speech_recognizer.speech_ended_at is None:
+        await asyncio.sleep(0.001)
+    speech_ended_at = speech_recognizer.speech_ended_at
+    recorder.prompted_at(speech_ended_at)
+    if mic == "manual":
+        await asyncio.sleep(
+            max(0.0, speech_ended_at + reaction_seconds - time.monotonic())
+        )
+        await orchestrator.toggle_mic(pressed_at=time.monotonic())
+        for ai_character in app.ai_characters:
+            orchestrator.activate_character(ai_character)
+    else:
+        # the characters are activated when it stops listening
+        while orchestrator.is_talking:
+            await asyncio.sleep(0.001)
+
+
+async def barge_in(
+    app: HeadlessApp,
+    orchestrator: DialogueOrchestrator,
+    recorder: LatencyRecorder,
+    after_seconds: float,
+):
+    """Presses the mic key once the first character starts talking, then again to stop talking.
+
+    Args:
+        app (HeadlessApp): The app being driven.
+        orchestrator (DialogueOrchestrator): The orchestrator running the pipeline.
+        recorder (LatencyRecorder): Records when the audio stops, and any that starts afterwards.
+        after_seconds (float): How long to watch for audio starting afterwards.
+    """
+    while recorder.latest_mark("first_audio") is None:
+        await asyncio.sleep(0.001)
+    # draw a frame, so the character is shown talking like they would be in the app
+    app.state_handoff.apply_pending()
+
+    def press_mic_key():
+        # from another thread, like the hotkey listener
+        pressed_at = time.monotonic()
+        recorder.start_barge_in(pressed_at)
+        orchestrator.call_soon(
+            orchestrator.loop.create_task,
+            orchestrator.toggle_mic(pressed_at=pressed_at),
+        )
+
+    await asyncio.to_thread(press_mic_key)
+    while not orchestrator.is_talking:
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(after_seconds)
+    await orchestrator.toggle_mic()
+
+
+def summarize(completed_turns: list[dict], character_counts: list[int]) -> list[dict]:
+    """Computes p50/p95/p99 for each metric and number of characters.
+
+    Args:
+        completed_turns (list[dict]): The turns recorded by the LatencyRecorder.
+        character_counts (list[int]): The numbers of characters that were benchmarked.
+
+    Returns:
+        list[dict]: One row per number of characters and metric.
+    """
+    rows = []
+    for character_count in character_counts:
+        turns = [
+            turn for turn in completed_turns if turn["characters"] == character_count
+        ]
+        for metric in METRICS:
+            values = [turn[metric] for turn in turns if metric in turn]
+            rows.append(
+                {
+                    "characters": character_count,
+                    "metric": metric,
+                    "samples": len(values),
+                    "p50": percentile(values, 0.50),
+                    "p95": percentile(values, 0.95),
+                    "p99": percentile(values, 0.99),
+                }
+            )
+    return rows
+
+
+def summarize_barge_ins(
+    completed_barge_ins: list[dict], character_counts: list[int]
+) -> list[dict]:
+    """Computes p50/p95/p99 of the time from pressing the mic key to silence for each number of characters.
+
+    Args:
+        completed_barge_ins (list[dict]): The barge ins recorded by the LatencyRecorder.
+        character_counts (list[int]): The numbers of characters that were benchmarked.
+
+    Returns:
+        list[dict]: One row per number of characters.
+    """
+    rows = []
+    for character_count in character_counts:
+        barge_ins = [
+            barge_in
+            for barge_in in completed_barge_ins
+            if barge_in["characters"] == character_count
+        ]
+        values = [
+            barge_in["silence"]
+            for barge_in in barge_ins
+            if barge_in["silence"] is not None
+        ]
+        rows.append(
+            {
+                "characters": character_count,
+                "metric": "silence",
+                "samples": len(values),
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+                "late_playbacks": sum(
+                    barge_in["late_playbacks"] for barge_in in barge_ins
+                ),
+            }
+        )
+    return rows
+
+
+def count_llm_requests(metrics: MetricsRecorder) -> dict:
+    """Totals the app's completion request and TTS failover counters across characters.
+
+    Args:
+        metrics (MetricsRecorder): The app's metrics.
+
+    Returns:
+        dict: The number of "requests" first sent, "hedges" sent after them, "hedge_wins", and "tts_failovers" from 11labs to Azure.
+    """
+    totals = {"requests": 0, "hedges": 0, "hedge_wins": 0, "tts_failovers": 0}
+    for (metric_name, labels), count in metrics.counters.items():
+        if metric_name == "llm_requests_total" and ("attempt", "primary") in labels:
+            totals["requests"] += count
+        elif metric_name == "llm_hedges_total":
+            totals["hedges"] += count
+        elif metric_name == "llm_hedge_wins_total":
+            totals["hedge_wins"] += count
+        elif metric_name == "tts_route_changes_total" and ("to", "azure") in labels:
+            totals["tts_failovers"] += count
+    return totals
+
+
+def format_seconds(value: float) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--characters", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--scenes", type=int, default=10)
+    parser.add_argument("--tts", choices=["elevenlabs", "azure"], default="elevenlabs")
+    parser.add_argument(
+        "--activation-mode", choices=["sequential", "ensemble"], default="sequential"
+    )
+    parser.add_argument("--llm-first-token-seconds", type=float, default=0.4)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80)
+    parser.add_argument("--response-characters", type=int, default=200)
+    parser.add_argument("--tts-first-audio-seconds", type=float, default=0.3)
+    parser.add_argument("--audio-kilobytes", type=int, default=64)
+    parser.add_argument("--playback-seconds", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.25)
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiplies every stand-in latency"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--barge-in",
+        action="store_true",
+        help="press the mic key as each scene's first character starts talking, and report the time until silence",
+    )
+    parser.add_argument(
+        "--mic",
+        choices=["manual", "hands-free"],
+        help="say each prompt into the mic, and time the turns from when the user stopped talking",
+    )
+    parser.add_argument(
+        "--reaction-seconds",
+        type=float,
+        default=0.3,
+        help="how long the user takes to press the mic key after they stop talking with --mic manual",
+    )
+    parser.add_argument(
+        "--stable-partial-seconds",
+        type=float,
+        default=0.4,
+        help="how long the transcript stays the same before --mic hands-free responds to it speculatively",
+    )
+    parser.add_argument(
+        "--end-of-speech-seconds",
+        type=float,
+        default=0.8,
+        help="how long the transcript stays the same before --mic hands-free stops listening",
+    )
+    parser.add_argument(
+        "--llm-stall-probability",
+        type=float,
+        default=0.0,
+        help="the chance of a completion request stalling before its first token",
+    )
+    parser.add_argument(
+        "--llm-stall-seconds",
+        type=float,
+        default=5.0,
+        help="how much longer a stalled request takes",
+    )
+    parser.add_argument(
+        "--first-token-deadline-seconds",
+        type=float,
+        default=0,
+        help="hedge a completion request with a second one if it has no first token after this long, 0 never hedges",
+    )
+    parser.add_argument(
+        "--elevenlabs-extra-seconds",
+        type=float,
+        default=0.0,
+        help="how much longer 11labs takes than Azure to return audio",
+    )
+    parser.add_argument(
+        "--tts-latency-budget-seconds",
+        type=float,
+        default=0,
+        help="fail over from 11labs to Azure while 11labs' median time to first audio is above this, 0 never fails over",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument(
+        "--max-p95-turn-seconds",
+        type=float,
+        help="exit with an error if any p95 of prompt -> end of turn is above this",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show the app's own output"
+    )
+    args = parser.parse_args()
+
+    latency = StubLatency(
+        llm_first_token_seconds=args.llm_first_token_seconds,
+        llm_tokens_per_second=args.llm_tokens_per_second,
+        response_characters=args.response_characters,
+        tts_first_audio_seconds=args.tts_first_audio_seconds,
+        elevenlabs_extra_seconds=args.elevenlabs_extra_seconds,
+        audio_kilobytes=args.audio_kilobytes,
+        playback_seconds=args.playback_seconds,
+        llm_stall_probability=args.llm_stall_probability,
+        llm_stall_seconds=args.llm_stall_seconds,
+        jitter=args.jitter,
+        scale=args.scale,
+        seed=args.seed,
+    )
+    recorder = LatencyRecorder()
+    # character count -> the app's completion request counters
+    llm_request_counts = {}
+    original_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_directory:
+        # the 11labs manager saves audio relative to the current directory
+        os.makedirs(os.path.join(work_directory, "assets", "audio"))
+        os.chdir(work_directory)
+        try:
+            for character_count in args.characters:
+                app_output = io.StringIO()
+                with redirect_stdout(sys.stdout if args.verbose else app_output):
+                    app = HeadlessApp(
+                        character_count,
+                        args.tts,
+                        latency,
+                        recorder,
+                        work_directory,
+                        activation_mode=args.activation_mode,
+                        hands_free=args.mic == "hands-free",
+                        # scaled like the stand-ins' latencies they're compared to
+                        stable_partial_seconds=args.stable_partial_seconds * args.scale,
+                        end_of_speech_seconds=args.end_of_speech_seconds * args.scale,
+                        first_token_deadline_seconds=args.first_token_deadline_seconds
+                        * args.scale,
+                        tts_latency_budget_seconds=args.tts_latency_budget_seconds
+                        * args.scale,
+                    )
+                    orchestrator = DialogueOrchestrator(commander_gpt=app)
+                    orchestrator.loop.run_until_complete(
+                        run_scenes(
+                            app,
+                            orchestrator,
+                            recorder,
+                            args.scenes,
+                            barge_in_after_seconds=(
+                                # long enough for the next character's audio to start if it wasn't stopped
+                                latency.playback_seconds * latency.scale
+                                if args.barge_in
+                                else None
+                            ),
+                            mic=args.mic,
+                            reaction_seconds=args.reaction_seconds * args.scale,
+                        )
+                    )
+                    orchestrator.loop.close()
+                llm_request_counts[character_count] = count_llm_requests(app.metrics)
+        finally:
+            os.chdir(original_directory)
+
+    if args.barge_in:
+        rows = summarize_barge_ins(recorder.completed_barge_ins, args.characters)
+    else:
+        rows = summarize(recorder.completed_turns, args.characters)
+    print(
+        f"{'characters':>10} {'metric':>12} {'samples':>8} {'p50':>8} {'p95':>8} {'p99':>8}"
+    )
+    for row in rows:
+        print(
+            f"{row['characters']:>10} {row['metric']:>12} {row['samples']:>8} "
+            f"{format_seconds(row['p50']):>8} {format_seconds(row['p95']):>8} {format_seconds(row['p99']):>8}"
+        )
+    if args.first_token_deadline_seconds > 0:
+        for character_count, counts in llm_request_counts.items():
+            print(
+                f"Hedged {counts['hedges']} of {counts['requests']} requests with {character_count} characters, "
+                f"the hedge answered first {counts['hedge_wins']} times."
+            )
+    if args.tts_latency_budget_seconds > 0:
+        for character_count, counts in llm_request_counts.items():
+            print(
+                f"Failed over from 11labs to Azure {counts['tts_failovers']} times with {character_count} characters."
+            )
+    for row in rows:
+        if row.get("late_playbacks", 0):
+            print(
+                f"Audio started {row['late_playbacks']} times after the mic key was pressed with {row['characters']} characters."
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "args": vars(args),
+                    "results": rows,
+                    "llm_requests": llm_request_counts,
+                },
+                f,
+                indent=4,
+            )
+
+    if args.max_p95_turn_seconds is not None:
+        slow_rows = [
+            row
+            for row in rows
+            if row["metric"] == "turn_end"
+            and row["p95"] is not None
+            and row["p95"] > args.max_p95_turn_seconds
+        ]
+        if slow_rows:
+            print(
+                f"p95 turn time is above {args.max_p95_turn_seconds}s for {slow_rows}"
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
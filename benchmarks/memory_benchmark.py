@@ -0,0 +1,267 @@
+"""Benchmarks the memory used by long chat histories, stored as ChatMessage records or as the API's nested dicts.
+
+Builds the histories a scene of several characters would have after a long stream, with prompts from many different twitch chatters,
+the same way OpenAiManager records them, and reports the memory used, the objects the garbage collector has to track,
+how long a full garbage collection takes, and how long building one request from a history takes.
+Then fills a character's long term memory with trimmed messages and reports how long indexing and searching it takes.
+
+EG: python -m benchmarks.memory_benchmark --characters 4 --messages 10000 --memories 10000
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# ml imports pynput for the hotkeys, which needs a display unless it's told not to listen
+os.environ.setdefault("PYNPUT_BACKEND", "dummy")
+
+from ml.chat_message import ChatMessage, messages_to_dicts  # noqa: E402
+from ml.long_term_memory import LongTermMemory  # noqa: E402
+
+
+def build_dict_histories(
+    character_names: list[str], messages: int, chatter_count: int
+) -> dict:
+    """Builds each character's history as the API's dicts, the way the histories were stored before ChatMessage.
+
+    Args:
+        character_names (list[str]): The characters in the scene.
+        messages (int): How many messages each character's history has.
+        chatter_count (int): How many different names the prompts come from.
+
+    Returns:
+        dict: Character name -> their history.
+    """
+    histories = {
+        name: [
+            {
+                "role": "system",
+                "content": [{"type": "text", "text": f"You are {name}."}],
+            }
+        ]
+        for name in character_names
+    }
+    turn = 0
+    while len(histories[character_names[0]]) < messages:
+        # built the same way for every turn, so nothing is shared that the app wouldn't share
+        users_name = f"chatter{turn % chatter_count}"
+        prompt = [
+            {
+                "type": "text",
+                "text": f"\n[{users_name}]\nWhat do you think about question number {turn}?",
+            }
+        ]
+        for history in histories.values():
+            history.append({"role": "user", "content": prompt})
+        speaker = character_names[turn % len(character_names)]
+        answer = f"This is answer {turn}. " * 10
+        for name, history in histories.items():
+            if name == speaker:
+                history.append({"role": "assistant", "content": answer})
+            else:
+                history.append({"role": "user", "content": f"\n[{speaker}]\n{answer}"})
+        turn += 1
+    return histories
+
+
+def build_record_histories(
+    character_names: list[str], messages: int, chatter_count: int
+) -> dict:
+    """Builds each character's history as ChatMessage records, the way OpenAiManager records them.
+
+    Args:
+        character_names (list[str]): The characters in the scene.
+        messages (int): How many messages each character's history has.
+        chatter_count (int): How many different names the prompts come from.
+
+    Returns:
+        dict: Character name -> their history.
+    """
+    histories = {
+        name: [ChatMessage("system", f"You are {name}.", as_parts=True)]
+        for name in character_names
+    }
+    turn = 0
+    while len(histories[character_names[0]]) < messages:
+        prompt = ChatMessage(
+            "user",
+            f"What do you think about question number {turn}?",
+            speaker=f"chatter{turn % chatter_count}",
+            as_parts=True,
+        )
+        for history in histories.values():
+            history.append(prompt)
+        speaker = character_names[turn % len(character_names)]
+        answer = f"This is answer {turn}. " * 10
+        shared_answer = ChatMessage("user", answer, speaker=speaker)
+        for name, history in histories.items():
+            if name == speaker:
+                history.append(ChatMessage("assistant", answer))
+            else:
+                history.append(shared_answer)
+        turn += 1
+    return histories
+
+
+def measure(build, to_request, character_names: list[str], args) -> dict:
+    """Builds the histories and measures them.
+
+    Args:
+        build (callable): build_dict_histories or build_record_histories.
+        to_request (callable): Turns a history into the messages sent with a request.
+        character_names (list[str]): The characters in the scene.
+        args (argparse.Namespace): The benchmark's arguments.
+
+    Returns:
+        dict: The measurements.
+    """
+    gc.collect()
+    tracked_before = len(gc.get_objects())
+    tracemalloc.start()
+    histories = build(character_names, args.messages, args.chatters)
+    allocated_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracked_objects = len(gc.get_objects()) - tracked_before
+
+    gc_seconds = []
+    for _ in range(args.repeats):
+        start_time = time.perf_counter()
+        gc.collect()
+        gc_seconds.append(time.perf_counter() - start_time)
+
+    history = histories[character_names[0]]
+    request_seconds = []
+    for _ in range(args.repeats):
+        start_time = time.perf_counter()
+        to_request(history)
+        request_seconds.append(time.perf_counter() - start_time)
+
+    return {
+        "messages": sum(len(history) for history in histories.values()),
+        "megabytes": allocated_bytes / 1024 / 1024,
+        "gc_tracked_objects": tracked_objects,
+        "gc_collect_ms": min(gc_seconds) * 1000,
+        "build_request_ms": min(request_seconds) * 1000,
+    }
+
+
+def measure_long_term_memory(args) -> dict:
+    """Indexes trimmed messages in a character's long term memory, with the hashing embedder, and times searching it.
+
+    Args:
+        args (argparse.Namespace): The benchmark's arguments.
+
+    Returns:
+        dict: The measurements.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        index_filepath = os.path.join(directory, "character_memory.npz")
+        long_term_memory = LongTermMemory(index_filepath)
+        for turn in range(args.memories):
+            long_term_memory.remember(
+                ChatMessage(
+                    "user",
+                    f"What do you think about question number {turn}? I asked about topic {turn % 97} before.",
+                    speaker=f"chatter{turn % args.chatters}",
+                ),
+                "Character0",
+            )
+        start_time = time.perf_counter()
+        long_term_memory.flush()
+        index_seconds = time.perf_counter() - start_time
+        index_bytes = os.path.getsize(index_filepath)
+
+        search_seconds = []
+        prompt_characters = []
+        for turn in range(args.searches):
+            prompt = f"Remember what I asked about topic {turn % 97}?"
+            start_time = time.perf_counter()
+            memories = long_term_memory.search(prompt)
+            search_seconds.append(time.perf_counter() - start_time)
+            if memories:
+                prompt_characters.append(
+                    len(long_term_memory.prompt_message(memories).text)
+                )
+    search_seconds.sort()
+    return {
+        "memories": args.memories,
+        "index_ms": index_seconds * 1000,
+        "index_file_megabytes": index_bytes / 1024 / 1024,
+        "search_p50_ms": search_seconds[len(search_seconds) // 2] * 1000,
+        "search_p95_ms": search_seconds[int(len(search_seconds) * 0.95)] * 1000,
+        "prompt_characters_mean": (
+            statistics.mean(prompt_characters) if prompt_characters else 0
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--characters", type=int, default=4)
+    parser.add_argument(
+        "--messages", type=int, default=10000, help="messages in each history"
+    )
+    parser.add_argument(
+        "--chatters", type=int, default=200, help="different names prompts come from"
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--memories", type=int, default=10000, help="messages in the long term memory"
+    )
+    parser.add_argument(
+        "--searches", type=int, default=200, help="searches of the long term memory"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    character_names = [f"Character{index}" for index in range(args.characters)]
+    rows = [
+        {
+            "representation": "dicts",
+            # the history was copied, with the prompt added, for every request
+            **measure(build_dict_histories, list.copy, character_names, args),
+        },
+        {
+            "representation": "records",
+            **measure(build_record_histories, messages_to_dicts, character_names, args),
+        },
+    ]
+    print(
+        f"{'representation':>14} {'messages':>9} {'MB':>8} {'gc objects':>11} {'gc ms':>8} {'request ms':>11}"
+    )
+    for row in rows:
+        print(
+            f"{row['representation']:>14} {row['messages']:>9} {row['megabytes']:>8.2f} {row['gc_tracked_objects']:>11} "
+            f"{row['gc_collect_ms']:>8.2f} {row['build_request_ms']:>11.2f}"
+        )
+    long_term_memory_row = measure_long_term_memory(args)
+    print(
+        f"\n{'memories':>9} {'index ms':>9} {'file MB':>8} {'search p50 ms':>14} {'search p95 ms':>14} {'prompt chars':>13}"
+    )
+    print(
+        f"{long_term_memory_row['memories']:>9} {long_term_memory_row['index_ms']:>9.1f} "
+        f"{long_term_memory_row['index_file_megabytes']:>8.2f} {long_term_memory_row['search_p50_ms']:>14.3f} "
+        f"{long_term_memory_row['search_p95_ms']:>14.3f} {long_term_memory_row['prompt_characters_mean']:>13.0f}"
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "args": vars(args),
+                    "results": rows,
+                    "long_term_memory": long_term_memory_row,
+                },
+                f,
+                indent=4,
+            )
+
+
+if __name__ == "__main__":
+    main()
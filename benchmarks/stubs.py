@@ -0,0 +1,500 @@
+"""In-process stand-ins for OpenAI, ElevenLabs, Azure, and audio playback, used to benchmark the dialogue pipeline without API keys, a mic, or a screen."""
+
+from types import SimpleNamespace
+import asyncio
+import base64
+import os
+import random
+import threading
+import time
+
+from ml.cancellation import TurnCancelled
+from ml.subtitle_timeline import SubtitleTimeline
+
+# marks the name of the character speaking in stand-in audio, which may be given a header before it's saved
+SPEAKER_MARKER = b"speaker:"
+
+
+def stub_audio(character_name: str, kilobytes: int) -> bytes:
+    """Returns silent stand-in audio of the given size that names the character speaking."""
+    speaker = SPEAKER_MARKER + f"{character_name}\n".encode("utf-8")
+    return speaker + bytes(max(0, kilobytes * 1024 - len(speaker)))
+
+
+def speaker_of(file_path: str) -> str:
+    """Returns the name of the character speaking in saved stand-in audio."""
+    with open(file_path, "rb") as f:
+        audio = f.read()
+    start = audio.find(SPEAKER_MARKER) + len(SPEAKER_MARKER)
+    return audio[start : audio.find(b"\n", start)].decode("utf-8")
+
+
+class StubLatency:
+    """How slow, and how large, the stand-ins' responses are."""
+
+    def __init__(
+        self,
+        llm_first_token_seconds: float = 0.4,
+        llm_tokens_per_second: float = 80,
+        response_characters: int = 200,
+        tts_first_audio_seconds: float = 0.3,
+        elevenlabs_extra_seconds: float = 0.0,
+        audio_kilobytes: int = 64,
+        playback_seconds: float = 1.0,
+        stt_finalize_seconds: float = 0.3,
+        speech_words_per_second: float = 2.5,
+        llm_stall_probability: float = 0.0,
+        llm_stall_seconds: float = 5.0,
+        jitter: float = 0.25,
+        scale: float = 1.0,
+        seed: int = 0,
+    ):
+        """Initializes the latency profile.
+
+        Args:
+            llm_first_token_seconds (float, optional): Time until the completion's first token. Defaults to 0.4.
+            llm_tokens_per_second (float, optional): How fast the rest of the completion is generated. Defaults to 80.
+            response_characters (int, optional): The length of each completion. Defaults to 200.
+            tts_first_audio_seconds (float, optional): Time until synthesized audio is returned. Defaults to 0.3.
+            elevenlabs_extra_seconds (float, optional): How much longer 11labs takes than Azure to return audio, EG: while it's overloaded. Defaults to 0.
+            audio_kilobytes (int, optional): The size of the synthesized audio returned by 11labs. Defaults to 64.
+            playback_seconds (float, optional): How long each clip plays for. Defaults to 1.
+            stt_finalize_seconds (float, optional): How long speech recognition takes to finish after being stopped, or to give its final result after the user stops talking. Defaults to 0.3.
+            speech_words_per_second (float, optional): How fast the user talks into the mic, before scaling. Defaults to 2.5.
+            llm_stall_probability (float, optional): The chance of a completion request stalling before its first token, EG: from an overloaded server. Defaults to 0.
+            llm_stall_seconds (float, optional): How much longer a stalled request takes. Defaults to 5.
+            jitter (float, optional): Each latency is randomly scaled by up to this fraction in either direction. Defaults to 0.25.
+            scale (float, optional): Multiplies every latency, EG: 0.1 for quick runs in CI. Defaults to 1.
+            seed (int, optional): Seed for the jitter so runs are repeatable. Defaults to 0.
+        """
+        self.llm_first_token_seconds = llm_first_token_seconds
+        self.llm_tokens_per_second = llm_tokens_per_second
+        self.response_characters = response_characters
+        self.tts_first_audio_seconds = tts_first_audio_seconds
+        self.elevenlabs_extra_seconds = elevenlabs_extra_seconds
+        self.audio_kilobytes = audio_kilobytes
+        self.playback_seconds = playback_seconds
+        self.stt_finalize_seconds = stt_finalize_seconds
+        self.speech_words_per_second = speech_words_per_second
+        self.llm_stall_probability = llm_stall_probability
+        self.llm_stall_seconds = llm_stall_seconds
+        self.jitter = jitter
+        self.scale = scale
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample(self, seconds: float) -> float:
+        """Returns the given latency, scaled and with jitter applied.
+
+        Args:
+            seconds (float): The nominal latency.
+
+        Returns:
+            float: The latency to wait for.
+        """
+        with self.lock:
+            jitter = self.random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0.0, seconds * jitter * self.scale)
+
+    def llm_first_token_sample(self) -> float:
+        """Returns the time until a completion's first token, which sometimes stalls."""
+        with self.lock:
+            stalled = self.random.random() < self.llm_stall_probability
+        seconds = self.llm_first_token_seconds
+        if stalled:
+            seconds += self.llm_stall_seconds
+        return self.sample(seconds)
+
+    def response_text(self) -> str:
+        """Returns a completion of the configured length."""
+        words = []
+        length = 0
+        while length < self.response_characters:
+            word = f"word{len(words)}"
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[: self.response_characters]
+
+
+class LatencyRecorder:
+    """Records when each stage of a character's turn happened, relative to when the prompt was given."""
+
+    def __init__(self):
+        """Initializes the recorder without any turns."""
+        self.lock = threading.Lock()
+        # character name -> {mark name -> time}
+        self.current_marks = {}
+        self.completed_turns = []
+        # when the mic key was pressed to talk over the characters, and when their audio stopped
+        self.barge_in_pressed_at: float = None
+        self.barge_in_silent_at: float = None
+        # audio that started playing after the characters were talked over
+        self.late_playbacks = 0
+        self.completed_barge_ins = []
+
+    def start_scene(self, character_names: list[str]):
+        """Starts timing a turn for each of the given characters from now.
+
+        Args:
+            character_names (list[str]): The characters being prompted.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.current_marks = {name: {"prompt": now} for name in character_names}
+
+    def prompted_at(self, at: float):
+        """Times the current scene's turns from the given time instead, EG: when the user stopped talking.
+        Stages reached earlier, like a response started before the user was done talking, come out negative.
+
+        Args:
+            at (float): When the prompt was given.
+        """
+        with self.lock:
+            for marks in self.current_marks.values():
+                marks["prompt"] = at
+
+    def mark(self, character_name: str, mark_name: str, at: float = None):
+        """Records a stage of the character's current turn, keeping only the first time each stage happens.
+
+        Args:
+            character_name (str): The character whose turn it is.
+            mark_name (str): The stage, EG: "first_token", "first_audio", or "turn_end".
+            at (float, optional): When it happened, defaults to now.
+        """
+        if at is None:
+            at = time.monotonic()
+        with self.lock:
+            marks = self.current_marks.get(character_name, None)
+            if marks is not None:
+                marks.setdefault(mark_name, at)
+
+    def playback_started(self, at: float):
+        """Records audio starting to play, which shouldn't happen after the characters were talked over."""
+        with self.lock:
+            if self.barge_in_pressed_at is not None:
+                self.late_playbacks += 1
+
+    def playback_stopped(self, at: float):
+        """Records the audio being stopped."""
+        with self.lock:
+            if self.barge_in_pressed_at is not None and self.barge_in_silent_at is None:
+                self.barge_in_silent_at = at
+
+    def start_barge_in(self, at: float):
+        """Records the mic key being pressed to talk over the characters.
+
+        Args:
+            at (float): When it was pressed.
+        """
+        with self.lock:
+            self.barge_in_pressed_at = at
+            self.barge_in_silent_at = None
+            self.late_playbacks = 0
+
+    def finish_barge_in(self, character_count: int):
+        """Stores how long the characters took to go quiet, and whether any audio started afterwards.
+
+        Args:
+            character_count (int): How many characters were in the scene.
+        """
+        with self.lock:
+            self.completed_barge_ins.append(
+                {
+                    "characters": character_count,
+                    "silence": (
+                        None
+                        if self.barge_in_silent_at is None
+                        else self.barge_in_silent_at - self.barge_in_pressed_at
+                    ),
+                    "late_playbacks": self.late_playbacks,
+                }
+            )
+            self.barge_in_pressed_at = None
+
+    def latest_mark(self, mark_name: str) -> float:
+        """Returns the latest time any character reached the given stage in the current scene, or None."""
+        with self.lock:
+            times = [
+                marks[mark_name]
+                for marks in self.current_marks.values()
+                if mark_name in marks
+            ]
+        return max(times) if times else None
+
+    def finish_scene(self, character_count: int):
+        """Stores the current scene's turns as durations from the prompt.
+
+        Args:
+            character_count (int): How many characters were in the scene.
+        """
+        with self.lock:
+            for character_name, marks in self.current_marks.items():
+                prompt_time = marks["prompt"]
+                self.completed_turns.append(
+                    {
+                        "characters": character_count,
+                        "character": character_name,
+                        **{
+                            name: at - prompt_time
+                            for name, at in marks.items()
+                            if name != "prompt"
+                        },
+                    }
+                )
+            self.current_marks = {}
+
+
+class StubChatCompletions:
+    """Stands in for AsyncOpenAI's client.chat.completions for one character."""
+
+    def __init__(
+        self, character_name: str, latency: StubLatency, recorder: LatencyRecorder
+    ):
+        self.character_name = character_name
+        self.latency = latency
+        self.recorder = recorder
+
+    async def create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        """Returns a completion (or a stream of chunks) after the configured latency."""
+        text = self.latency.response_text()
+        await asyncio.sleep(self.latency.llm_first_token_sample())
+        tokens = [f"{word} " for word in text.split(" ")]
+        seconds_per_token = 1 / self.latency.llm_tokens_per_second
+        if stream:
+            return StubStream(self.stream(tokens, seconds_per_token))
+
+        await asyncio.sleep(self.latency.sample(seconds_per_token * len(tokens)))
+        # without streaming the first token arrives with the rest of them
+        self.recorder.mark(self.character_name, "first_token")
+        message = SimpleNamespace(role="assistant", content=text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    async def stream(self, tokens: list[str], seconds_per_token: float):
+        """Yields one chunk per token."""
+        for index, token in enumerate(tokens):
+            if index == 0:
+                self.recorder.mark(self.character_name, "first_token")
+            else:
+                await asyncio.sleep(self.latency.sample(seconds_per_token))
+            delta = SimpleNamespace(
+                role="assistant" if index == 0 else None, content=token
+            )
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=delta, finish_reason=None)]
+            )
+
+
+class StubStream:
+    """Stands in for AsyncOpenAI's stream of chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __aiter__(self):
+        return self.chunks.__aiter__()
+
+    async def close(self):
+        """Stops the stream early."""
+        await self.chunks.aclose()
+
+
+class StubOpenAI:
+    """Stands in for the AsyncOpenAI client used by a single character."""
+
+    def __init__(
+        self, character_name: str, latency: StubLatency, recorder: LatencyRecorder
+    ):
+        self.chat = SimpleNamespace(
+            completions=StubChatCompletions(character_name, latency, recorder)
+        )
+
+
+class StubElevenLabs:
+    """Stands in for the ElevenLabs client's voices and convert_with_timestamps."""
+
+    def __init__(
+        self, voice_to_character: dict, latency: StubLatency, recorder: LatencyRecorder
+    ):
+        """Initializes the stand-in.
+
+        Args:
+            voice_to_character (dict): Voice name -> the name of the character using it.
+            latency (StubLatency): The latency profile.
+            recorder (LatencyRecorder): Where to record stages of the turn.
+        """
+        self.latency = latency
+        self.recorder = recorder
+        self.voice_id_to_character = {}
+        voices = []
+        for index, (voice_name, character_name) in enumerate(
+            voice_to_character.items()
+        ):
+            voice_id = f"voice{index}"
+            self.voice_id_to_character[voice_id] = character_name
+            voices.append(SimpleNamespace(name=voice_name, voice_id=voice_id))
+        self.voices = SimpleNamespace(
+            get_all=lambda: SimpleNamespace(voices=voices),
+            get_settings=lambda voice_id: None,
+        )
+        self.text_to_speech = SimpleNamespace(
+            convert_with_timestamps=self.convert_with_timestamps
+        )
+
+    def convert_with_timestamps(self, text: str, voice_id: str, **kwargs):
+        """Returns audio of the configured size with evenly spaced character timestamps after the configured latency.
+
+        The audio names the character speaking, so playback can be attributed to them.
+        """
+        time.sleep(
+            self.latency.sample(
+                self.latency.tts_first_audio_seconds
+                + self.latency.elevenlabs_extra_seconds
+            )
+        )
+        character_name = self.voice_id_to_character.get(voice_id, "")
+        audio = stub_audio(character_name, self.latency.audio_kilobytes)
+        playback_seconds = self.latency.playback_seconds * self.latency.scale
+        seconds_per_character = playback_seconds / max(1, len(text))
+        alignment = SimpleNamespace(
+            characters=list(text),
+            character_start_times_seconds=[
+                index * seconds_per_character for index in range(len(text))
+            ],
+            character_end_times_seconds=[
+                (index + 1) * seconds_per_character for index in range(len(text))
+            ],
+        )
+        return SimpleNamespace(
+            audio_base_64=base64.b64encode(audio).decode("utf-8"),
+            alignment=alignment,
+        )
+
+
+class StubAudioManager:
+    """Stands in for AudioManager, recording when playback starts and when it would end."""
+
+    def __init__(self, latency: StubLatency, recorder: LatencyRecorder):
+        self.latency = latency
+        self.recorder = recorder
+
+    def play_audio(
+        self,
+        file_path: str,
+        sleep_during_playback: bool = True,
+        cancellation_token=None,
+        **kwargs,
+    ):
+        """Records the start of playback for the character named at the start of the audio."""
+        if cancellation_token is not None:
+            cancellation_token.raise_if_cancelled()
+        character_name = speaker_of(file_path)
+        now = time.monotonic()
+        self.recorder.playback_started(now)
+        playback_seconds = self.latency.playback_seconds * self.latency.scale
+        self.recorder.mark(character_name, "first_audio", at=now)
+        self.recorder.mark(character_name, "turn_end", at=now + playback_seconds)
+        if sleep_during_playback:
+            time.sleep(playback_seconds)
+
+    def stop(self):
+        """Records the audio being stopped."""
+        self.recorder.playback_stopped(time.monotonic())
+
+
+class StubAzureConnectionsManager:
+    """Stands in for AzureConnectionsManager's speech to text and in memory text to speech."""
+
+    backend_name = "azure"
+
+    def __init__(
+        self, voice_to_character: dict, latency: StubLatency, recorder: LatencyRecorder
+    ):
+        """Initializes the stand-in.
+
+        Args:
+            voice_to_character (dict): Azure voice name -> the name of the character using it.
+            latency (StubLatency): The latency profile.
+            recorder (LatencyRecorder): Where to record stages of the turn.
+        """
+        self.voice_to_character = voice_to_character
+        self.latency = latency
+        self.recorder = recorder
+        self.transcript = "What should we do next?"
+        # when the user said the last word of the transcript, from time.monotonic()
+        self.speech_ended_at: float = None
+
+    def start_speechtotext_from_mic(self, commander_gpt=None, on_transcript=None):
+        """Starts recognition immediately, with the user saying the transcript a word at a time on another thread.
+
+        Args:
+            commander_gpt (HeadlessApp, optional): Unused, the subtitles aren't drawn.
+            on_transcript (callable, optional): Called with the partial results as each word is said, then the final result.
+        """
+        self.speech_ended_at = None
+        threading.Thread(target=self.talk, args=(on_transcript,), daemon=True).start()
+
+    def talk(self, on_transcript=None):
+        """Says the transcript a word at a time, like partial results, then gives the final result with its punctuation after the finalization latency.
+
+        Args:
+            on_transcript (callable, optional): Called with everything recognized so far.
+        """
+        words = self.transcript.rstrip("?!.").lower().split()
+        for index in range(len(words)):
+            # scaled like the hands free mode's delays, so it doesn't think each pause between words is the end
+            time.sleep(self.latency.scale / self.latency.speech_words_per_second)
+            if on_transcript is not None:
+                on_transcript(" ".join(words[: index + 1]))
+        self.speech_ended_at = time.monotonic()
+        time.sleep(self.latency.sample(self.latency.stt_finalize_seconds))
+        if on_transcript is not None:
+            on_transcript(self.transcript)
+
+    def stop_speechtotext_from_mic(self) -> str:
+        """Returns the transcript after the configured finalization latency."""
+        time.sleep(self.latency.sample(self.latency.stt_finalize_seconds))
+        return self.transcript
+
+    def synthesize_with_word_boundaries(
+        self,
+        azure_voice_name: str,
+        azure_voice_style: str = "",
+        text_to_speak: str = "",
+        subdirectory: str = "",
+        turn_trace=None,
+        cancellation_token=None,
+    ):
+        """Saves audio after the configured latency and returns it with evenly spaced word timings, like synthesizing in memory.
+
+        The audio names the character speaking, so playback can be attributed to them.
+        Like Azure, synthesis stops as soon as the cancellation token is cancelled.
+        """
+        synthesis_seconds = self.latency.sample(self.latency.tts_first_audio_seconds)
+        if cancellation_token is None:
+            time.sleep(synthesis_seconds)
+        elif cancellation_token.wait(synthesis_seconds):
+            raise TurnCancelled()
+        character_name = self.voice_to_character.get(azure_voice_name, "")
+        tts_file = os.path.join(
+            os.path.abspath(os.curdir),
+            subdirectory,
+            f"___Msg{str(hash(text_to_speak))}{time.time()}_azure.wav",
+        )
+        with open(tts_file, "wb") as f:
+            f.write(stub_audio(character_name, self.latency.audio_kilobytes))
+        playback_seconds = self.latency.playback_seconds * self.latency.scale
+        words = text_to_speak.split(" ")
+        seconds_per_word = playback_seconds / max(1, len(words))
+        word_boundaries = []
+        text_offset = 0
+        for index, word in enumerate(words):
+            word_boundaries.append(
+                (text_offset, len(word), index * seconds_per_word, seconds_per_word)
+            )
+            text_offset += len(word) + 1
+        return (
+            SubtitleTimeline.from_word_boundaries(
+                text_to_speak, word_boundaries, playback_seconds
+            ),
+            tts_file,
+        )
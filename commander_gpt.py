@@ -1,24 +1,43 @@
 import tkinter as tk
 import tkinter.font as tkFont
-from tkinter import PhotoImage
-import threading
 import sys
-from ml.utils import (
-	read_config_file,
-	wait_until_key,
-	write_json_file,
-)
+from ml.utils import read_config_file
 from ml.azure_connections import AzureConnectionsManager
 from ml.eleven_labs import ElevenLabsManager
+from ml.audio_player import AudioManager
 from ml.ai_character import AICharacter
 from ml.twitch_bot import TwitchBot
+from ml.image_cache import ImageCache
+from ml.orchestrator import DialogueOrchestrator
+from ml.state_handoff import StateHandoff
+from ml.metrics import MetricsRecorder
+from ml.render_profiler import RenderProfiler
+from ml.http_clients import SharedHttpClients
+from ml.compositor import HeadlessCompositor
+from ml.frame_export import create_frame_exporter
+from ml.config_watcher import ConfigWatcher
+from ml.speech_to_text import create_speech_to_text
 
 from rich import print
 import time
 import math
-import re
 from elevenlabs import AudioWithTimestampsResponseModel
 
+CHARACTER_CONFIG_FILEPATH = "configs/character_config.json"
+SYSTEM_CONFIG_FILEPATH = "configs/system_config.json"
+# system_config.json settings applied without restarting when the file is edited
+LIVE_SYSTEM_CONFIG_KEYS = {
+	"llm_timeout_seconds",
+	"tts_timeout_seconds",
+	"activation_mode",
+	"twitch_digest_mode",
+	"twitch_digest_max_messages",
+	"subtitles",
+	"hands_free",
+	"tts_routing",
+	"config_reload",
+}
+
 
 class CommanderGPTApp:
 	def __init__(self, root, args):
@@ -28,16 +47,17 @@ class CommanderGPTApp:
 		Starts the main update loop.
 
 		Args:
-				root (tk.Tk): The root Tkinter window.
+				root (tk.Tk): The root Tkinter window, None when rendering headlessly.
 				args (list[str]): Command-line arguments, used to determine the character for the app. Expected [filename, character_name].
 		"""
 		self.init_configs(args)
 		self.init_libs()
 
 		self.init_visuals(root)
-		self.init_logic_threads()
-		# start updating main thread
-		self.update()
+		self.orchestrator.start()
+		# start updating main thread, when headless run_headless() renders instead
+		if not self.headless:
+			self.update()
 
 	def init_configs(self, args):
 		"""Initializes configuration settings for the app and create a character for each name provided.
@@ -52,14 +72,14 @@ class CommanderGPTApp:
 		self.token_config = read_config_file("configs/token_config.json")
 
 		# read character_config file
-		self.character_config = read_config_file("configs/character_config.json")
+		self.character_config = read_config_file(CHARACTER_CONFIG_FILEPATH)
 		if len(args) < 2:
 			exit(
 				"You must provide at least one character defined in character_config.json. EG: commander_gpt.py commander"
 			)
 
 		# read system configs
-		self.system_config = read_config_file("configs/system_config.json")
+		self.system_config = read_config_file(SYSTEM_CONFIG_FILEPATH)
 		self.window_width = self.system_config.get("window_width", 1280)
 		self.window_height = self.system_config.get("window_height", 1920)
 		self.background_colour = self.system_config.get("background_colour", "#00FF00")
@@ -69,13 +89,53 @@ class CommanderGPTApp:
 		self.enable_screenshot_toggle_key = self.system_config.get(
 			"enable_screenshot_toggle_key", "="
 		)
+		self.image_cache_max_megabytes = self.system_config.get(
+			"image_cache_max_megabytes", 256
+		)
+		# debug overlay and log of how long frames take to draw
+		self.render_profiler_config = self.system_config.get("render_profiler", {})
+		self.render_profiler_toggle_key = self.render_profiler_config.get(
+			"toggle_key", None
+		)
+		# render off-screen and export the frames instead of drawing to a window
+		self.headless_config = self.system_config.get("headless", {})
+		self.headless = self.headless_config.get("enabled", False)
+		# run the characters' turns in a session on the dialogue server, and only draw them and play their audio here
+		self.use_server = self.system_config.get("server_client", {}).get(
+			"enabled", False
+		)
+		# pick up edits to the configs without restarting, the server reads them when the session starts instead
+		config_reload_config = self.system_config.get("config_reload", {})
+		self.config_watcher: ConfigWatcher = None
+		if config_reload_config.get("enabled", False) and not self.use_server:
+			self.config_watcher = ConfigWatcher(
+				file_paths=[CHARACTER_CONFIG_FILEPATH, SYSTEM_CONFIG_FILEPATH],
+				interval_seconds=config_reload_config.get("interval_seconds", 1.0),
+			)
 		self.subtitles = None
-		self.last_characters_response = None
+		# state changes from the dialogue logic, applied on the Tk thread before each frame
+		self.state_handoff = StateHandoff()
+		# from 11labs, or a SubtitleTimeline from Azure
 		self.audio_with_timestamps: AudioWithTimestampsResponseModel = None
 		self.current_subtitile_timing: float = 0
 
+		# pooled connections to OpenAI and 11labs shared by every character
+		http_clients_config = self.system_config.get("http_clients", {})
+		self.http_clients = SharedHttpClients(
+			max_connections=http_clients_config.get("max_connections", 20),
+			max_keepalive_connections=http_clients_config.get(
+				"max_keepalive_connections", 10
+			),
+			keepalive_expiry_seconds=http_clients_config.get(
+				"keepalive_expiry_seconds", 120
+			),
+			http2=http_clients_config.get("http2", False),
+		)
+
 		# create characters for each one provided in args
 		self.ai_characters = []
+		# AICharacter -> their key in character_config.json, to find their config again when it's edited
+		self.character_config_keys = {}
 		for i in range(1, len(args)):
 			# get character based on name from command line args
 			character_config_key = args[i]
@@ -93,8 +153,10 @@ class CommanderGPTApp:
 				commander_gpt=self,
 				config=character_info,
 				chat_history_filepath=chat_history_filepath,
+				display_only=self.use_server,
 			)
 			self.ai_characters.append(ai_character)
+			self.character_config_keys[ai_character] = character_config_key
 
 		if len(self.ai_characters) > 1:
 			# if there is more than 1 AICharacter then tell them each about the others so they can communicate through shared history
@@ -105,9 +167,6 @@ class CommanderGPTApp:
 					if ai_character.name != other_ai_character.name:
 						ai_character.other_ai_characters.append(other_ai_character)
 
-		# whether the next message sent to an ai_character would include a screenshot or not
-		self.screen_shot_enabled = False
-
 		# Twitch configs
 		self.enable_twitch_integration = self.system_config.get(
 			"enable_twitch_integration", False
@@ -117,23 +176,108 @@ class CommanderGPTApp:
 			"twitch_chat_history_length", 50
 		)
 
+		# answer all chat messages from the last turn in one response instead of one at a time
+		self.twitch_digest_mode = self.system_config.get("twitch_digest_mode", False)
+		self.twitch_digest_max_messages = self.system_config.get(
+			"twitch_digest_max_messages", 10
+		)
+
 		self.twitch_access_token = self.token_config.get("twitch_access_token", None)
 		# User's subtitles
-		self.subtitles_config = self.system_config.get("subtitles", {})
-		self.show_subtitles = self.subtitles_config.get("show_subtitles", False)
-		self.user_text_color = self.subtitles_config.get("user_text_color", False)
-		self.text_outline_color = self.subtitles_config.get("text_outline_color", False)
-		self.text_outline_width = self.subtitles_config.get("text_outline_width", 2)
-		self.font_size = self.subtitles_config.get("font_size", 32)
-		self.subtitle_xpos = self.subtitles_config.get("xpos", 20)
-		self.subtitle_ypos = self.subtitles_config.get("ypos", 20)
-		self.subtitle_width = self.subtitles_config.get("width", 1280)
-
-		self.font = tkFont.Font(
-			family="assets/fonts/NotoSerifCJK-Regular.ttc",
-			size=self.font_size,
-			weight="bold",
+		vars(self).update(self.read_subtitles_config(self.system_config))
+
+	def read_subtitles_config(self, system_config: dict) -> dict:
+		"""Reads the settings for the user's subtitles.
+
+		Args:
+				system_config (dict): The contents of system_config.json.
+
+		Returns:
+				dict: The app's attribute names and their values.
+		"""
+		subtitles_config = system_config.get("subtitles", {})
+		return {
+			"subtitles_config": subtitles_config,
+			"show_subtitles": subtitles_config.get("show_subtitles", False),
+			"user_text_color": subtitles_config.get("user_text_color", False),
+			"text_outline_color": subtitles_config.get("text_outline_color", False),
+			"text_outline_width": subtitles_config.get("text_outline_width", 2),
+			"font_size": subtitles_config.get("font_size", 32),
+			"subtitle_xpos": subtitles_config.get("xpos", 20),
+			"subtitle_ypos": subtitles_config.get("ypos", 20),
+			"subtitle_width": subtitles_config.get("width", 1280),
+		}
+
+	def reload_config(self, file_path: str, config: dict):
+		"""Applies an edited config file while the app runs.
+		Called by the config watcher off the Tk thread.
+
+		Args:
+				file_path (str): The config file that was edited.
+				config (dict): Its new contents.
+		"""
+		if file_path == CHARACTER_CONFIG_FILEPATH:
+			self.character_config = config
+			ai_character: AICharacter
+			for (
+				ai_character,
+				character_config_key,
+			) in self.character_config_keys.items():
+				character_info = config.get(character_config_key, None)
+				if character_info is None:
+					print(
+						f"[red]\n{character_config_key} was removed from character_config.json, keeping their current config."
+					)
+					continue
+				ai_character.reload_config(character_info)
+		elif file_path == SYSTEM_CONFIG_FILEPATH:
+			self.reload_system_config(config)
+
+	def reload_system_config(self, system_config: dict):
+		"""Applies the settings in LIVE_SYSTEM_CONFIG_KEYS from an edited system_config.json, the rest need a restart.
+
+		Args:
+				system_config (dict): The new contents of system_config.json.
+		"""
+		changed_keys = sorted(
+			key
+			for key in system_config.keys() | self.system_config.keys()
+			if system_config.get(key, None) != self.system_config.get(key, None)
+		)
+		restart_keys = [
+			key for key in changed_keys if key not in LIVE_SYSTEM_CONFIG_KEYS
+		]
+		if restart_keys:
+			print(
+				f"[yellow]\nRestart the app to apply the changes to {restart_keys} in system_config.json."
+			)
+		changed_keys = [key for key in changed_keys if key in LIVE_SYSTEM_CONFIG_KEYS]
+		if not changed_keys:
+			return
+		# only take the settings that are applied now, so the config matches what's in effect
+		live_config = dict(self.system_config)
+		for key in changed_keys:
+			if key in system_config:
+				live_config[key] = system_config[key]
+			else:
+				live_config.pop(key, None)
+		system_config = live_config
+		self.system_config = system_config
+		self.orchestrator.apply_system_config(system_config)
+		self.twitch_digest_mode = system_config.get("twitch_digest_mode", False)
+		self.twitch_digest_max_messages = system_config.get(
+			"twitch_digest_max_messages", 10
 		)
+		if self.config_watcher is not None:
+			self.config_watcher.interval_seconds = system_config.get(
+				"config_reload", {}
+			).get("interval_seconds", 1.0)
+		if "subtitles" in changed_keys:
+			subtitle_changes = self.read_subtitles_config(system_config)
+			self.state_handoff.post(self, **subtitle_changes)
+			if subtitle_changes["font_size"] != self.font_size:
+				self.state_handoff.post_call(self.init_font)
+		print(f"[green]\nReloaded system_config.json, changed: {changed_keys}")
 
 	def init_libs(self):
 		"""Initializes the necessary libraries for the app.
@@ -141,14 +285,62 @@ class CommanderGPTApp:
 		Sets up the speech-to-text, OpenAI, ElevenLabs, and audio manager libraries with the respective API keys.
 		"""
 		print("[yellow]\nInit Libraries")
+		# timing of each stage of the dialogue pipeline
+		metrics_config = self.system_config.get("metrics", {})
+		enable_metrics = metrics_config.get("enabled", False)
+		self.metrics = MetricsRecorder(
+			spans_filepath=(
+				metrics_config.get("spans_filepath", "logs/turn_spans.jsonl")
+				if enable_metrics
+				else None
+			),
+			prometheus_port=(
+				metrics_config.get("prometheus_port", 9464) if enable_metrics else None
+			),
+		)
+		if self.use_server:
+			# only import aiohttp if the server is actually used
+			from ml.server_client import ServerClientOrchestrator
+
+			# runs the mic input on one event loop, sending the prompts and activations to the server
+			self.orchestrator = ServerClientOrchestrator(commander_gpt=self)
+		else:
+			# runs the mic input, activation queue, LLM calls, TTS, and twitch chat on one event loop
+			self.orchestrator = DialogueOrchestrator(commander_gpt=self)
 		# setup our libraries
+		# plays the audio from both 11labs and Azure
+		self.audio_manager = AudioManager()
 		self.elevenlabs_manager = None
 		ai_character: AICharacter
 		# if any of the characters need 11labs then create a manager for it, otherwise don't bother
 		for ai_character in self.ai_characters:
-			if ai_character.use_elevenlabs_voice and self.elevenlabs_manager is None:
+			if (
+				ai_character.use_elevenlabs_voice
+				and self.elevenlabs_manager is None
+				and not self.use_server
+			):
+				elevenlabs_api_key = self.token_config.get("elevenlabs_api_key", None)
 				self.elevenlabs_manager = ElevenLabsManager(
-					elevenlabs_api_key=self.token_config.get("elevenlabs_api_key", None)
+					elevenlabs_api_key=elevenlabs_api_key,
+					client=self.http_clients.elevenlabs_client(elevenlabs_api_key),
+					audio_manager=self.audio_manager,
+					voice_names=[
+						ai_character.elevenlabs_voice
+						for ai_character in self.ai_characters
+						if ai_character.use_elevenlabs_voice
+					],
+					voice_cache_filepath=self.system_config.get(
+						"elevenlabs_voice_cache_filepath",
+						"cache/elevenlabs_voices.json",
+					),
+					voice_cache_ttl_seconds=self.system_config.get(
+						"elevenlabs_voice_cache_ttl_hours", 24
+					)
+					* 60
+					* 60,
+					output_format=self.system_config.get(
+						"elevenlabs_output_format", "pcm_24000"
+					),
 				)
 				break
 
@@ -160,110 +352,199 @@ class CommanderGPTApp:
 				"speech_recognition_language", "en-US"
 			),
 		)
+		# Used for transcribing the mic to text, Azure's or a local model
+		try:
+			self.speech_recognizer = create_speech_to_text(
+				self.system_config.get("speech_to_text", {}), self.speechtotext_manager
+			)
+		except ValueError as e:
+			exit(e)
 
 		self.twitch_bot: TwitchBot = None
-		if self.twitch_channel_name:
+		if self.twitch_channel_name and not self.use_server:
 			self.twitch_bot = TwitchBot(
 				twitch_access_token=self.twitch_access_token,
 				twitch_channel_name=self.twitch_channel_name,
 				chat_history_length=self.twitch_chat_history_length,
+				character_names=[
+					ai_character.name for ai_character in self.ai_characters
+				],
+				user_cooldown_seconds=self.system_config.get(
+					"twitch_user_cooldown_seconds", 5.0
+				),
+				duplicate_window_seconds=self.system_config.get(
+					"twitch_duplicate_window_seconds", 30.0
+				),
+				first_time_chatter_bonus_seconds=self.system_config.get(
+					"twitch_first_time_chatter_bonus_seconds", 30.0
+				),
+				mention_bonus_seconds=self.system_config.get(
+					"twitch_mention_bonus_seconds", 60.0
+				),
+				loop=self.orchestrator.loop,
 			)
 
 	def init_visuals(self, root: tk.Tk):
 		"""Initializes the main window and canvas for visual display.
 
 		Sets up the root window size, title, and the canvas for drawing. Initializes the font used for text display.
+		When headless, sets up the off-screen compositor and where its frames are exported to instead.
 
 		Args:
-				root (tk.Tk): The root Tkinter window where the app will be displayed.
+				root (tk.Tk): The root Tkinter window where the app will be displayed, None when headless.
 		"""
-		print("[yellow]\nInit Main Window")
 		self.root = root
-		self.root.title("GPT")
-		self.root.geometry(f"{self.window_width}x{self.window_height}")
-		self.root.resizable = False
-		self.image_cache = {}
-		# Create a canvas to draw text with outline
-		self.canvas = tk.Canvas(
-			root,
-			width=self.window_width,
-			height=self.window_height,
-			bg=self.background_colour,
-			highlightthickness=0,
-		)
-		self.canvas.pack()
-
-	def init_logic_threads(self):
-		"""Initializes the main thread that will handle the connections to the AI endpoints.
-
-		Starts new threads that will terminate if the main process terminates.
-		The first thread handles user input.
-		The second thread handles the queue of characters who you activated to respond.
-		There is then a thread for each character who waits for their specific activation key to be pressed and add themselves to the queue.
-		The last thread just allows keyboard toggling of screenshots on or off.
-		"""
-		self.character_activation_queue = []
-		self.is_talking = False
-		# one thread to handle waiting on the mic input
-		handle_mic_input_thread = threading.Thread(
-			target=self.handle_mic_input, daemon=True
-		)
-		handle_mic_input_thread.start()
-		# thread to go through queue of activated characters and ask them the question
-		handle_activate_next_character_thread = threading.Thread(
-			target=self.activate_next_character, daemon=True
-		)
-		handle_activate_next_character_thread.start()
+		self.canvas = None
+		self.image_cache: ImageCache = None
+		self.compositor: HeadlessCompositor = None
+		self.frame_exporter = None
+		if self.headless:
+			print("[yellow]\nInit Headless Compositor")
+			self.compositor = HeadlessCompositor(
+				width=self.window_width, height=self.window_height
+			)
+			self.headless_frame_rate = self.headless_config.get("frame_rate", 30)
+			self.frame_exporter = create_frame_exporter(
+				output=self.headless_config.get("output", "image_sequence"),
+				width=self.window_width,
+				height=self.window_height,
+				path=self.headless_config.get("path", None),
+			)
+		else:
+			print("[yellow]\nInit Main Window")
+			self.root.title("GPT")
+			self.root.geometry(f"{self.window_width}x{self.window_height}")
+			self.root.resizable = False
+			# decoded images shared by all characters
+			self.image_cache = ImageCache(
+				max_decoded_bytes=self.image_cache_max_megabytes * 1024 * 1024
+			)
+			# Create a canvas to draw text with outline
+			self.canvas = tk.Canvas(
+				root,
+				width=self.window_width,
+				height=self.window_height,
+				bg=self.background_colour,
+				highlightthickness=0,
+			)
+			self.canvas.pack()
+		self.init_font()
+		self.render_profiler: RenderProfiler = None
+		if self.render_profiler_config.get("enabled", False):
+			self.render_profiler = RenderProfiler(
+				show_overlay=self.render_profiler_config.get("show_overlay", True),
+				log_filepath=self.render_profiler_config.get(
+					"log_filepath", "logs/render_profile.jsonl"
+				),
+				log_interval_seconds=self.render_profiler_config.get(
+					"log_interval_seconds", 5
+				),
+			)
 
-		# one thread per character to wait on being activated
-		# when activated they will add themselves to the queue to be asked the question recorded by the mic
+		# decode every character's images ahead of time so the first change of state doesn't stutter
+		image_paths = []
 		ai_character: AICharacter
 		for ai_character in self.ai_characters:
-			# Create thread to handle the AI stuff, they will terminate if the main process terminates
-			thread_chatgpt = threading.Thread(
-				target=self.handle_chatgpt,
-				daemon=True,
-				kwargs={"ai_character": ai_character},
-			)
-			# Start the thread
-			thread_chatgpt.start()
-
-			# Thread to respond to twitch chat messages if enabled
-			if self.enable_twitch_integration:
-				thread_twitch_chat = threading.Thread(
-					target=self.handle_twitch_chat_responses,
-					daemon=True,
-					kwargs={"ai_character": ai_character},
-				)
-				# Start the thread
-				thread_twitch_chat.start()
-		# thread to read twitch messages if enabled
-		if self.enable_twitch_integration:
-			thread_twitch_chat_monitor = threading.Thread(
-				target=self.handle_twitch_chat_monitor,
-				daemon=True,
+			image_paths.extend(ai_character.images_by_state.values())
+		self.preload_images(image_paths)
+
+	def init_font(self):
+		"""Creates the font for the user's subtitles, on the Tk thread."""
+		if self.compositor is not None:
+			self.font = self.compositor.font(self.font_size)
+		else:
+			self.font = tkFont.Font(
+				family="assets/fonts/NotoSerifCJK-Regular.ttc",
+				size=self.font_size,
+				weight="bold",
 			)
-			# Start the thread
-			thread_twitch_chat_monitor.start()
 
-		non_blocking_toggles = threading.Thread(
-			target=self.handle_non_blocking_toggles, daemon=True
-		)
+	def preload_images(self, file_paths: list[str]):
+		"""Decodes images ahead of time, on the Tk thread, so the first time each is shown doesn't stutter.
 
-		non_blocking_toggles.start()
+		Args:
+				file_paths (list[str]): The image files, the ones already decoded are skipped.
+		"""
+		if self.compositor is not None:
+			self.compositor.preload(file_paths=file_paths)
+		else:
+			self.image_cache.preload(root=self.root, file_paths=file_paths)
 
 	def update(self):
 		"""Periodically updates the visuals and interactions in the app.
 
 		This method calls the update_visuals method to refresh the display. It runs in a loop to keep updating until the app is closed.
 		"""
+		self.render_frame()
+
+		# Schedule the next update (every 10ms)
+		self.root.after(10, self.update)
+		if self.render_profiler is not None:
+			self.render_profiler.frame_scheduled(delay_seconds=0.01)
+
+	def run_headless(self):
+		"""Renders and exports frames at the configured frame rate until interrupted, EG: with Ctrl+C.
+
+		Frames that can't be rendered in time are skipped rather than rushed, so the exported frames stay evenly spaced.
+		"""
+		frame_seconds = 1 / self.headless_frame_rate
+		next_frame_time = time.monotonic()
+		# the frame's position in the timeline, counting the skipped ones
+		frame_number = 0
+		try:
+			while True:
+				self.render_frame(frame_number=frame_number)
+				next_frame_time += frame_seconds
+				frame_number += 1
+				now = time.monotonic()
+				if next_frame_time < now:
+					# skip the frames we've fallen behind on
+					skipped_frames = math.ceil((now - next_frame_time) / frame_seconds)
+					next_frame_time += skipped_frames * frame_seconds
+					frame_number += skipped_frames
+				delay = next_frame_time - now
+				if self.render_profiler is not None:
+					self.render_profiler.frame_scheduled(delay_seconds=delay)
+				time.sleep(delay)
+		except KeyboardInterrupt:
+			print("[yellow]\nStopping the headless renderer.")
+		finally:
+			self.frame_exporter.close()
+
+	def render_frame(self, frame_number: int = None):
+		"""Draws a single frame, on the canvas or with the compositor when headless, which then exports it.
+
+		Args:
+				frame_number (int, optional): The frame's position in the exported timeline, including any skipped frames. Defaults to the number of frames rendered.
+		"""
+		if self.render_profiler is not None:
+			self.render_profiler.frame_started()
+		# apply any state changes from the dialogue logic before drawing
+		self.state_handoff.apply_pending()
 		# determine how much time has past since the last update
 		now = time.monotonic()
 		# update visuals telling it how long it's been since an update
 		self.update_visuals(time=now)
+		if self.render_profiler is not None and self.render_profiler.show_overlay:
+			self.draw_render_profiler_overlay()
+		if self.compositor is not None:
+			frame = self.compositor.render()
+			if frame_number is None:
+				frame_number = self.compositor.frames
+			self.frame_exporter.write(
+				frame, frame_number, changed=self.compositor.frame_changed
+			)
 
-		# Schedule the next update (every 10ms)
-		self.root.after(10, self.update)
+		if self.render_profiler is not None:
+			if self.compositor is not None:
+				canvas_items = self.compositor.layer_count()
+				image_cache_stats = self.compositor.stats()
+			else:
+				canvas_items = len(self.canvas.find_all())
+				image_cache_stats = self.image_cache.stats()
+			self.render_profiler.frame_finished(
+				canvas_items=canvas_items, image_cache_stats=image_cache_stats
+			)
 
 	def update_visuals(self, time: int):
 		"""Updates the visuals on the canvas.
@@ -273,7 +554,10 @@ class CommanderGPTApp:
 		Args:
 				time (int): The time given in seconds, always increases.
 		"""
-		self.canvas.delete("all")
+		if self.compositor is not None:
+			self.compositor.clear()
+		else:
+			self.canvas.delete("all")
 		# type hint
 		ai_character: AICharacter
 		# for each character draw them on the screen in their current state
@@ -284,15 +568,37 @@ class CommanderGPTApp:
 				or not ai_character.hide_character_when_idle
 			):
 				if ai_character.state == "talking":
-					offset_y = (
-						ai_character.image_offset_y
-						+ ai_character.max_amplitude
-						+ (
-							math.sin(time * ai_character.movement_speed)
-							* ai_character.max_amplitude
-						)
-					)
 					character_image = ai_character.voice_image
+					loudness_envelope = ai_character.loudness_envelope
+					if (
+						ai_character.audio_driven_animation
+						and loudness_envelope is not None
+					):
+						# look up how loud the voice is at the current playback position
+						loudness = loudness_envelope.level(
+							time - self.current_subtitile_timing
+						)
+						offset_y = (
+							ai_character.image_offset_y
+							+ 2 * ai_character.max_amplitude * loudness
+						)
+						if (
+							loudness >= ai_character.mouth_open_threshold
+							and character_image
+							== ai_character.images_by_state.get("talking")
+						):
+							character_image = ai_character.images_by_state.get(
+								"mouth_open", character_image
+							)
+					else:
+						offset_y = (
+							ai_character.image_offset_y
+							+ ai_character.max_amplitude
+							+ (
+								math.sin(time * ai_character.movement_speed)
+								* ai_character.max_amplitude
+							)
+						)
 					self.show_image(
 						character_image,
 						offset_y=offset_y,
@@ -308,11 +614,7 @@ class CommanderGPTApp:
 
 		# draw user's subtitles from the mic input
 		subtitles_to_show: str = None
-		if (
-			self.audio_with_timestamps
-			and ai_character.use_elevenlabs_voice
-			and ai_character.show_subtitles
-		):
+		if self.audio_with_timestamps and ai_character.show_subtitles:
 			subtitle_time = time - self.current_subtitile_timing
 			subtitles_to_show = ""
 			# get the subtitles for the current time
@@ -380,6 +682,32 @@ class CommanderGPTApp:
 					outline_width=self.text_outline_width,
 				)
 
+	def draw_render_profiler_overlay(self):
+		"""Draws the render profiler's latest frame timings in the top left corner, on top of everything else."""
+		if self.compositor is not None:
+			self.compositor.draw_text(
+				10,
+				10,
+				text=self.render_profiler.overlay_text(),
+				text_color="white",
+				outline_color="black",
+				width=self.window_width,
+				font=self.compositor.font(14),
+				outline_width=1,
+				anchor="nw",
+				justify="left",
+			)
+			return
+		self.canvas.create_text(
+			10,
+			10,
+			text=self.render_profiler.overlay_text(),
+			font="TkFixedFont",
+			fill="white",
+			anchor="nw",
+			justify="left",
+		)
+
 	def show_image(self, file_path: str, offset_y: int, ai_character: AICharacter):
 		"""Displays an image on the canvas.
 
@@ -396,10 +724,16 @@ class CommanderGPTApp:
 			if file_path is None:
 				return
 
-			image = self.image_cache.get(file_path, None)
-			if image is None:
-				image = PhotoImage(file=file_path)
-				self.image_cache[file_path] = image
+			if self.compositor is not None:
+				self.compositor.draw_image(
+					file_path,
+					ai_character.image_xpos,
+					ai_character.image_ypos + offset_y,
+					anchor=ai_character.image_alignment,
+				)
+				return
+
+			image = self.image_cache.get(file_path)
 
 			self.canvas.create_image(
 				ai_character.image_xpos,
@@ -434,8 +768,20 @@ class CommanderGPTApp:
 				text_color (str): The colour of the text.
 				outline_color (str): The colour of the text's outline.
 				width (int): The width of the text are it can be drawn to, given in pixels.
-				font (tkFont): The font face to use.
+				font (tkFont): The font face to use, or the compositor's font when headless.
 		"""
+		if self.compositor is not None:
+			self.compositor.draw_text(
+				xpos,
+				ypos,
+				text=text,
+				text_color=text_color,
+				outline_color=outline_color,
+				width=width,
+				font=font,
+				outline_width=outline_width,
+			)
+			return
 		# Draw outline text offset from where the actual text will be
 		for x_offset in range(-outline_width, outline_width + 1):
 			for y_offset in range(-outline_width, outline_width + 1):
@@ -461,290 +807,31 @@ class CommanderGPTApp:
 			justify="center",
 		)
 
-	def handle_mic_input(self):
-		"""Handles the mic input.
-		Wait for the mic activation key to be pressed.
-		Record the audio as text using Azure.
-		Stop recording when the activation key is pressed again.
-		"""
-		while True:
-			if self.is_talking:
-				continue
-			print(
-				f"[green]\nWaiting. Press {self.mic_activation_key} to start talking or the activation key for any character to hear them talk."
-			)
-			# Wait until user presses the mic_activation_key
-			wait_until_key(key_to_match=self.mic_activation_key)
-			self.is_talking = True
-
-			print(
-				f"[yellow]\nListening to mic. Press {self.mic_activation_key} again to stop talking."
-			)
-			# clear state of ALL characters if you start talking
-			ai_char: AICharacter
-			for ai_char in self.ai_characters:
-				ai_char.state = "listening"
-				ai_char.subtitles = None
-				# ensure to reset the user's name to the original configured one
-				ai_char.users_name = ai_char.original_users_name
-
-			# get mic result
-			mic_result = self.speechtotext_manager.speechtotext_from_mic_continuous(
-				stop_key=self.mic_activation_key, commander_gpt=self
-			)
-			self.subtitles = mic_result
-			self.last_characters_response = mic_result
-			print("[green]\nDone listening to mic.")
-			self.is_talking = False
-
-	def activate_character(self, ai_character: AICharacter):
-		"""Activates a given AI Character by adding them to the queue.
-		Will only add them to the queue if the user is not actively recording from the mic.
-
-		Args:
-				ai_character (AICharacter): The AI Character to activate.
-		"""
-		if self.is_talking:
-			print(
-				f"[red]\nMic is active, cannot activate character. Stop talking by pressing {self.mic_activation_key} again."
-			)
-			return
-		# queue up the given character
-		if ai_character not in self.character_activation_queue:
-			self.character_activation_queue.append(ai_character)
-
-	def activate_next_character(self):
-		"""Handles activating each character in the queue one at a time.
-		Characters are given the most recent prompt, and it is then sent to OpenAI to generate a response.
-		The character's response is then fed into the TTS configured for that character.
-		Lastly the returned audio is played.
-		It does this for each character in the queue, in the order they were added.
-		"""
-		while True:
-			if len(self.character_activation_queue) > 0:
-				# first entry in the queue
-				ai_character: AICharacter
-				ai_character = self.character_activation_queue.pop(0)
-
-				print(
-					f"[green]\n---\nStart processing dialogue for {ai_character.name}.\n---"
-				)
-				ai_character.state = "thinking"
-
-				# determine if screenshots are enabled, if so what monitor to screenshot
-				# -1 means it will not send one in this case
-				monitor_number = -1
-				if self.screen_shot_enabled:
-					monitor_number = ai_character.monitor_to_screenshot
-
-				# send question to openai
-				openai_result = ai_character.openai_manager.chat_with_history(
-					ai_character=ai_character,
-					prompt=self.last_characters_response,
-					monitor_to_screenshot=monitor_number,
-					max_history_length_messages=ai_character.max_history_length_messages,
-					model=ai_character.openai_model_name,
-					other_ai_characters=ai_character.other_ai_characters,
-				)
-				ai_character.subtitles = None
-				if openai_result is None:
-					print(
-						"[red]\nThe AI had nothing to say or something went wrong, if you simply pressed the key too early press it again."
-					)
-					ai_character.state = "error"
-					continue
-
-				if (
-					ai_character.message_replacements is not None
-					and openai_result is not None
-				):
-					for replacement_info in ai_character.message_replacements:
-						to_replace = replacement_info.get("to_replace", None)
-						replace_with = replacement_info.get("replace_with", None)
-						if to_replace and replace_with:
-							openai_result = openai_result.replace(
-								to_replace, replace_with
-							)
-
-				# write the results to chat_history as a backup
-				write_json_file(
-					ai_character.chat_history_filepath,
-					ai_character.openai_manager.chat_history,
-				)
-				# hide any mic input shown on screen
-				self.subtitles = None
-				self.last_characters_response = openai_result
-
-				# submit to 11labs to get audio
-				if ai_character.use_elevenlabs_voice:
-					print("convert text to audio and play it")
-					ai_character.voice_style = None
-					# generic talking by default
-					ai_character.voice_image = ai_character.images_by_state.get(
-						"talking"
-					)
-					self.current_subtitile_timing = time.monotonic()
-					self.audio_with_timestamps = (
-						self.elevenlabs_manager.text_to_audio_with_timestamps(
-							ai_character=ai_character,
-							input_text=openai_result,
-							voice=ai_character.elevenlabs_voice,
-							save_as_wave=True,
-							subdirectory="assets/audio",
-							model_id=ai_character.elevenlabs_model_id,
-						)
-					)
-				else:
-					# Using Azure TTS
-
-					# play the audio
-					print("play audio using azure tts")
-					ai_character.voice_style = None
-					# generic talking by default
-					ai_character.voice_image = ai_character.images_by_state.get(
-						"talking"
-					)
-					# Azure TTS support more voice styles, so use those images if they exist
-					if openai_result.startswith("(") and ")" in openai_result:
-						for prefix in ai_character.supported_prefixes:
-							if openai_result.startswith(prefix):
-								ai_character.voice_style = (
-									ai_character.supported_prefixes.get(prefix, None)
-								)
-
-								voice_image_file_name = prefix.replace("(", "").replace(
-									")", ""
-								)
-								ai_character.voice_image = (
-									ai_character.images_by_state.get(
-										voice_image_file_name,
-										ai_character.images_by_state.get("error"),
-									)
-								)
-								openai_result = openai_result.removeprefix(prefix)
-
-					ai_character.state = "talking"
-					# while this character talks, the others listen
-					other_ai_character: AICharacter
-					for other_ai_character in ai_character.other_ai_characters:
-						other_ai_character.state = "listening"
-						other_ai_character.subtitles = None
-
-					# there are other characters we could potentially trigger
-					trigger_pattern = re.compile("\[trigger\](.*?)\[\/trigger\]")
-					if (
-						openai_result is not None
-						and ai_character.other_ai_characters is not None
-					):
-						# find if the AI wants to trigger any other characters
-						find_triggers = re.findall(trigger_pattern, openai_result)
-						if len(find_triggers) > 0:
-							for character_name in find_triggers:
-								# as long as the name is valid
-								if character_name is not None:
-									# trigger the character specified based on their name
-									for (
-										other_ai_character
-									) in ai_character.other_ai_characters:
-										# if the name matches another character in the scene
-										if other_ai_character.name == character_name:
-											# add them to the queue to talk next
-											self.activate_character(other_ai_character)
-											break
-							# Remove all instances of [trigger]NAME[/trigger]
-							openai_result = re.sub(trigger_pattern, "", openai_result)
-
-					ai_character.voice_color = ai_character.character_text_color
-					ai_character.subtitles = openai_result
-
-					self.speechtotext_manager.texttospeech_from_text(
-						azure_voice_name=ai_character.azure_voice_name,
-						azure_voice_style=ai_character.voice_style,
-						text_to_speak=openai_result,
-					)
-
-					ai_character.state = "idle"
-					# if we hide the character then also hide the subtitles when they're done
-					if ai_character.hide_character_when_idle:
-						ai_character.subtitles = None
-
-				print(
-					f"[green]\n---\nFinished processing dialogue for {ai_character.name}.\n---\n"
-				)
-				if len(self.character_activation_queue) <= 0:
-					print(
-						f"[green]\n---\nFinished processing queue, press {self.mic_activation_key} to talk again.\n---\n"
-					)
-			time.sleep(0.5)
-
-	def handle_chatgpt(self, ai_character: AICharacter):
-		"""Listens for the character's activation key is pressed and adds them to the queue to respond.
-
-		Args:
-				ai_character (AICharacter): The AI Character to monitor.
-		"""
-		print(
-			f"[green]\nStarting the loop for {ai_character.name}, press num {ai_character.activation_key} to begin"
-		)
-		while True:
-			print(f"[green]\n{ai_character.name} is waiting.")
-			# wait for them to be activated
-			wait_until_key(key_to_match=ai_character.activation_key)
-			print(f"[yellow]\n{ai_character.name} has been queued up to talk.")
-			self.activate_character(ai_character)
-
-	def handle_twitch_chat_responses(self, ai_character: AICharacter):
-		while True:
-			# if user is talking through their mic we won't respond to twitch chat
-			if self.is_talking:
-				continue
-			# we will only respond to twitch chat if we're idle
-			if ai_character.state != "idle":
-				continue
-			# there's a queue of characters talking already so don't respond to chat
-			if len(self.character_activation_queue) > 0:
-				continue
-
-			# get mic result
-			twitch_message = self.twitch_bot.pick_random_message(
-				ai_character=ai_character, remove_after=True
-			)
-			# only respond if there's a message
-			if twitch_message is not None:
-				self.subtitles = twitch_message
-				self.last_characters_response = twitch_message
-				print(
-					f"[yellow]\n{ai_character.name} has been queued up to respond to twitch chat's message {twitch_message}'"
-				)
-				self.activate_character(ai_character)
-			else:
-				# only check once a second at most
-				time.sleep(1)
-
-	def handle_twitch_chat_monitor(self):
-		if self.enable_twitch_integration:
-			self.twitch_bot.run()
-
-	def handle_non_blocking_toggles(self):
-		"""Waits for a key to pressed and toggles enabling of sending screenshots."""
-		# only need to do this if we actually have screenshots enabled in configs
-		while True:
-			# Wait until user presses the enable_screenshot_toggle_key
-			wait_until_key(key_to_match=self.enable_screenshot_toggle_key)
-			self.screen_shot_enabled = not self.screen_shot_enabled
-			if self.screen_shot_enabled:
-				print("[green]\nScreenshot will be sent with your next message.")
-			else:
-				print("[yelow]\nYour next message will be text-only.")
-
 
 if __name__ == "__main__":
 	print(sys.argv)
-	# Create the main window (root)
-	root = tk.Tk()
+	headless = (
+		read_config_file("configs/system_config.json")
+		.get("headless", {})
+		.get("enabled", False)
+	)
+	# Create the main window (root), headless rendering doesn't need one (or a display)
+	root = None if headless else tk.Tk()
 
 	# Initialize the app
 	app = CommanderGPTApp(root=root, args=sys.argv)
 
 	# Run the application
-	root.mainloop()
+	if headless:
+		app.run_headless()
+		app.compositor.print_stats()
+	else:
+		root.mainloop()
+		app.image_cache.print_stats()
+	for ai_character in app.ai_characters:
+		if ai_character.response_cache is not None:
+			ai_character.response_cache.print_stats(
+				prefix=f"{ai_character.name}'s response cache"
+			)
+	if app.render_profiler is not None:
+		app.render_profiler.print_stats()
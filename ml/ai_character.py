@@ -1,30 +1,67 @@
 from .utils import (
     read_config_file,
 )
+from .chat_message import ChatMessage
+from .long_term_memory import EMBEDDERS, LongTermMemory, memory_filepath
 from .openai_chat import OpenAiManager
+from .response_cache import ResponseCache
+from .response_filter import ResponseFilter
 
 from rich import print
 from os.path import exists
 import tkinter.font as tkFont
-from transformers import AutoTokenizer, AutoModelForCausalLM
+
+# what the character is doing right now, and the objects reload_config only replaces when their own settings change
+RELOAD_KEPT_ATTRIBUTES = {
+    "character_info",
+    "commander_gpt",
+    "other_ai_characters",
+    "users_name",
+    "response_cache",
+    "long_term_memory",
+    "response_filter",
+    "_font",
+    "state",
+    "subtitles",
+    "voice_style",
+    "voice_image",
+    "voice_color",
+    "loudness_envelope",
+    "image_offset_y",
+    "movement_speed",
+}
 
 
 class AICharacter:
     """Representation of an AI Character."""
 
-    def __init__(self, commander_gpt, config: dict, chat_history_filepath: str):
+    def __init__(
+        self,
+        commander_gpt,
+        config: dict,
+        chat_history_filepath: str,
+        display_only: bool = False,
+    ):
         """Initializes the OpenAiManager with an API key for OpenAI access.
 
         Args:
             commander_gpt (CommanderGPTApp): The commander gpt app.
             config (dict): A dictionary of configs specific to this character.
             chat_history_filepath (str): The path to where this character should store its history.
+            display_only (bool, optional): Only read the config, for drawing a character whose turns run on a server. Their model, response cache, memory, and chat history aren't loaded. Defaults to False.
         """
         self.character_info = config
         self.commander_gpt = commander_gpt
         self.chat_history_filepath = chat_history_filepath
 
         self.init_configs()
+        if display_only:
+            self.response_cache = None
+            self.long_term_memory = None
+            self.openai_manager = None
+            return
+        self.response_cache = self.create_response_cache()
+        self.long_term_memory = self.create_long_term_memory()
         self.init_libs()
         self.init_chat_history()
 
@@ -42,6 +79,19 @@ class AICharacter:
 
         # what model to use with openai
         self.openai_model_name = self.character_info.get("openai_model_name", "gpt-4o")
+        # how long to wait on openai, and what to ask instead when it's slow
+        llm_deadlines_config = self.character_info.get("llm_deadlines", {})
+        self.first_token_deadline_seconds = llm_deadlines_config.get(
+            "first_token_deadline_seconds", 0
+        )
+        self.hedge_model_name = llm_deadlines_config.get(
+            "hedge_model_name", self.openai_model_name
+        )
+        self.hedge_base_url = llm_deadlines_config.get("hedge_base_url", None)
+        self.request_timeout_seconds = llm_deadlines_config.get(
+            "request_timeout_seconds", 60
+        )
+        self.max_retries = llm_deadlines_config.get("max_retries", 2)
 
         # 11labs configs
         self.use_elevenlabs_voice = self.character_info.get(
@@ -81,6 +131,20 @@ class AICharacter:
             "restore_previous_history", False
         )
 
+        # reuse responses to repeated prompts, EG: common questions from twitch chat
+        self.response_cache_config = self.character_info.get("response_cache", {})
+
+        # remember what was trimmed from the chat history, and bring the relevant parts back into prompts
+        self.long_term_memory_config = self.character_info.get("long_term_memory", {})
+        embedder = self.long_term_memory_config.get("embedder", "hashing")
+        if (
+            self.long_term_memory_config.get("enabled", False)
+            and embedder not in EMBEDDERS
+        ):
+            exit(
+                f"Unknown long term memory embedder {embedder}, expected one of {EMBEDDERS}."
+            )
+
         self.visuals_config = self.character_info.get("visuals", {})
 
         # subtitles configs
@@ -96,11 +160,8 @@ class AICharacter:
         self.subtitle_ypos = self.subtitles_config.get("ypos", 20)
         self.subtitle_width = self.subtitles_config.get("width", 1280)
 
-        self.font = tkFont.Font(
-            family="assets/fonts/NotoSerifCJK-Regular.ttc",
-            size=self.font_size,
-            weight="bold",
-        )
+        # created the first time it is drawn, since fonts need a Tk window to exist
+        self._font = None
 
         # character visuals configs
         self.hide_character_when_idle = self.visuals_config.get(
@@ -111,6 +172,11 @@ class AICharacter:
         self.image_ypos = self.visuals_config.get("image_ypos", 0)
 
         self.supported_prefixes = self.visuals_config.get("supported_prefixes", {})
+        # the message replacements, triggers, and prefixes compiled once, to filter each response in one pass
+        self.response_filter = ResponseFilter(
+            message_replacements=self.message_replacements,
+            supported_prefixes=self.supported_prefixes,
+        )
         self.image_paths = self.visuals_config.get("images", {})
         self.image_azure_voice_style_root_path = self.visuals_config.get(
             "image_azure_voice_style_root_path", ""
@@ -140,6 +206,11 @@ class AICharacter:
         self.max_amplitude = self.visuals_config.get("max_amplitude", 5)
         self.max_movement_speed = self.visuals_config.get("move_speed", 5)
         self.movement_speed = self.max_movement_speed
+        # bob (and open the mouth) with the loudness of the voice, instead of at a fixed pace
+        self.audio_driven_animation = self.visuals_config.get(
+            "audio_driven_animation", True
+        )
+        self.mouth_open_threshold = self.visuals_config.get("mouth_open_threshold", 0.3)
 
         # global state
         self.state = "idle"
@@ -147,6 +218,50 @@ class AICharacter:
         self.voice_style = None
         self.voice_image = None
         self.voice_color = "white"
+        # LoudnessEnvelope of the audio being spoken
+        self.loudness_envelope = None
+
+    @property
+    def font(self) -> tkFont.Font:
+        """The font used to draw this character's subtitles, the compositor's when rendering headlessly."""
+        if self._font is None and self.commander_gpt.compositor is not None:
+            self._font = self.commander_gpt.compositor.font(self.font_size)
+        if self._font is None:
+            self._font = tkFont.Font(
+                family="assets/fonts/NotoSerifCJK-Regular.ttc",
+                size=self.font_size,
+                weight="bold",
+            )
+        return self._font
+
+    def create_response_cache(self) -> ResponseCache:
+        """Returns a new response cache, or None if it's not enabled."""
+        if not self.response_cache_config.get("enabled", False):
+            return None
+        return ResponseCache(
+            max_entries=self.response_cache_config.get("max_entries", 200),
+            ttl_seconds=self.response_cache_config.get("ttl_seconds", 3600),
+            context_messages=self.response_cache_config.get("context_messages", 0),
+        )
+
+    def create_long_term_memory(self) -> LongTermMemory:
+        """Returns the long term memory, reading its saved index, or None if it's not enabled."""
+        if not self.long_term_memory_config.get("enabled", False):
+            return None
+        return LongTermMemory(
+            index_filepath=self.long_term_memory_config.get(
+                "index_filepath", memory_filepath(self.chat_history_filepath)
+            ),
+            embedder=self.long_term_memory_config.get("embedder", "hashing"),
+            embedding_model_name=self.long_term_memory_config.get(
+                "embedding_model_name", "sentence-transformers/all-MiniLM-L6-v2"
+            ),
+            top_k=self.long_term_memory_config.get("top_k", 3),
+            min_similarity=self.long_term_memory_config.get("min_similarity", 0.25),
+            max_snippet_characters=self.long_term_memory_config.get(
+                "max_snippet_characters", 400
+            ),
+        )
 
     def init_libs(self):
         """Initializes libraries unique to this character.
@@ -154,18 +269,35 @@ class AICharacter:
         Creates an OpenAIManager to communicate with chatGPT.
         """
         if self.local_model_name:
+            # only import transformers (and torch) if a local model is actually used
+            from transformers import AutoTokenizer, AutoModelForCausalLM
+
             self.openai_manager = OpenAiManager(
                 openai_api_key=None,
                 local_model=AutoModelForCausalLM.from_pretrained(self.local_model_name),
                 local_tokenizer=AutoTokenizer.from_pretrained(self.local_model_name),
             )
         else:
+            openai_api_key = self.commander_gpt.token_config.get("openai_api_key", None)
+            http_clients = self.commander_gpt.http_clients
+            # every character shares the same pooled connections, with their own timeout and retries
+            client_options = {
+                "timeout": self.request_timeout_seconds,
+                "max_retries": self.max_retries,
+            }
+            hedge_client = None
+            if self.hedge_base_url:
+                hedge_client = http_clients.openai_client(
+                    openai_api_key, base_url=self.hedge_base_url
+                ).with_options(**client_options)
             self.openai_manager = OpenAiManager(
-                openai_api_key=self.commander_gpt.token_config.get(
-                    "openai_api_key", None
-                ),
+                openai_api_key=openai_api_key,
                 local_model=None,
                 local_tokenizer=None,
+                client=http_clients.openai_client(openai_api_key).with_options(
+                    **client_options
+                ),
+                hedge_client=hedge_client,
             )
 
     def init_chat_history(self):
@@ -177,11 +309,13 @@ class AICharacter:
         try:
             if self.restore_previous_history and exists(self.chat_history_filepath):
                 # read the existing file and use it
-                self.openai_manager.chat_history = read_config_file(
-                    self.chat_history_filepath
-                )
+                self.openai_manager.chat_history = [
+                    ChatMessage.from_dict(message)
+                    for message in read_config_file(self.chat_history_filepath)
+                ]
                 return
             else:
+                self.remember_previous_history()
                 file = open(self.chat_history_filepath, "w+")
                 file.write("")
         except Exception as e:
@@ -192,12 +326,138 @@ class AICharacter:
 
         # and enter the first system message if provided
         if self.first_system_message is not None:
-            first_system_message_stringified = "\n".join(
-                self.first_system_message["content"]
-            )
-            system_message_formated = {
-                "role": "system",
-                "content": [{"type": "text", "text": first_system_message_stringified}],
-            }
+            system_message_formated = self.system_message()
             print("first_system_message:", system_message_formated)
             self.openai_manager.chat_history.append(system_message_formated)
+
+    def remember_previous_history(self):
+        """Adds the chat history from the last time the app ran to the long term memory, if it's enabled, before the history is cleared."""
+        if self.long_term_memory is None or not exists(self.chat_history_filepath):
+            return
+        try:
+            previous_history = read_config_file(self.chat_history_filepath)
+        except Exception:
+            # an empty or unreadable file has nothing to remember
+            return
+        for message in previous_history:
+            self.long_term_memory.remember(ChatMessage.from_dict(message), self.name)
+        remembered_count = self.long_term_memory.flush()
+        print(
+            f"[yellow]\n{self.name} remembers {remembered_count} messages from their previous chat history."
+        )
+
+    def system_message(self) -> ChatMessage:
+        """Returns the first system message, with the character's personality, for the chat history."""
+        first_system_message_stringified = "\n".join(
+            self.first_system_message["content"]
+        )
+        return ChatMessage("system", first_system_message_stringified, as_parts=True)
+
+    def reload_config(self, config: dict) -> list[str]:
+        """Applies an edited config to the live character, rebuilding only what the edit changed.
+
+        The chat history, the OpenAI or local model, the response cache, and decoded images are kept unless their own settings changed.
+        Changes are posted through the app's StateHandoff, so a frame never draws a half-applied config.
+        Should be called off the Tk thread, since loading a new local model or voice can take a while.
+
+        Args:
+            config (dict): The character's new entry from character_config.json.
+
+        Returns:
+            list[str]: The top level settings that changed.
+        """
+        changed_keys = sorted(
+            key
+            for key in config.keys() | self.character_info.keys()
+            if config.get(key, None) != self.character_info.get(key, None)
+        )
+        if not changed_keys:
+            return []
+
+        # read the edit into a scratch character first, so an invalid config never reaches the live one
+        reloaded = AICharacter.__new__(AICharacter)
+        reloaded.character_info = config
+        reloaded.commander_gpt = self.commander_gpt
+        reloaded.chat_history_filepath = self.chat_history_filepath
+        try:
+            reloaded.init_configs()
+        except SystemExit as e:
+            # init_configs exits on an invalid config, which is right at startup but not mid-stream
+            print(f"[red]\nIgnoring the edit to {self.name}'s config: {e}")
+            return []
+
+        changes = {
+            name: value
+            for name, value in vars(reloaded).items()
+            if name not in RELOAD_KEPT_ATTRIBUTES and getattr(self, name, None) != value
+        }
+        changes["character_info"] = config
+        if "original_users_name" in changes:
+            changes["users_name"] = reloaded.users_name
+        if reloaded.font_size != self.font_size:
+            # recreated on the Tk thread the next time it's drawn
+            changes["_font"] = None
+        if "response_cache" in changed_keys:
+            changes["response_cache"] = reloaded.create_response_cache()
+        if "long_term_memory" in changed_keys:
+            if self.long_term_memory is not None:
+                # save the messages trimmed since the last turn, before the new memory reads the index
+                self.long_term_memory.flush()
+            changes["long_term_memory"] = reloaded.create_long_term_memory()
+        if "message_replacements" in changed_keys or (
+            reloaded.supported_prefixes != self.supported_prefixes
+        ):
+            changes["response_filter"] = reloaded.response_filter
+
+        if reloaded.local_model_name != self.local_model_name:
+            print(f"[yellow]\nLoading {self.name}'s new model.")
+            reloaded.init_libs()
+            # the conversation so far carries over to the new model
+            reloaded.openai_manager.chat_history = self.openai_manager.chat_history
+            changes["openai_manager"] = reloaded.openai_manager
+        elif "llm_deadlines" in changed_keys and not reloaded.local_model_name:
+            # the clients are created with the timeout, retries, and hedge endpoint
+            reloaded.init_libs()
+            reloaded.openai_manager.chat_history = self.openai_manager.chat_history
+            changes["openai_manager"] = reloaded.openai_manager
+        chat_history = self.openai_manager.chat_history
+        if (
+            reloaded.first_system_message != self.first_system_message
+            and reloaded.first_system_message is not None
+        ):
+            if chat_history and chat_history[0].role == "system":
+                chat_history[0] = reloaded.system_message()
+            else:
+                chat_history.insert(0, reloaded.system_message())
+
+        elevenlabs_manager = self.commander_gpt.elevenlabs_manager
+        if reloaded.use_elevenlabs_voice and (
+            reloaded.elevenlabs_voice != self.elevenlabs_voice
+            or not self.use_elevenlabs_voice
+        ):
+            if elevenlabs_manager is None:
+                print(
+                    f"[red]\n{self.name} now uses 11labs, restart the app to connect to it. Keeping their previous voice until then."
+                )
+                for name in ("use_elevenlabs_voice", "elevenlabs_voice"):
+                    changes.pop(name, None)
+            else:
+                elevenlabs_manager.voice_catalog.resolve([reloaded.elevenlabs_voice])
+
+        # read before posting the changes, the Tk thread may apply them at any moment
+        previous_activation_key = self.activation_key
+        new_image_paths = set(reloaded.images_by_state.values()) - set(
+            self.images_by_state.values()
+        )
+        self.commander_gpt.state_handoff.post(self, **changes)
+        if "activation_key" in changes:
+            self.commander_gpt.orchestrator.rebind_activation_key(
+                self, previous_activation_key, reloaded.activation_key
+            )
+        if new_image_paths:
+            # decode the new images ahead of time, the ones already decoded are reused
+            self.commander_gpt.state_handoff.post_call(
+                self.commander_gpt.preload_images, sorted(new_image_paths)
+            )
+        print(f"[green]\nReloaded {self.name}'s config, changed: {changed_keys}")
+        return changed_keys
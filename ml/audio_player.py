@@ -1,14 +1,19 @@
 import pygame
 import time
 import os
-import subprocess
+import io
+import wave
 
 import pyaudio
 import soundfile as sf
 from mutagen.mp3 import MP3
 from rich import print
 
+from .cancellation import CancellationToken, TurnCancelled, raise_if_cancelled
+
 BUFFER_SIZE = 2048
+# the mixer's sample rate, TTS output is requested at or below this so it plays without converting
+MIXER_FREQUENCY = 48000
 
 
 class AudioManager:
@@ -25,10 +30,10 @@ class AudioManager:
     def __init__(self):
         """Initializes the Pygame mixer for audio playback.
 
-        This method sets the audio playback frequency to 48kHz and the buffer size to the predefined constant
+        This method sets the audio playback frequency to MIXER_FREQUENCY (48kHz) and the buffer size to the predefined constant
         `BUFFER_SIZE` to avoid audio glitches during playback.
         """
-        pygame.mixer.init(frequency=48000, buffer=BUFFER_SIZE)
+        pygame.mixer.init(frequency=MIXER_FREQUENCY, buffer=BUFFER_SIZE)
         return
 
     def play_audio(
@@ -37,6 +42,7 @@ class AudioManager:
         sleep_during_playback: bool = True,
         delete_file: bool = False,
         play_using_music: bool = True,
+        cancellation_token: CancellationToken = None,
     ):
         """Plays an audio file using Pygame's mixer.
 
@@ -45,65 +51,62 @@ class AudioManager:
             sleep_during_playback (bool, optional): Whether the program should wait for the length of the audio file before returning. Defaults to True.
             delete_file (bool, optional): Whether to delete the file after playback. Should not be used in multithreaded contexts. Defaults to False.
             play_using_music (bool, optional): If True, the audio will be played using Pygame's Music system (which only supports one file at a time). If False, it will use Pygame's Sound system to allow simultaneous playback of multiple sounds. Defaults to True.
+            cancellation_token (CancellationToken, optional): Doesn't start playing, or stops playing, when cancelled.
 
         Raises:
-            Exception: If the audio file format is incompatible with Pygame's Music system, the file will be converted to WAV format.
+            TurnCancelled: If the cancellation token was cancelled.
+
+        Notes:
+            - If the audio file format is incompatible with Pygame, it is decoded in memory and played from there instead.
         """
+        raise_if_cancelled(cancellation_token)
         if not pygame.mixer.get_init():  # Reinitialize mixer if needed
-            pygame.mixer.init(frequency=48000, buffer=BUFFER_SIZE)
+            pygame.mixer.init(frequency=MIXER_FREQUENCY, buffer=BUFFER_SIZE)
 
         if play_using_music:
             # Pygame Music can only play one file at a time
             try:
                 pygame.mixer.music.load(file_path)
-                pygame.mixer.music.play()
-                converted = False
             except Exception:
-                # Convert the file to a supported format if loading fails
-                converted_wav = "temp_convert.wav"
-                subprocess.run(
-                    [
-                        "ffmpeg",
-                        "-y",
-                        "-i",
-                        file_path,
-                        "-ar",
-                        "48000",
-                        "-ac",
-                        "2",
-                        "-c:a",
-                        "pcm_s16le",
-                        converted_wav,
-                    ]
-                )
-                converted = True
-                pygame.mixer.music.load(converted_wav)
-                pygame.mixer.music.play()
+                pygame.mixer.music.load(decode_to_wave(file_path), "wav")
+            pygame.mixer.music.play()
         else:
-            converted = False
             # Use Pygame Sound for simultaneous playback
-            pygame_sound = pygame.mixer.Sound(file_path)
+            try:
+                pygame_sound = pygame.mixer.Sound(file_path)
+            except Exception:
+                pygame_sound = pygame.mixer.Sound(file=decode_to_wave(file_path))
             pygame_sound.play()
+        if cancellation_token is not None and cancellation_token.cancelled:
+            # cancelled while loading the file, so it started after everything was stopped
+            self.stop()
+            raise TurnCancelled()
 
         if sleep_during_playback:
             # Sleep until the file is done playing
             file_length = self.get_audio_length(file_path)
-            time.sleep(file_length)
+            if cancellation_token is None:
+                time.sleep(file_length)
+            elif cancellation_token.wait(file_length):
+                self.stop()
+                raise TurnCancelled()
             # Delete the file if specified
             if delete_file:
                 pygame.mixer.music.stop()
                 pygame.mixer.quit()
                 try:
                     os.remove(file_path)
-                    if converted:
-                        os.remove(
-                            converted_wav
-                        )  # Remove the converted wav if it was created
                 except PermissionError:
                     print(
                         f"[red]\nCouldn't remove {file_path} because it is being used by another process."
                     )
 
+    def stop(self):
+        """Stops everything playing, EG: when the characters are interrupted."""
+        if pygame.mixer.get_init():
+            pygame.mixer.music.stop()
+            pygame.mixer.stop()
+
     def get_audio_length(self, file_path: str) -> float:
         """Calculates the length of an audio file based on its format.
 
@@ -128,3 +131,42 @@ class AudioManager:
             print("[red]\nUnknown audio file type. Returning 0 as file length")
             file_length = 0
         return file_length
+
+
+def write_wave_file(
+    pcm_audio: bytes,
+    file_path: str,
+    sample_rate: int,
+    channels: int = 1,
+    sample_width_bytes: int = 2,
+):
+    """Saves raw PCM audio as a .wav file, adding only a header so it plays without converting.
+
+    Args:
+        pcm_audio (bytes): Signed little-endian samples, EG: from 11labs' "pcm_24000" output format.
+        file_path (str): Where to save the .wav file.
+        sample_rate (int): The samples per second.
+        channels (int, optional): How many channels the samples are interleaved from. Defaults to 1.
+        sample_width_bytes (int, optional): The size of each sample. Defaults to 2 (16 bit).
+    """
+    with wave.open(file_path, "wb") as wave_file:
+        wave_file.setnchannels(channels)
+        wave_file.setsampwidth(sample_width_bytes)
+        wave_file.setframerate(sample_rate)
+        wave_file.writeframes(pcm_audio)
+
+
+def decode_to_wave(file_path: str) -> io.BytesIO:
+    """Decodes an audio file Pygame can't load into a 16 bit .wav in memory.
+
+    Args:
+        file_path (str): The path to the audio file.
+
+    Returns:
+        io.BytesIO: The decoded .wav, ready to be loaded by Pygame.
+    """
+    samples, sample_rate = sf.read(file_path, dtype="int16", always_2d=True)
+    decoded = io.BytesIO()
+    sf.write(decoded, samples, sample_rate, format="WAV", subtype="PCM_16")
+    decoded.seek(0)
+    return decoded
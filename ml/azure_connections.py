@@ -1,14 +1,29 @@
+import os
+import time
+
 import azure.cognitiveservices.speech as speechsdk
-from .utils import wait_until_key
 from rich import print
 
+from .cancellation import CancellationToken, optional_on_cancel, raise_if_cancelled
+from .metrics import optional_span
+from .subtitle_timeline import SubtitleTimeline
+
+# word boundary offsets are reported in ticks of 100 nanoseconds
+TICKS_PER_SECOND = 10_000_000
+
 
 class AzureConnectionsManager:
     """Class for managing Azure Speech-to-Text and Text-to-Speech operations."""
 
+    # the speech to text backend's name in metrics
+    backend_name = "azure"
     azure_speechconfig = None
     azure_audioconfig = None
     azure_speechrecognizer = None
+    callbacks_connected = False
+    commander_gpt = None
+    on_transcript = None
+    all_results = []
 
     def __init__(
         self,
@@ -41,132 +56,147 @@ class AzureConnectionsManager:
                 language=speech_recognition_language,
             )
 
-            # For TTS output (what the AI says)
-            self.output_speech_config = speechsdk.SpeechConfig(
-                subscription=azure_tts_key, region=azure_tts_region
-            )
-            self.output_audio_config = speechsdk.audio.AudioOutputConfig(
-                use_default_speaker=True
-            )
+            # For TTS output (what the AI says), a config is created for each synthesis
+            self.azure_tts_key = azure_tts_key
+            self.azure_tts_region = azure_tts_region
             print(f"speech_recognition_language: {speech_recognition_language}")
         except Exception as e:
             print("[red]\nFailed to setup azure speech")
             exit(e)
 
-    def texttospeech_from_text(
+    def synthesize_with_word_boundaries(
         self,
         azure_voice_name: str,
         azure_voice_style: str = "",
         text_to_speak: str = "",
-    ):
-        """Synthesizes text to speech using Azure's Text-to-Speech service.
+        subdirectory: str = "",
+        turn_trace=None,
+        cancellation_token: CancellationToken = None,
+    ) -> tuple[SubtitleTimeline, str]:
+        """Synthesizes text to speech in memory rather than on the speaker, and saves it as a .wav file to play later.
+
+        The word boundaries Azure reports while synthesizing are turned into a subtitle timeline,
+        so the subtitles can be shown in time with the audio the same way as with 11labs.
 
         Args:
             azure_voice_name (str): The name of the voice to use for synthesis (e.g., "en-US-JennyNeural").
             azure_voice_style (str, optional): The style of the voice (e.g., "cheerful", "whispering"). Defaults to "".
             text_to_speak (str): The text to convert into speech.
+            subdirectory (str, optional): The subdirectory where the audio file will be saved. Defaults to the current directory.
+            turn_trace (TurnTrace, optional): Times each stage.
+            cancellation_token (CancellationToken, optional): Stops synthesizing when cancelled.
 
         Returns:
-            speechsdk.SpeechSynthesisResult: The result of the speech synthesis process.
+            tuple[SubtitleTimeline, str]: The subtitle timeline and the file path the audio was saved to, or None if synthesis failed.
 
         Raises:
-            None: Prints errors to console if synthesis fails.
+            TurnCancelled: If the cancellation token was cancelled.
         """
         if len(text_to_speak) == 0:
             print("[yellow]\nThis message was empty")
-            return
-
-        voice_style = azure_voice_style
-
-        # Set the voice
-        self.output_speech_config.speech_synthesis_voice_name = azure_voice_name
+            return None
 
+        # a config per synthesis, so characters can synthesize with different voices at the same time
+        speech_config = speechsdk.SpeechConfig(
+            subscription=self.azure_tts_key, region=self.azure_tts_region
+        )
+        speech_config.speech_synthesis_voice_name = azure_voice_name
+        # a wav header at the mixer's rate is included, so the audio can be saved and played as is
+        speech_config.set_speech_synthesis_output_format(
+            speechsdk.SpeechSynthesisOutputFormat.Riff48Khz16BitMonoPcm
+        )
+        # no audio config keeps the audio in memory instead of playing it on the default speaker
         speech_synthesizer = speechsdk.SpeechSynthesizer(
-            speech_config=self.output_speech_config,
-            audio_config=self.output_audio_config,
+            speech_config=speech_config, audio_config=None
         )
 
-        if voice_style != "":
-            ssml_text = f"<speak version='1.0' xmlns='http://www.w3.org/2001/10/synthesis' xmlns:mstts='http://www.w3.org/2001/mstts' xmlns:emo='http://www.w3.org/2009/10/emotionml' xml:lang='en-US'><voice name='{azure_voice_name}'><mstts:express-as style='{voice_style}'>{text_to_speak}</mstts:express-as></voice></speak>"
-            speech_synthesis_result = speech_synthesizer.speak_ssml_async(
-                ssml_text
-            ).get()
-        else:
-            speech_synthesis_result = speech_synthesizer.speak_text_async(
-                text_to_speak
-            ).get()
-
-        if (
-            speech_synthesis_result.reason
-            == speechsdk.ResultReason.SynthesizingAudioCompleted
+        # (offset of the word in the text, length of the word, start in seconds, duration in seconds)
+        word_boundaries = []
+        speech_synthesizer.synthesis_word_boundary.connect(
+            lambda evt: word_boundaries.append(
+                (
+                    evt.text_offset,
+                    evt.word_length,
+                    evt.audio_offset / TICKS_PER_SECOND,
+                    evt.duration.total_seconds(),
+                )
+            )
+        )
+
+        # word offsets are reported within the SSML, so remember where the text starts in it
+        text_offset_in_request = 0
+        raise_if_cancelled(cancellation_token)
+        with (
+            optional_span(turn_trace, "tts_synthesis", backend="azure"),
+            optional_on_cancel(
+                cancellation_token, speech_synthesizer.stop_speaking_async
+            ),
         ):
-            print("Audio completed")
-        elif speech_synthesis_result.reason == speechsdk.ResultReason.Canceled:
+            if azure_voice_style:
+                ssml_text = f"<speak version='1.0' xmlns='http://www.w3.org/2001/10/synthesis' xmlns:mstts='http://www.w3.org/2001/mstts' xmlns:emo='http://www.w3.org/2009/10/emotionml' xml:lang='en-US'><voice name='{azure_voice_name}'><mstts:express-as style='{azure_voice_style}'>{text_to_speak}</mstts:express-as></voice></speak>"
+                text_offset_in_request = ssml_text.index(text_to_speak)
+                speech_synthesis_result = speech_synthesizer.speak_ssml_async(
+                    ssml_text
+                ).get()
+            else:
+                speech_synthesis_result = speech_synthesizer.speak_text_async(
+                    text_to_speak
+                ).get()
+        raise_if_cancelled(cancellation_token)
+
+        if speech_synthesis_result.reason == speechsdk.ResultReason.Canceled:
             cancellation_details = speech_synthesis_result.cancellation_details
             print(f"[yellow]\nSpeech synthesis canceled: {cancellation_details.reason}")
             if cancellation_details.reason == speechsdk.CancellationReason.Error:
                 if cancellation_details.error_details:
                     print(f"[red]\nError details: {cancellation_details.error_details}")
                     print("Did you set the speech resource key and region values?")
-                    return None
-        return speech_synthesis_result
+            return None
 
-    def speechtotext_from_mic_continuous(self, stop_key="8", commander_gpt=None):
-        """Performs continuous speech recognition using the microphone input.
+        subtitle_timeline = SubtitleTimeline.from_word_boundaries(
+            text=text_to_speak,
+            word_boundaries=[
+                (
+                    text_offset - text_offset_in_request,
+                    word_length,
+                    start_seconds,
+                    duration_seconds,
+                )
+                for text_offset, word_length, start_seconds, duration_seconds in word_boundaries
+            ],
+            audio_seconds=speech_synthesis_result.audio_duration.total_seconds(),
+        )
+
+        file_name = f"___Msg{str(hash(text_to_speak))}{time.time()}_azure.wav"
+        tts_file = os.path.join(os.path.abspath(os.curdir), subdirectory, file_name)
+        with optional_span(turn_trace, "audio_save"):
+            with open(tts_file, "wb") as f:
+                f.write(speech_synthesis_result.audio_data)
+        return subtitle_timeline, tts_file
+
+    def start_speechtotext_from_mic(self, commander_gpt=None, on_transcript=None):
+        """Starts continuous speech recognition using the microphone input, returning once it is running.
+
+        Call stop_speechtotext_from_mic() to stop recognition and get the result.
 
         Args:
-            stop_key (str, optional): The key to stop the speech recognition (default is "8").
             commander_gpt (CommanderGPTApp, optional): The app to show in-progress subtitles as you talk.
-
-        Returns:
-            str: The recognized speech as a single concatenated string.
+            on_transcript (callable, optional): Called from the recognizer's thread with everything recognized so far, on every partial and final result.
 
         Raises:
             None: Prints any errors or details during the speech recognition process.
         """
+        self.commander_gpt = commander_gpt
+        self.on_transcript = on_transcript
+        self.all_results = []
 
-        done = False
-
-        def recognizing_cb(evt: speechsdk.SpeechRecognitionEventArgs):
-            """Callback function that handles speech recognition results while recognizing.
-
-            Args:
-                evt (speechsdk.SpeechRecognitionEventArgs): The event argument containing recognition data.
-            """
-            # print(f"RECOGNIZING: {evt.result.text}")
-            if commander_gpt:
-                # tell it to show your in-progress message
-                commander_gpt.subtitles = evt.result.text
-
-        all_results = []
-
-        def recognized_cb(evt: speechsdk.SpeechRecognitionEventArgs):
-            """Callback function that handles speech recognition results once recognized.
-
-            Args:
-                evt (speechsdk.SpeechRecognitionEventArgs): The event argument containing recognition data.
-            """
-            print(f"[green]\n{evt.result.text}")
-            all_results.append(evt.result.text)
-
-        def stop_cb(evt: speechsdk.SessionEventArgs):
-            """Callback function that signals to stop continuous recognition.
-
-            Args:
-                evt (speechsdk.SessionEventArgs): The event argument signaling session end.
-            """
-            # print(f"CLOSING on {evt}")
-            nonlocal done
-            done = True
-
-        # Connect callbacks to the events fired by the speech recognizer
-        self.azure_speechrecognizer.recognizing.connect(recognizing_cb)
-        self.azure_speechrecognizer.recognized.connect(recognized_cb)
-        self.azure_speechrecognizer.session_stopped.connect(stop_cb)
-        self.azure_speechrecognizer.canceled.connect(stop_cb)
+        if not self.callbacks_connected:
+            # Connect callbacks to the events fired by the speech recognizer, once since they are kept between recognitions
+            self.azure_speechrecognizer.recognizing.connect(self.recognizing_cb)
+            self.azure_speechrecognizer.recognized.connect(self.recognized_cb)
+            self.callbacks_connected = True
 
         # Perform recognition. `start_continuous_recognition_async` asynchronously initiates continuous recognition operation,
-        # Other tasks can be performed on this thread while recognition starts...
         # wait on result_future.get() to know when initialization is done.
         # Call stop_continuous_recognition_async() to stop recognition.
         result_future = self.azure_speechrecognizer.start_continuous_recognition_async()
@@ -174,18 +204,44 @@ class AzureConnectionsManager:
         result_future.get()  # wait for voidfuture, so we know engine initialization is done.
         print("Continuous Recognition is now running, say something.")
 
-        while not done:
-            # No real sample parallel work to do on this thread, so just wait for user to type stop.
-            # Can't exit function or speech_recognizer will go out of scope and be destroyed while running.
-            wait_until_key(key_to_match=stop_key)
-            print("\nEnding azure speech recognition\n")
-            self.azure_speechrecognizer.stop_continuous_recognition_async()
-            break
+    def stop_speechtotext_from_mic(self) -> str:
+        """Stops continuous speech recognition started by start_speechtotext_from_mic() and returns what was recognized.
 
-        print("recognition stopped, main thread can exit now.")
-        if len(all_results) <= 0:
+        Returns:
+            str: The recognized speech as a single concatenated string, or None if nothing was recognized.
+        """
+        print("\nEnding azure speech recognition\n")
+        self.azure_speechrecognizer.stop_continuous_recognition_async().get()
+        print("recognition stopped.")
+        if len(self.all_results) <= 0:
             return None
 
-        final_result = " ".join(all_results).strip()
+        final_result = " ".join(self.all_results).strip()
         print(f"[green]\nHere’s the result we got!\n> {final_result}\n")
         return final_result
+
+    def recognizing_cb(self, evt: speechsdk.SpeechRecognitionEventArgs):
+        """Callback function that handles speech recognition results while recognizing.
+
+        Args:
+            evt (speechsdk.SpeechRecognitionEventArgs): The event argument containing recognition data.
+        """
+        # print(f"RECOGNIZING: {evt.result.text}")
+        if self.commander_gpt:
+            # tell it to show your in-progress message
+            self.commander_gpt.state_handoff.post(
+                self.commander_gpt, subtitles=evt.result.text
+            )
+        if self.on_transcript:
+            self.on_transcript(" ".join([*self.all_results, evt.result.text]).strip())
+
+    def recognized_cb(self, evt: speechsdk.SpeechRecognitionEventArgs):
+        """Callback function that handles speech recognition results once recognized.
+
+        Args:
+            evt (speechsdk.SpeechRecognitionEventArgs): The event argument containing recognition data.
+        """
+        print(f"[green]\n{evt.result.text}")
+        self.all_results.append(evt.result.text)
+        if self.on_transcript:
+            self.on_transcript(" ".join(self.all_results).strip())
@@ -0,0 +1,104 @@
+from contextlib import contextmanager, nullcontext
+import threading
+import time
+
+from rich import print
+
+
+class TurnCancelled(Exception):
+    """Raised by work on a worker thread that stopped because its CancellationToken was cancelled."""
+
+
+class CancellationToken:
+    """Cancels the work of the turns in progress, EG: when the user starts talking over the characters.
+
+    Cancelling the orchestrator's tasks stops what's awaited on the event loop, but not the blocking work already running on worker threads
+    (speech synthesis, local models, playback), so that work checks the token between steps
+    and registers callbacks to abort whatever it's waiting on when the token is cancelled.
+    """
+
+    def __init__(self):
+        """Initializes a token that hasn't been cancelled."""
+        self.cancelled_event = threading.Event()
+        # when the token was cancelled, from time.monotonic()
+        self.cancelled_at: float = None
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the token has been cancelled."""
+        return self.cancelled_event.is_set()
+
+    def cancel(self):
+        """Cancels the token, calling every registered callback. Can be called from any thread, later calls do nothing."""
+        with self.lock:
+            if self.cancelled_event.is_set():
+                return
+            self.cancelled_at = time.monotonic()
+            self.cancelled_event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[red]\nFailed to abort work while cancelling: {e}")
+
+    def raise_if_cancelled(self):
+        """Raises TurnCancelled if the token has been cancelled."""
+        if self.cancelled_event.is_set():
+            raise TurnCancelled()
+
+    def wait(self, timeout_seconds: float) -> bool:
+        """Sleeps until the token is cancelled or the timeout passes.
+
+        Args:
+            timeout_seconds (float): The longest to sleep for.
+
+        Returns:
+            bool: Whether the token was cancelled.
+        """
+        return self.cancelled_event.wait(timeout_seconds)
+
+    @contextmanager
+    def on_cancel(self, callback):
+        """Calls the callback if the token is cancelled while inside the with block, EG: to stop a request being waited on.
+        It's called straight away if the token was already cancelled.
+
+        Args:
+            callback (callable): Called with no arguments, from the thread that cancels the token.
+        """
+        with self.lock:
+            already_cancelled = self.cancelled_event.is_set()
+            if not already_cancelled:
+                self.callbacks.append(callback)
+        if already_cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self.lock:
+                if callback in self.callbacks:
+                    self.callbacks.remove(callback)
+
+
+def raise_if_cancelled(cancellation_token: CancellationToken):
+    """Raises TurnCancelled if the token was cancelled, does nothing without a token.
+
+    Args:
+        cancellation_token (CancellationToken): The token, or None.
+    """
+    if cancellation_token is not None:
+        cancellation_token.raise_if_cancelled()
+
+
+def optional_on_cancel(cancellation_token: CancellationToken, callback):
+    """Returns cancellation_token.on_cancel(callback), or a context that does nothing without a token.
+
+    Args:
+        cancellation_token (CancellationToken): The token, or None.
+        callback (callable): Called with no arguments if the token is cancelled.
+    """
+    if cancellation_token is None:
+        return nullcontext()
+    return cancellation_token.on_cancel(callback)
@@ -0,0 +1,269 @@
+from collections import OrderedDict, deque
+import heapq
+import itertools
+import threading
+import time
+
+
+class ChatIntakeEntry:
+    """A single chat message waiting to be answered."""
+
+    __slots__ = ("entry_id", "author", "content", "first", "arrival_time")
+
+    def __init__(
+        self, entry_id: int, author: str, content: str, first: bool, arrival_time: float
+    ):
+        self.entry_id = entry_id
+        self.author = author
+        self.content = content
+        self.first = first
+        self.arrival_time = arrival_time
+
+
+def normalize_chat_message(content: str) -> str:
+    """Normalizes a chat message so near-identical messages compare equal.
+
+    Case, punctuation, and extra whitespace are ignored, and runs of the same character are shortened (EG: "LOOOOL!!" and "lool" match).
+
+    Args:
+        content (str): The chat message.
+
+    Returns:
+        str: The normalized message.
+    """
+    normalized = []
+    previous = ""
+    run_length = 0
+    for character in content.lower():
+        if not character.isalnum():
+            character = " "
+        if character == previous:
+            run_length += 1
+            if run_length > 2 or character == " ":
+                continue
+        else:
+            previous = character
+            run_length = 1
+        normalized.append(character)
+    return "".join(normalized).strip()
+
+
+class ChatIntake:
+    """Thread-safe, bounded store of recent chat messages that hands out the best one to answer next.
+
+    Messages are scored by how recent they are, plus a bonus (given in seconds of recency) for first time chatters and for mentioning the character.
+    Each character has its own heap since mentions differ per character, picked or evicted messages are removed lazily from the heaps.
+    Near-identical messages within a time window and users sending messages faster than the cooldown are dropped on arrival.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 50,
+        character_names: list[str] = None,
+        user_cooldown_seconds: float = 5.0,
+        duplicate_window_seconds: float = 30.0,
+        first_time_chatter_bonus_seconds: float = 30.0,
+        mention_bonus_seconds: float = 60.0,
+        clock=time.monotonic,
+    ):
+        """Initializes an empty intake.
+
+        Args:
+            capacity (int, optional): The most messages to keep, the oldest are evicted first. Defaults to 50.
+            character_names (list[str], optional): Names of the characters that may be mentioned in chat. Defaults to none.
+            user_cooldown_seconds (float, optional): Messages from a user sent sooner than this after their last accepted one are dropped. Defaults to 5.
+            duplicate_window_seconds (float, optional): Messages matching one seen within this many seconds are dropped. Defaults to 30.
+            first_time_chatter_bonus_seconds (float, optional): How much newer a first time chatter's message is treated as. Defaults to 30.
+            mention_bonus_seconds (float, optional): How much newer a message mentioning the character is treated as. Defaults to 60.
+            clock (callable, optional): Returns the current time in seconds. Defaults to time.monotonic.
+        """
+        self.capacity = max(1, capacity)
+        self.user_cooldown_seconds = user_cooldown_seconds
+        self.duplicate_window_seconds = duplicate_window_seconds
+        self.first_time_chatter_bonus_seconds = first_time_chatter_bonus_seconds
+        self.mention_bonus_seconds = mention_bonus_seconds
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self.entry_ids = itertools.count()
+        # entry id -> ChatIntakeEntry, only messages that can still be picked
+        self.entries = {}
+        # entry ids oldest first, may contain ids that were already picked
+        self.arrival_order = deque()
+        # normalized character name -> heap of (-score, entry id), "" is for characters that can't be mentioned
+        self.heaps = {"": []}
+        for character_name in character_names or []:
+            self.heaps[normalize_chat_message(character_name)] = []
+        # normalized message -> time it was last seen
+        self.recent_messages = OrderedDict()
+        # user -> time their last message was accepted
+        self.last_message_time_by_user = OrderedDict()
+
+        self.accepted = 0
+        self.dropped_duplicates = 0
+        self.dropped_rate_limited = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, author: str, content: str, first: bool = False) -> bool:
+        """Adds a chat message unless it is a duplicate or the user is sending too many.
+
+        Args:
+            author (str): The display name of the chatter.
+            content (str): The chat message.
+            first (bool, optional): Whether this is the chatter's first message in the channel. Defaults to False.
+
+        Returns:
+            bool: True if the message was kept, False if it was dropped.
+        """
+        normalized = normalize_chat_message(content)
+        if not normalized:
+            return False
+
+        with self.lock:
+            now = self.clock()
+            self.expire(self.recent_messages, now - self.duplicate_window_seconds)
+            self.expire(
+                self.last_message_time_by_user, now - self.user_cooldown_seconds
+            )
+
+            if normalized in self.recent_messages:
+                # keep the duplicate window open while the spam continues
+                self.recent_messages.move_to_end(normalized)
+                self.recent_messages[normalized] = now
+                self.dropped_duplicates += 1
+                return False
+            if author in self.last_message_time_by_user:
+                self.dropped_rate_limited += 1
+                return False
+
+            self.recent_messages[normalized] = now
+            self.last_message_time_by_user[author] = now
+
+            entry = ChatIntakeEntry(
+                entry_id=next(self.entry_ids),
+                author=author,
+                content=content,
+                first=first,
+                arrival_time=now,
+            )
+            self.entries[entry.entry_id] = entry
+            self.arrival_order.append(entry.entry_id)
+
+            # pad with spaces so names only match whole words
+            padded_content = f" {normalized} "
+            base_score = now
+            if first:
+                base_score += self.first_time_chatter_bonus_seconds
+            for character_name, heap in self.heaps.items():
+                score = base_score
+                if character_name and f" {character_name} " in padded_content:
+                    score += self.mention_bonus_seconds
+                heapq.heappush(heap, (-score, entry.entry_id))
+            self.accepted += 1
+
+            # evict the oldest messages, skipping ones that were already picked
+            while len(self.entries) > self.capacity:
+                oldest_entry_id = self.arrival_order.popleft()
+                if self.entries.pop(oldest_entry_id, None) is not None:
+                    self.evicted += 1
+            self.compact()
+            return True
+
+    def pick(self, character_name: str = "", remove: bool = True) -> ChatIntakeEntry:
+        """Returns the highest scoring message for the given character.
+
+        Args:
+            character_name (str, optional): The name of the character that will answer, used to prefer messages mentioning them.
+            remove (bool, optional): Remove the message so it cannot be picked again. Defaults to True.
+
+        Returns:
+            ChatIntakeEntry: The message, or None if there are none.
+        """
+        with self.lock:
+            heap = self.heaps.get(
+                normalize_chat_message(character_name), self.heaps[""]
+            )
+            # discard entries that were picked or evicted since they were pushed
+            while heap and heap[0][1] not in self.entries:
+                heapq.heappop(heap)
+            if not heap:
+                return None
+            entry_id = heap[0][1]
+            if not remove:
+                return self.entries[entry_id]
+            heapq.heappop(heap)
+            entry = self.entries.pop(entry_id)
+            self.compact()
+            return entry
+
+    def drain(
+        self, character_name: str = "", max_messages: int = 10
+    ) -> list[ChatIntakeEntry]:
+        """Removes and returns the highest scoring messages for the given character, best first.
+
+        Args:
+            character_name (str, optional): The name of the character that will answer, used to prefer messages mentioning them.
+            max_messages (int, optional): The most messages to return. Defaults to 10.
+
+        Returns:
+            list[ChatIntakeEntry]: The messages, which may be empty.
+        """
+        drained = []
+        with self.lock:
+            heap = self.heaps.get(
+                normalize_chat_message(character_name), self.heaps[""]
+            )
+            while heap and len(drained) < max_messages:
+                _, entry_id = heapq.heappop(heap)
+                entry = self.entries.pop(entry_id, None)
+                if entry is not None:
+                    drained.append(entry)
+            self.compact()
+        return drained
+
+    def compact(self):
+        """Rebuilds the arrival order and heaps once stale ids outnumber live ones, keeping them bounded.
+
+        Must be called while holding the lock.
+        """
+        limit = 2 * self.capacity + 16
+        if len(self.arrival_order) > limit:
+            self.arrival_order = deque(
+                entry_id for entry_id in self.arrival_order if entry_id in self.entries
+            )
+        for character_name, heap in self.heaps.items():
+            if len(heap) > limit:
+                live_heap = [item for item in heap if item[1] in self.entries]
+                heapq.heapify(live_heap)
+                self.heaps[character_name] = live_heap
+
+    def expire(self, times_by_key: OrderedDict, cutoff: float):
+        """Removes keys last seen before the cutoff from an OrderedDict kept in time order.
+
+        Args:
+            times_by_key (OrderedDict): The keys and when they were last seen, oldest first.
+            cutoff (float): Keys older than this time are removed.
+        """
+        while times_by_key:
+            key, seen_time = next(iter(times_by_key.items()))
+            if seen_time >= cutoff:
+                break
+            times_by_key.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Returns counts of what happened to incoming messages.
+
+        Returns:
+            dict: Waiting, accepted, dropped, and evicted message counts.
+        """
+        with self.lock:
+            return {
+                "waiting": len(self.entries),
+                "accepted": self.accepted,
+                "dropped_duplicates": self.dropped_duplicates,
+                "dropped_rate_limited": self.dropped_rate_limited,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,110 @@
+import re
+import sys
+
+from .utils import write_json_file
+
+# the speaker's name that starts the text of messages said by someone other than the character, EG: "\n[Player]\nHello"
+SPEAKER_HEADER_PATTERN = re.compile(r"\n\[([^\]\n]*)\]\n")
+
+
+class ChatMessage:
+    """One message of a character's chat history, kept compact because a long stream builds up thousands of them.
+
+    Messages are never changed once created, so the same message is shared by every character's history it's added to.
+    The roles and speakers' names are interned so every message refers to the same strings,
+    and the API's nested dicts are only built when a request is sent or the history is saved.
+    """
+
+    __slots__ = ("role", "speaker", "text", "as_parts", "raw_content")
+
+    def __init__(
+        self,
+        role: str,
+        text: str,
+        speaker: str = None,
+        as_parts: bool = False,
+        raw_content: list = None,
+    ):
+        """Initializes the message.
+
+        Args:
+            role (str): "system", "user", or "assistant".
+            text (str): What was said, without the speaker's name.
+            speaker (str, optional): Who said it, shown before the text, or None for the character's own messages and their personality. Defaults to None.
+            as_parts (bool, optional): Whether the API's content is a list with one text part, rather than a string. Defaults to False.
+            raw_content (list, optional): Content that isn't a single text part, EG: from an edited history file, kept as it is. Defaults to None.
+        """
+        self.role = sys.intern(role)
+        self.text = text
+        self.speaker = None if speaker is None else sys.intern(speaker)
+        self.as_parts = as_parts
+        self.raw_content = raw_content
+
+    @classmethod
+    def from_dict(cls, message: dict):
+        """Returns the message for a dict in the API's format, EG: read from a saved history.
+
+        Args:
+            message (dict): {"role": ..., "content": ...}, where the content is a string or a list of parts.
+
+        Returns:
+            ChatMessage: The message.
+        """
+        role = message.get("role", "user")
+        content = message.get("content", "")
+        as_parts = isinstance(content, list)
+        if as_parts:
+            if len(content) != 1 or content[0].get("type", None) != "text":
+                return cls(role, "", raw_content=content)
+            content = content[0].get("text", "")
+        header = SPEAKER_HEADER_PATTERN.match(content)
+        if header is None:
+            return cls(role, content, as_parts=as_parts)
+        return cls(
+            role, content[header.end() :], speaker=header.group(1), as_parts=as_parts
+        )
+
+    @property
+    def content_text(self) -> str:
+        """The message's text as the model sees it, with the speaker's name before it."""
+        if self.speaker is None:
+            return self.text
+        return f"\n[{self.speaker}]\n{self.text}"
+
+    def to_dict(self) -> dict:
+        """Returns the message in the API's format.
+
+        Returns:
+            dict: {"role": ..., "content": ...}
+        """
+        if self.raw_content is not None:
+            return {"role": self.role, "content": self.raw_content}
+        content_text = self.content_text
+        if self.as_parts:
+            return {
+                "role": self.role,
+                "content": [{"type": "text", "text": content_text}],
+            }
+        return {"role": self.role, "content": content_text}
+
+
+def messages_to_dicts(messages: list[ChatMessage]) -> list[dict]:
+    """Returns the messages in the API's format.
+
+    Args:
+        messages (list[ChatMessage]): The messages.
+
+    Returns:
+        list[dict]: Each message's to_dict().
+    """
+    return [message.to_dict() for message in messages]
+
+
+def write_chat_history(filepath: str, messages: list[ChatMessage]):
+    """Saves a chat history as JSON in the API's format, so it can be read back with ChatMessage.from_dict().
+
+    Args:
+        filepath (str): Where to save it.
+        messages (list[ChatMessage]): The history, a copy of the list since it's usually written on another thread.
+    """
+    write_json_file(filepath, messages_to_dicts(messages))
@@ -0,0 +1,432 @@
+from collections import OrderedDict
+import math
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from rich import print
+
+# where each Tk anchor is within an image, as fractions of its width and height
+ANCHOR_FRACTIONS = {
+    "nw": (0.0, 0.0),
+    "n": (0.5, 0.0),
+    "ne": (1.0, 0.0),
+    "w": (0.0, 0.5),
+    "center": (0.5, 0.5),
+    "e": (1.0, 0.5),
+    "sw": (0.0, 1.0),
+    "s": (0.5, 1.0),
+    "se": (1.0, 1.0),
+}
+
+
+class Layer:
+    """A premultiplied RGBA image, cropped to its visible pixels so fully transparent areas cost nothing to blend."""
+
+    __slots__ = ("pixels", "left", "top", "width", "height")
+
+    def __init__(self, rgba: np.ndarray):
+        """Crops and premultiplies the image.
+
+        Args:
+            rgba (np.ndarray): Straight alpha RGBA, shaped (height, width, 4).
+        """
+        # the size before cropping, which anchors are relative to
+        self.height, self.width = rgba.shape[:2]
+        visible = rgba[..., 3] > 0
+        rows = np.flatnonzero(visible.any(axis=1))
+        columns = np.flatnonzero(visible.any(axis=0))
+        if rows.size == 0:
+            self.left, self.top = 0, 0
+            self.pixels = np.zeros((0, 0, 4), dtype=np.uint8)
+            return
+        # where the visible pixels start within the full image
+        self.left, self.top = int(columns[0]), int(rows[0])
+        self.pixels = premultiply(
+            rgba[rows[0] : rows[-1] + 1, columns[0] : columns[-1] + 1]
+        )
+
+
+class HeadlessCompositor:
+    """Draws the character images and outlined subtitles into an RGBA framebuffer off-screen, so no window or display is needed.
+
+    Images and text are each turned into a premultiplied alpha layer once and cached, then every frame is blended from the cached layers with NumPy.
+    A frame drawn with the same layers in the same places as the one before it is reused instead of blended again.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        font_filepath: str = "assets/fonts/NotoSerifCJK-Regular.ttc",
+        max_text_layers: int = 64,
+    ):
+        """Initializes an empty, fully transparent framebuffer.
+
+        Args:
+            width (int): The width of each frame in pixels.
+            height (int): The height of each frame in pixels.
+            font_filepath (str, optional): The font to draw text with. Defaults to "assets/fonts/NotoSerifCJK-Regular.ttc".
+            max_text_layers (int, optional): How many rendered pieces of text to keep, the least recently used are evicted. Defaults to 64.
+        """
+        self.width = width
+        self.height = height
+        self.font_filepath = font_filepath
+        self.max_text_layers = max_text_layers
+        # premultiplied RGBA, so blending a layer over it is one multiply and add
+        self.framebuffer = np.zeros((height, width, 4), dtype=np.uint8)
+        # the framebuffer with straight alpha, which is what gets exported
+        self.frame = np.zeros((height, width, 4), dtype=np.uint8)
+
+        # file path -> Layer
+        self.image_layers = {}
+        # (text, colours, width, font, outline, justify) -> Layer, least recently used first
+        self.text_layers = OrderedDict()
+        # font size -> ImageFont
+        self.fonts = {}
+
+        # (layer, left, top) for each layer drawn this frame, and the last frame
+        self.draw_list = []
+        self.previous_draw_list = None
+        self.frames = 0
+        self.reused_frames = 0
+        # whether the last render drew a different frame than the one before it
+        self.frame_changed = True
+
+    def font(self, size: int) -> ImageFont.FreeTypeFont:
+        """Returns the font at the given size, loading it the first time.
+
+        Args:
+            size (int): The font size in pixels.
+
+        Returns:
+            ImageFont.FreeTypeFont: The font.
+        """
+        font = self.fonts.get(size, None)
+        if font is None:
+            try:
+                font = ImageFont.truetype(self.font_filepath, size)
+            except OSError:
+                print(
+                    f"[red]\nCouldn't load the font {self.font_filepath}, using the default font."
+                )
+                font = ImageFont.load_default(size)
+            self.fonts[size] = font
+        return font
+
+    def preload(self, file_paths: list[str]):
+        """Decodes the given images ahead of time so the first change of state doesn't stutter.
+
+        Args:
+            file_paths (list[str]): The image files to decode, duplicates are ignored.
+        """
+        for file_path in dict.fromkeys(file_paths):
+            if file_path is None:
+                continue
+            try:
+                self.image_layer(file_path)
+            except Exception as e:
+                print(f"[red]\nError preloading image {file_path}: {e}")
+
+    def image_layer(self, file_path: str) -> Layer:
+        """Returns the image as a layer, decoding it the first time.
+
+        Args:
+            file_path (str): The path to the image file.
+
+        Returns:
+            Layer: The image's layer.
+        """
+        layer = self.image_layers.get(file_path, None)
+        if layer is None:
+            with Image.open(file_path) as image:
+                layer = Layer(np.asarray(image.convert("RGBA")))
+            self.image_layers[file_path] = layer
+        return layer
+
+    def text_layer(
+        self,
+        text: str,
+        text_color: str,
+        outline_color: str,
+        width: int,
+        font: ImageFont.FreeTypeFont,
+        outline_width: int,
+        justify: str,
+    ) -> Layer:
+        """Returns the text wrapped to the width and drawn with an outline as a layer, rendering it the first time.
+
+        Args:
+            text (str): The text to draw.
+            text_color (str): The colour of the text.
+            outline_color (str): The colour of the text's outline.
+            width (int): The width the text is wrapped to, given in pixels.
+            font (ImageFont.FreeTypeFont): The font to draw with.
+            outline_width (int): The width of the outline in pixels, 0 for none.
+            justify (str): How lines are aligned, "left", "center", or "right".
+
+        Returns:
+            Layer: The text's layer, sized to fit the text.
+        """
+        key = (text, text_color, outline_color, width, font, outline_width, justify)
+        layer = self.text_layers.get(key, None)
+        if layer is not None:
+            self.text_layers.move_to_end(key)
+            return layer
+
+        wrapped_text = wrap_text(text, font, width)
+        measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+        left, top, right, bottom = measure.multiline_textbbox(
+            (0, 0), wrapped_text, font=font, align=justify, stroke_width=outline_width
+        )
+        left, top = math.floor(left), math.floor(top)
+        image = Image.new(
+            "RGBA",
+            (max(1, math.ceil(right) - left), max(1, math.ceil(bottom) - top)),
+        )
+        ImageDraw.Draw(image).multiline_text(
+            (-left, -top),
+            wrapped_text,
+            font=font,
+            fill=ImageColor.getrgb(text_color or "white"),
+            align=justify,
+            stroke_width=outline_width,
+            stroke_fill=ImageColor.getrgb(outline_color or "black"),
+        )
+        layer = Layer(np.asarray(image))
+
+        self.text_layers[key] = layer
+        while len(self.text_layers) > self.max_text_layers:
+            self.text_layers.popitem(last=False)
+        return layer
+
+    def clear(self):
+        """Starts a new frame without anything drawn on it."""
+        self.draw_list = []
+
+    def draw_image(self, file_path: str, x: int, y: int, anchor: str = "nw"):
+        """Draws an image on the frame, in the same way as a Tk canvas' create_image.
+
+        Args:
+            file_path (str): The path to the image file.
+            x (int): The x position in pixels.
+            y (int): The y position in pixels.
+            anchor (str, optional): Which point of the image is placed at the position, EG: "nw" or "center". Defaults to "nw".
+        """
+        self.draw_layer(self.image_layer(file_path), x, y, anchor)
+
+    def draw_text(
+        self,
+        x: int,
+        y: int,
+        text: str,
+        text_color: str,
+        outline_color: str,
+        width: int,
+        font: ImageFont.FreeTypeFont,
+        outline_width: int = 2,
+        anchor: str = "n",
+        justify: str = "center",
+    ):
+        """Draws outlined text on the frame, in the same way as a Tk canvas' create_text.
+
+        Args:
+            x (int): The x position in pixels.
+            y (int): The y position in pixels.
+            text (str): The text to draw, nothing is drawn if empty.
+            text_color (str): The colour of the text.
+            outline_color (str): The colour of the text's outline.
+            width (int): The width the text is wrapped to, given in pixels.
+            font (ImageFont.FreeTypeFont): The font to draw with, from font().
+            outline_width (int, optional): The width of the outline in pixels, 0 for none. Defaults to 2.
+            anchor (str, optional): Which point of the text is placed at the position. Defaults to "n".
+            justify (str, optional): How lines are aligned, "left", "center", or "right". Defaults to "center".
+        """
+        if not text:
+            return
+        layer = self.text_layer(
+            text, text_color, outline_color, width, font, outline_width, justify
+        )
+        self.draw_layer(layer, x, y, anchor)
+
+    def draw_layer(self, layer: Layer, x: int, y: int, anchor: str):
+        """Adds a layer to the frame, to be blended over everything drawn before it.
+
+        Args:
+            layer (Layer): The layer.
+            x (int): The x position in pixels.
+            y (int): The y position in pixels.
+            anchor (str): Which point of the layer is placed at the position.
+        """
+        anchor_x, anchor_y = ANCHOR_FRACTIONS.get(anchor, (0.0, 0.0))
+        self.draw_list.append(
+            (
+                layer,
+                round(x - layer.width * anchor_x) + layer.left,
+                round(y - layer.height * anchor_y) + layer.top,
+            )
+        )
+
+    def layer_count(self) -> int:
+        """Returns how many layers have been drawn on the current frame."""
+        return len(self.draw_list)
+
+    def render(self) -> np.ndarray:
+        """Blends the layers drawn since clear() into the frame.
+
+        Returns:
+            np.ndarray: The frame as straight (not premultiplied) RGBA, shaped (height, width, 4). It is reused by the next render.
+        """
+        self.frames += 1
+        previous_draw_list = self.previous_draw_list
+        if previous_draw_list is not None and len(previous_draw_list) == len(
+            self.draw_list
+        ):
+            if all(
+                layer is previous_layer
+                and left == previous_left
+                and top == previous_top
+                for (layer, left, top), (
+                    previous_layer,
+                    previous_left,
+                    previous_top,
+                ) in zip(self.draw_list, previous_draw_list)
+            ):
+                self.reused_frames += 1
+                self.frame_changed = False
+                return self.frame
+        # keeping the layers referenced also means a cached layer that was evicted can't be mistaken for a new one
+        self.previous_draw_list = self.draw_list
+        self.frame_changed = True
+
+        self.framebuffer.fill(0)
+        for layer, left, top in self.draw_list:
+            blend_over(self.framebuffer, layer.pixels, left, top)
+        unpremultiply(self.framebuffer, out=self.frame)
+        return self.frame
+
+    def stats(self) -> dict:
+        """Returns statistics on the cached layers and reused frames.
+
+        Returns:
+            dict: Frames rendered and reused, and the number and size of the cached image and text layers.
+        """
+        return {
+            "frames": self.frames,
+            "reused_frames": self.reused_frames,
+            "decoded_images": len(self.image_layers),
+            "decoded_bytes": sum(
+                layer.pixels.nbytes for layer in self.image_layers.values()
+            ),
+            "text_layers": len(self.text_layers),
+        }
+
+    def print_stats(self, prefix: str = "Compositor"):
+        """Prints the compositor statistics.
+
+        Args:
+            prefix (str, optional): Text to print before the statistics.
+        """
+        stats = self.stats()
+        print(
+            f"[yellow]\n{prefix} {stats['frames']} frames ({stats['reused_frames']} reused), "
+            f"{stats['decoded_images']} images using {stats['decoded_bytes'] / (1024 * 1024):.1f}MB, "
+            f"{stats['text_layers']} text layers cached."
+        )
+
+
+def wrap_text(text: str, font: ImageFont.FreeTypeFont, width: int) -> str:
+    """Wraps text to fit within a width, breaking between words where possible like a Tk canvas does.
+
+    Args:
+        text (str): The text to wrap, existing line breaks are kept.
+        font (ImageFont.FreeTypeFont): The font the text is drawn with.
+        width (int): The widest a line can be, in pixels.
+
+    Returns:
+        str: The text with line breaks added.
+    """
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if font.getlength(candidate) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # break up any word wider than a whole line
+            line = ""
+            for character in word:
+                if line and font.getlength(line + character) > width:
+                    lines.append(line)
+                    line = ""
+                line += character
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def divide_by_255(values: np.ndarray) -> np.ndarray:
+    """Divides uint16 values of up to 255 * 255 by 255, rounding to the nearest, with shifts instead of a slow integer division."""
+    values = values + 128
+    return (values + (values >> 8)) >> 8
+
+
+def premultiply(rgba: np.ndarray) -> np.ndarray:
+    """Multiplies the colour of each pixel by its alpha.
+
+    Args:
+        rgba (np.ndarray): Straight alpha RGBA, shaped (height, width, 4).
+
+    Returns:
+        np.ndarray: A new premultiplied alpha RGBA array.
+    """
+    premultiplied = rgba.astype(np.uint16)
+    premultiplied[..., :3] = divide_by_255(
+        premultiplied[..., :3] * premultiplied[..., 3:4]
+    )
+    return premultiplied.astype(np.uint8)
+
+
+def unpremultiply(rgba: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Divides the colour of each pixel by its alpha.
+
+    Args:
+        rgba (np.ndarray): Premultiplied alpha RGBA, shaped (height, width, 4).
+        out (np.ndarray): Where to write the straight alpha RGBA, the same shape.
+
+    Returns:
+        np.ndarray: out.
+    """
+    np.copyto(out, rgba)
+    # fully opaque and fully transparent pixels are the same either way, so only the partly transparent edges are divided
+    alpha = rgba[..., 3]
+    rows, columns = np.nonzero((alpha > 0) & (alpha < 255))
+    if rows.size > 0:
+        pixels = rgba[rows, columns].astype(np.uint16)
+        pixel_alpha = pixels[:, 3:4]
+        out[rows, columns, :3] = np.minimum(
+            255, (pixels[:, :3] * 255 + pixel_alpha // 2) // pixel_alpha
+        )
+    return out
+
+
+def blend_over(framebuffer: np.ndarray, layer: np.ndarray, left: int, top: int):
+    """Blends a premultiplied layer over the framebuffer in place, clipping it to the framebuffer's edges.
+
+    Args:
+        framebuffer (np.ndarray): Premultiplied RGBA, shaped (height, width, 4).
+        layer (np.ndarray): Premultiplied RGBA, shaped (height, width, 4).
+        left (int): Where the layer's left edge is in the framebuffer.
+        top (int): Where the layer's top edge is in the framebuffer.
+    """
+    frame_height, frame_width = framebuffer.shape[:2]
+    layer_height, layer_width = layer.shape[:2]
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + layer_width, frame_width), min(top + layer_height, frame_height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    source = layer[y0 - top : y1 - top, x0 - left : x1 - left]
+    destination = framebuffer[y0:y1, x0:x1]
+    transparency = 255 - source[..., 3:4].astype(np.uint16)
+    destination[...] = source + divide_by_255(destination * transparency)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+
+from rich import print
+
+from .utils import read_config_file
+
+
+class ConfigWatcher:
+    """Polls config files for edits, and reads them again when they change.
+
+    Polling the file's modified time and size costs a single stat per file, and needs no extra dependencies or OS specific watchers.
+    """
+
+    def __init__(self, file_paths: list[str], interval_seconds: float = 1.0):
+        """Initializes the watcher, remembering how the files look now so only later edits are reported.
+
+        Args:
+            file_paths (list[str]): The config files to watch.
+            interval_seconds (float, optional): How often to check the files. Defaults to 1.0.
+        """
+        self.interval_seconds = interval_seconds
+        self.signatures = {
+            file_path: self.signature(file_path) for file_path in file_paths
+        }
+
+    def signature(self, file_path: str) -> tuple:
+        """Returns the file's modified time and size, or None if it doesn't exist."""
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return None
+        return stat_result.st_mtime_ns, stat_result.st_size
+
+    def changed_configs(self) -> dict:
+        """Reads the files that changed since they were last checked.
+
+        A file that isn't valid JSON (EG: saved halfway through an edit) is skipped, and read again on its next change.
+
+        Returns:
+            dict: The file path -> parsed config of each changed file.
+        """
+        changed_configs = {}
+        for file_path, previous_signature in self.signatures.items():
+            signature = self.signature(file_path)
+            if signature is None or signature == previous_signature:
+                continue
+            self.signatures[file_path] = signature
+            try:
+                changed_configs[file_path] = read_config_file(file_path)
+            except (OSError, json.JSONDecodeError) as e:
+                print(
+                    f"[red]\nIgnoring the edit to {file_path}, it couldn't be read: {e}"
+                )
+        return changed_configs
+
+    async def watch(self, on_change):
+        """Checks the files until cancelled, calling on_change on a worker thread for each edit.
+
+        Args:
+            on_change (callable): Called with the file path and its parsed config.
+        """
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            changed_configs = await asyncio.to_thread(self.changed_configs)
+            for file_path, config in changed_configs.items():
+                try:
+                    await asyncio.to_thread(on_change, file_path, config)
+                except Exception as e:
+                    print(f"[red]\nFailed to reload {file_path}: {e}")
@@ -1,177 +1,189 @@
 from elevenlabs.client import ElevenLabs
-from elevenlabs import save, Voice, AudioWithTimestampsResponseModel
+from elevenlabs import save, AudioWithTimestampsResponseModel
 import time
 import os
-from .audio_player import AudioManager
+from .audio_player import AudioManager, write_wave_file
+from .cancellation import CancellationToken, raise_if_cancelled
+from .metrics import optional_span
+from .voice_catalog import VoiceCatalog
 import base64
 
 
 class ElevenLabsManager:
     """Manages interaction with the ElevenLabs API, including text-to-speech functionality."""
 
-    def __init__(self, elevenlabs_api_key: str):
+    def __init__(
+        self,
+        elevenlabs_api_key: str,
+        client: ElevenLabs = None,
+        audio_manager: AudioManager = None,
+        voice_names: list[str] = None,
+        voice_cache_filepath: str = "cache/elevenlabs_voices.json",
+        voice_cache_ttl_seconds: float = 24 * 60 * 60,
+        output_format: str = "pcm_24000",
+    ):
         """Initializes the ElevenLabsManager with the provided API key and retrieves voice settings.
 
         Args:
             elevenlabs_api_key (str): The API key used to authenticate with ElevenLabs.
+            client (ElevenLabs, optional): The client to use instead of creating one, EG: a stand-in for benchmarks.
+            audio_manager (AudioManager, optional): The audio manager to play audio with instead of creating one.
+            voice_names (list[str], optional): The voices the characters use, their ids and settings are resolved up front.
+            voice_cache_filepath (str, optional): Where the voices and their settings are cached, not cached if None. Defaults to "cache/elevenlabs_voices.json".
+            voice_cache_ttl_seconds (float, optional): How long the cached voices are used before being refreshed in the background. Defaults to a day.
+            output_format (str, optional): The 11labs output format to request. Raw PCM (EG: "pcm_24000") is saved with a .wav header the mixer plays as is, encoded formats (EG: "mp3_44100_128") are saved as they are. Defaults to "pcm_24000".
 
         Initializes:
-            - Retrieves available voices from the ElevenLabs API.
-            - Creates mappings of voice names to IDs and stores voice settings for later use.
+            - Loads the voice names, IDs, and settings from the cache, only waiting on the ElevenLabs API for voices that aren't cached.
         """
-        self.client = ElevenLabs(api_key=elevenlabs_api_key)
-        self.voices = self.client.voices.get_all().voices
-        self.voice_to_id = {}
-        for voice in self.voices:
-            self.voice_to_id[voice.name] = voice.voice_id
-            print(voice.name)
-        self.voice_to_settings = {}
+        self.client = client or ElevenLabs(api_key=elevenlabs_api_key)
+        self.voice_catalog = VoiceCatalog(
+            client=self.client,
+            cache_filepath=voice_cache_filepath,
+            ttl_seconds=voice_cache_ttl_seconds,
+        )
+        self.voice_catalog.resolve(voice_names or [])
+
+        self.output_format = output_format
+
+        # created when first needed, so a server streaming the audio to its clients never opens the mixer
+        self.audio_manager = audio_manager
 
-        self.audio_manager = AudioManager()
+    def default_audio_manager(self) -> AudioManager:
+        """Returns the audio manager given when created, or creates one the first time it's needed."""
+        if self.audio_manager is None:
+            self.audio_manager = AudioManager()
+        return self.audio_manager
 
-    def text_to_audio(
+    def synthesize_with_timestamps(
         self,
-        ai_character,
         input_text: str,
         voice: str = "Alice",
         save_as_wave: bool = True,
         subdirectory: str = "",
         model_id: str = "eleven_monolingual_v1",
-    ) -> str:
-        """Converts input text to speech and saves it as an audio file, then plays it.
-
-        It also updates the state of the commander_gpt app so the character reflects the new state.
+        turn_trace=None,
+        cancellation_token: CancellationToken = None,
+    ) -> tuple[AudioWithTimestampsResponseModel, str]:
+        """Converts input text to speech and saves it as an audio file, without playing it.
 
         Args:
-            ai_character (AICharacter): The character speaking.
             input_text (str): The text to be converted to speech.
             voice (str, optional): The voice to use for speech synthesis. Defaults to "Doug VO Only".
-            save_as_wave (bool, optional): Whether to save the output as a .wav file (True) or .mp3 (False). Defaults to True.
+            save_as_wave (bool, optional): Whether to save PCM output as a .wav file (True) or as raw .pcm (False). Encoded output formats are saved with their own extension. Defaults to True.
             subdirectory (str, optional): The subdirectory where the audio file will be saved. Defaults to the current directory.
             model_id (str, optional): The model to use for speech synthesis (e.g., "eleven_monolingual_v1" or "eleven_turbo_v2"). Defaults to "eleven_monolingual_v1".
+            turn_trace (TurnTrace, optional): Times each stage.
+            cancellation_token (CancellationToken, optional): Stops before requesting the audio, or before saving it, when cancelled.
 
         Returns:
-            str: The file path where the generated audio file is saved.
+            tuple[AudioWithTimestampsResponseModel, str]: The audio data and timestamps, and the file path it was saved to.
+
+        Raises:
+            TurnCancelled: If the cancellation token was cancelled.
 
         Notes:
-            - If `save_as_wave` is True, the audio will be saved as a .wav file; otherwise, it will be saved as an .mp3 file.
+            - The audio is requested in the manager's output_format, raw PCM is given a .wav header so the mixer can play it without converting it.
             - The method uses a workaround for an issue with the ElevenLabs API where the voice settings are not automatically retrieved. It stores the voice settings for later use.
             - The file name is generated based on the hash of the input text and the current time.
         """
-        # Workaround to fetch the voice settings the first time a voice is used
-        if voice not in self.voice_to_settings:
-            self.voice_to_settings[voice] = self.client.voices.get_settings(
-                self.voice_to_id[voice]
-            )
-        voice_settings = self.voice_to_settings[voice]
+        # Workaround to fetch the voice settings the first time a voice is used, usually already cached
+        with optional_span(turn_trace, "tts_voice_settings", backend="elevenlabs"):
+            voice_settings = self.voice_catalog.voice_settings(voice)
+        raise_if_cancelled(cancellation_token)
 
-        # Generate the speech from text using the selected voice and model
-        audio_saved = self.client.generate(
-            text=input_text,
-            voice=Voice(voice_id=self.voice_to_id[voice], settings=voice_settings),
-            model=model_id,
-        )
+        # Generate the speech from text using the selected voice and model getting the audio and timestamps
+        response_model: AudioWithTimestampsResponseModel
+        with optional_span(turn_trace, "tts_synthesis", backend="elevenlabs"):
+            response_model = self.client.text_to_speech.convert_with_timestamps(
+                text=input_text,
+                voice_id=self.voice_catalog.voice_id(voice),
+                voice_settings=voice_settings,
+                model_id=model_id,
+                output_format=self.output_format,
+            )
+            audio_saved = base64.b64decode(response_model.audio_base_64)
+        # the request can't be aborted, but the audio doesn't need saving
+        raise_if_cancelled(cancellation_token)
 
-        # Generate the file name and path based on whether it's saved as .wav or .mp3
-        if save_as_wave:
-            file_name = f"___Msg{str(hash(input_text))}{time.time()}_{model_id}.wav"
-        else:
-            file_name = f"___Msg{str(hash(input_text))}{time.time()}_{model_id}.mp3"
+        # EG: "pcm_24000" or "mp3_44100_128"
+        codec, _, sample_rate = self.output_format.partition("_")
+        is_wave = codec == "pcm" and save_as_wave
+        # Generate the file name and path based on the format it's saved in
+        file_name = f"___Msg{str(hash(input_text))}{time.time()}_{model_id}.{'wav' if is_wave else codec}"
 
         tts_file = os.path.join(os.path.abspath(os.curdir), subdirectory, file_name)
 
         # Save the generated audio to the specified file
-        save(audio_saved, tts_file)
-
-        ai_character.state = "talking"
-        ai_character.voice_color = ai_character.character_text_color
-        ai_character.subtitles = input_text
-        # while this character talks, the others listen
-        for other_ai_character in ai_character.other_ai_characters:
-            other_ai_character.state = "listening"
-            other_ai_character.subtitles = None
-
-        # play the saved audio file
-        self.audio_manager.play_audio(
-            file_path=tts_file,
-            sleep_during_playback=True,
-            delete_file=False,
-            play_using_music=True,
-        )
+        with optional_span(turn_trace, "audio_save"):
+            if is_wave:
+                write_wave_file(audio_saved, tts_file, sample_rate=int(sample_rate))
+            else:
+                save(audio_saved, tts_file)
 
-        return tts_file
+        return response_model, tts_file
 
-    def text_to_audio_with_timestamps(
+    def play_with_timestamps(
         self,
         ai_character,
         input_text: str,
-        voice: str = "Alice",
-        save_as_wave: bool = True,
-        subdirectory: str = "",
-        model_id: str = "eleven_monolingual_v1",
-    ) -> AudioWithTimestampsResponseModel:
-        """Converts input text to speech and saves it as an audio file, then plays it.
+        tts_file: str,
+        turn_trace=None,
+        audio_manager: AudioManager = None,
+        cancellation_token: CancellationToken = None,
+    ):
+        """Starts playing audio saved by synthesize_with_timestamps, without waiting for it to finish.
 
         It also updates the state of the commander_gpt app so the character reflects the new state.
 
         Args:
             ai_character (AICharacter): The character speaking.
-            input_text (str): The text to be converted to speech.
-            voice (str, optional): The voice to use for speech synthesis. Defaults to "Doug VO Only".
-            save_as_wave (bool, optional): Whether to save the output as a .wav file (True) or .mp3 (False). Defaults to True.
-            subdirectory (str, optional): The subdirectory where the audio file will be saved. Defaults to the current directory.
-            model_id (str, optional): The model to use for speech synthesis (e.g., "eleven_monolingual_v1" or "eleven_turbo_v2"). Defaults to "eleven_monolingual_v1".
-
-        Returns:
-            AudioWithTimestampsResponseModel: The audio data and timestamps.
-
-        Notes:
-            - If `save_as_wave` is True, the audio will be saved as a .wav file; otherwise, it will be saved as an .mp3 file.
-            - The method uses a workaround for an issue with the ElevenLabs API where the voice settings are not automatically retrieved. It stores the voice settings for later use.
-            - The file name is generated based on the hash of the input text and the current time.
+            input_text (str): The text being spoken.
+            tts_file (str): The path to the saved audio.
+            turn_trace (TurnTrace, optional): Times starting playback, and records when the audio starts playing.
+            audio_manager (AudioManager, optional): Plays the audio instead of this manager's own, EG: a server session's, which streams it to its clients. Defaults to None.
+            cancellation_token (CancellationToken, optional): Doesn't start playing, or stops playing, when cancelled.
+
+        Raises:
+            TurnCancelled: If the cancellation token was cancelled.
         """
-        # Workaround to fetch the voice settings the first time a voice is used
-        if voice not in self.voice_to_settings:
-            self.voice_to_settings[voice] = self.client.voices.get_settings(
-                self.voice_to_id[voice]
-            )
-        voice_settings = self.voice_to_settings[voice]
-
-        # Generate the speech from text using the selected voice and model getting the audio and timestamps
-        response_model: AudioWithTimestampsResponseModel
-        response_model = self.client.text_to_speech.convert_with_timestamps(
-            text=input_text,
-            voice_id=self.voice_to_id[voice],
-            voice_settings=voice_settings,
-            model_id=model_id,
-        )
-        audio_saved = base64.b64decode(response_model.audio_base_64)
-
-        # Generate the file name and path based on whether it's saved as .wav or .mp3
-        if save_as_wave:
-            file_name = f"___Msg{str(hash(input_text))}{time.time()}_{model_id}.wav"
-        else:
-            file_name = f"___Msg{str(hash(input_text))}{time.time()}_{model_id}.mp3"
-
-        tts_file = os.path.join(os.path.abspath(os.curdir), subdirectory, file_name)
-
-        # Save the generated audio to the specified file
-        save(audio_saved, tts_file)
-
-        ai_character.state = "talking"
+        raise_if_cancelled(cancellation_token)
+        state_handoff = ai_character.commander_gpt.state_handoff
         ai_character.voice_color = ai_character.character_text_color
-        ai_character.subtitles = input_text
+        state_handoff.post(ai_character, state="talking", subtitles=input_text)
         # while this character talks, the others listen
         for other_ai_character in ai_character.other_ai_characters:
-            other_ai_character.state = "listening"
-            other_ai_character.subtitles = None
+            state_handoff.post(other_ai_character, state="listening", subtitles=None)
 
         # play the saved audio file
-        self.audio_manager.play_audio(
-            file_path=tts_file,
-            sleep_during_playback=False,
-            delete_file=False,
-            play_using_music=True,
-        )
-
-        return response_model
+        with optional_span(turn_trace, "playback_start"):
+            (audio_manager or self.default_audio_manager()).play_audio(
+                file_path=tts_file,
+                sleep_during_playback=False,
+                delete_file=False,
+                play_using_music=True,
+                cancellation_token=cancellation_token,
+            )
+        if turn_trace is not None:
+            turn_trace.mark("first_audio")
+
+
+def audio_duration_seconds(
+    audio_with_timestamps: AudioWithTimestampsResponseModel,
+) -> float:
+    """Returns how long audio from 11labs (or Azure's SubtitleTimeline) plays for, based on its character timestamps.
+
+    Args:
+        audio_with_timestamps (AudioWithTimestampsResponseModel): The audio data and timestamps, or a SubtitleTimeline.
+
+    Returns:
+        float: The time the last character finishes being spoken, in seconds.
+    """
+    alignment = audio_with_timestamps.alignment
+    if alignment is None:
+        return 0.0
+    end_times = (
+        getattr(alignment, "character_end_times_seconds", None)
+        or alignment.character_start_times_seconds
+    )
+    return end_times[-1] if end_times else 0.0
@@ -0,0 +1,75 @@
+import re
+import threading
+import time
+
+# words only, so a partial result and the final one with punctuation and capitals added match
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_transcript(transcript: str) -> str:
+    """Returns the transcript's words in lower case, without punctuation.
+
+    Args:
+        transcript (str): The recognized speech.
+
+    Returns:
+        str: EG: "what should we do next" for "What should we do next?"
+    """
+    return " ".join(WORD_PATTERN.findall(transcript.lower()))
+
+
+class EndpointDetector:
+    """Decides when the user has finished talking from the speech recognizer's results, so the mic doesn't need a second key press.
+
+    Once the transcript has stopped changing for stable_seconds it's worth starting a response to speculatively,
+    and once it hasn't changed for end_of_speech_seconds the user is done talking.
+    """
+
+    def __init__(self, stable_seconds: float = 0.4, end_of_speech_seconds: float = 0.8):
+        """Initializes the detector.
+
+        Args:
+            stable_seconds (float, optional): How long the transcript must stay the same before responding to it speculatively. Defaults to 0.4.
+            end_of_speech_seconds (float, optional): How long the transcript must stay the same before the user is done talking. Defaults to 0.8.
+        """
+        self.stable_seconds = stable_seconds
+        self.end_of_speech_seconds = end_of_speech_seconds
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets the transcript, before the user starts talking again."""
+        with self.lock:
+            self.transcript = ""
+            self.normalized_transcript = ""
+            # when the words last changed, from time.monotonic()
+            self.last_changed_at: float = None
+
+    def update(self, transcript: str):
+        """Records the transcript so far, called by the speech recognizer with every partial and final result from any thread.
+
+        Args:
+            transcript (str): Everything recognized since the user started talking.
+        """
+        normalized_transcript = normalize_transcript(transcript)
+        with self.lock:
+            self.transcript = transcript
+            if normalized_transcript != self.normalized_transcript:
+                self.normalized_transcript = normalized_transcript
+                self.last_changed_at = time.monotonic()
+
+    def poll(self) -> tuple[str, str]:
+        """Returns whether the user is still talking.
+
+        Returns:
+            tuple[str, str]: "waiting" before anything is heard, "speaking", "stable", or "ended", and the transcript so far.
+        """
+        with self.lock:
+            if not self.normalized_transcript:
+                return "waiting", ""
+            quiet_seconds = time.monotonic() - self.last_changed_at
+            if quiet_seconds >= self.end_of_speech_seconds:
+                return "ended", self.transcript
+            if quiet_seconds >= self.stable_seconds:
+                return "stable", self.transcript
+            return "speaking", self.transcript
@@ -0,0 +1,270 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+import errno
+import os
+import shutil
+import struct
+
+import numpy as np
+from PIL import Image
+from rich import print
+
+# width, height, and frame number, written before every frame in shared memory
+SHARED_MEMORY_HEADER = struct.Struct("<IIQ")
+
+
+class ImageSequenceExporter:
+    """Saves each frame as a numbered transparent PNG, EG: to record a scene or import it into an editor.
+
+    Frames are encoded on a few worker threads (Pillow releases the GIL while compressing), so the render loop only waits when they fall behind.
+    A frame that hasn't changed is linked to the previous file instead of being encoded again,
+    and so are the frames skipped while the render loop fell behind, so the numbers stay in step with the timeline.
+    """
+
+    def __init__(
+        self, directory: str = "frames", compress_level: int = 1, workers: int = 4
+    ):
+        """Initializes the exporter, creating the directory if needed.
+
+        Args:
+            directory (str, optional): Where to save the frames. Defaults to "frames".
+            compress_level (int, optional): PNG compression from 0 (fastest) to 9 (smallest). Defaults to 1.
+            workers (int, optional): How many frames can be encoded at once. Defaults to 4.
+        """
+        self.directory = directory
+        self.compress_level = compress_level
+        os.makedirs(directory, exist_ok=True)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="frame_export"
+        )
+        # the oldest first, a few more than the workers are queued before write() waits
+        self.pending = []
+        self.max_pending = workers * 2
+        self.previous = None
+        self.previous_frame_number: int = None
+
+    def write(self, frame: np.ndarray, frame_number: int, changed: bool = True):
+        """Queues a frame to be saved.
+
+        Args:
+            frame (np.ndarray): Straight alpha RGBA, shaped (height, width, 4).
+            frame_number (int): The frame's position in the sequence, after a gap if frames were skipped.
+            changed (bool, optional): False if the frame is the same as the last one written. Defaults to True.
+        """
+        if self.previous is not None:
+            # the skipped frames show the last one written, like a video would
+            for skipped_frame_number in range(
+                self.previous_frame_number + 1, frame_number
+            ):
+                self.queue(
+                    self.executor.submit(
+                        self.link, *self.previous, self.file_path(skipped_frame_number)
+                    )
+                )
+        self.previous_frame_number = frame_number
+        file_path = self.file_path(frame_number)
+        if changed or self.previous is None:
+            # copied because the compositor draws the next frame into the same array
+            future = self.executor.submit(self.encode, frame.copy(), file_path)
+        else:
+            future = self.executor.submit(self.link, *self.previous, file_path)
+        self.previous = (future, file_path)
+        self.queue(future)
+
+    def file_path(self, frame_number: int) -> str:
+        """Returns where a frame is saved.
+
+        Args:
+            frame_number (int): The frame's position in the sequence.
+
+        Returns:
+            str: The path of its PNG.
+        """
+        return os.path.join(self.directory, f"frame_{frame_number:06d}.png")
+
+    def queue(self, future):
+        """Keeps track of a frame being saved, waiting for the oldest once too many are queued.
+
+        Args:
+            future (Future): The task saving the frame.
+        """
+        self.pending.append(future)
+        if len(self.pending) > self.max_pending:
+            self.pending.pop(0).result()
+
+    def encode(self, frame: np.ndarray, file_path: str):
+        """Encodes and saves a frame, on a worker thread.
+
+        Args:
+            frame (np.ndarray): Straight alpha RGBA, shaped (height, width, 4).
+            file_path (str): Where to save the PNG.
+        """
+        Image.fromarray(frame, "RGBA").save(
+            file_path, compress_level=self.compress_level
+        )
+
+    def link(self, previous_future, previous_filepath: str, file_path: str):
+        """Saves an unchanged frame as a hard link to the previous one once that's saved, on a worker thread.
+
+        Args:
+            previous_future (Future): The task saving the previous frame, which was queued first so is already running or done.
+            previous_filepath (str): The previous frame's file.
+            file_path (str): Where to save the frame.
+        """
+        previous_future.result()
+        # replace a frame left by an earlier run
+        if os.path.lexists(file_path):
+            os.remove(file_path)
+        try:
+            os.link(previous_filepath, file_path)
+        except OSError:
+            # EG: the file system doesn't support hard links
+            shutil.copyfile(previous_filepath, file_path)
+
+    def close(self):
+        """Waits for the queued frames to be saved."""
+        self.executor.shutdown(wait=True)
+        for future in self.pending:
+            future.result()
+        self.pending = []
+
+
+class NamedPipeExporter:
+    """Writes each frame as raw RGBA to a named pipe, EG: for OBS's media source to read through ffmpeg.
+
+    Frames are dropped while nothing is reading the pipe, so the app never waits for a reader to connect.
+    """
+
+    def __init__(self, pipe_filepath: str = "/tmp/commander_gpt_frames"):
+        """Initializes the exporter, creating the named pipe if it doesn't exist.
+
+        Args:
+            pipe_filepath (str, optional): The path of the named pipe. Defaults to "/tmp/commander_gpt_frames".
+        """
+        self.pipe_filepath = pipe_filepath
+        self.pipe = None
+        if not os.path.exists(pipe_filepath):
+            os.mkfifo(pipe_filepath)
+
+    def write(self, frame: np.ndarray, frame_number: int, changed: bool = True):
+        """Writes a frame, if there is a reader.
+
+        Args:
+            frame (np.ndarray): Straight alpha RGBA, shaped (height, width, 4).
+            frame_number (int): The frame's position in the sequence.
+            changed (bool, optional): Unused, every frame is written to keep the reader's frame rate steady. Defaults to True.
+        """
+        if self.pipe is None:
+            try:
+                # opening without blocking fails straight away when there's no reader yet
+                descriptor = os.open(self.pipe_filepath, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    return
+                raise
+            # then block on writes so a frame is never written partially
+            os.set_blocking(descriptor, True)
+            self.pipe = os.fdopen(descriptor, "wb", buffering=0)
+            print(f"[green]\nA reader connected to {self.pipe_filepath}.")
+        try:
+            self.pipe.write(frame.tobytes())
+        except BrokenPipeError:
+            print(f"[yellow]\nThe reader disconnected from {self.pipe_filepath}.")
+            self.close()
+
+    def close(self):
+        """Closes the pipe, a new reader can connect on the next write."""
+        if self.pipe is not None:
+            try:
+                self.pipe.close()
+            except BrokenPipeError:
+                pass
+            self.pipe = None
+
+
+class SharedMemoryExporter:
+    """Copies each frame into a block of shared memory, for another process on the same machine to read.
+
+    The block starts with the width, height, and frame number (little-endian uint32, uint32, uint64), followed by the frame as raw RGBA.
+    The frame number is written after the frame, so a reader can tell when a new frame is ready.
+    """
+
+    def __init__(self, name: str, width: int, height: int):
+        """Initializes the exporter, creating the shared memory.
+
+        Args:
+            name (str): The name of the shared memory block.
+            width (int): The width of each frame in pixels.
+            height (int): The height of each frame in pixels.
+        """
+        size = SHARED_MEMORY_HEADER.size + width * height * 4
+        try:
+            self.shared_memory = shared_memory.SharedMemory(
+                name=name, create=True, size=size
+            )
+        except FileExistsError:
+            # left behind by a previous run
+            self.shared_memory = shared_memory.SharedMemory(name=name)
+            if self.shared_memory.size != size:
+                # for a different resolution, so replace it
+                self.shared_memory.close()
+                self.shared_memory.unlink()
+                self.shared_memory = shared_memory.SharedMemory(
+                    name=name, create=True, size=size
+                )
+        self.width = width
+        self.height = height
+        self.pixels = np.ndarray(
+            (height, width, 4),
+            dtype=np.uint8,
+            buffer=self.shared_memory.buf,
+            offset=SHARED_MEMORY_HEADER.size,
+        )
+
+    def write(self, frame: np.ndarray, frame_number: int, changed: bool = True):
+        """Copies a frame into the shared memory.
+
+        Args:
+            frame (np.ndarray): Straight alpha RGBA, shaped (height, width, 4).
+            frame_number (int): The frame's position in the sequence.
+            changed (bool, optional): False if the frame is the same as the last one written, then only the frame number is updated. Defaults to True.
+        """
+        if changed:
+            self.pixels[...] = frame
+        SHARED_MEMORY_HEADER.pack_into(
+            self.shared_memory.buf, 0, self.width, self.height, frame_number
+        )
+
+    def close(self):
+        """Releases and removes the shared memory."""
+        self.pixels = None
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+
+def create_frame_exporter(output: str, width: int, height: int, path: str):
+    """Creates the exporter for the configured output.
+
+    Args:
+        output (str): "image_sequence", "pipe", or "shared_memory".
+        width (int): The width of each frame in pixels.
+        height (int): The height of each frame in pixels.
+        path (str): The directory, named pipe, or shared memory name to export to, the exporter's default if None.
+
+    Returns:
+        The exporter, with write(frame, frame_number, changed) and close() methods.
+
+    Raises:
+        ValueError: If the output isn't one of the above.
+    """
+    if output == "image_sequence":
+        return ImageSequenceExporter(directory=path or "frames")
+    if output == "pipe":
+        return NamedPipeExporter(pipe_filepath=path or "/tmp/commander_gpt_frames")
+    if output == "shared_memory":
+        return SharedMemoryExporter(
+            name=path or "commander_gpt_frames", width=width, height=height
+        )
+    raise ValueError(
+        f"Unknown headless output {output}, expected image_sequence, pipe, or shared_memory"
+    )
@@ -0,0 +1,68 @@
+from pynput import keyboard
+from pynput.keyboard import KeyCode
+
+from .utils import key_to_string
+
+
+class HotkeyListener:
+    """Listens to the keyboard on a single thread and runs the callbacks bound to a key when it is released.
+
+    Replaces starting a separate listener (and thread) for every key being waited on.
+    Callbacks run on the listener's thread, so they should only hand work off to somewhere else.
+    """
+
+    def __init__(self):
+        """Initializes the listener without any bindings."""
+        # key string -> list of callbacks
+        self.bindings = {}
+        self.listener = None
+
+    def bind(self, key: str, callback):
+        """Calls the callback every time the key is released.
+
+        Args:
+            key (str): The key to listen for, in the same format as the configs, EG: "Key.home" or "=".
+            callback (callable): Called with no arguments when the key is released.
+        """
+        if key is None:
+            return
+        key_string = key_to_string(KeyCode.from_char(key))
+        # replaced rather than appended to, since the listener's thread may be reading it
+        self.bindings[key_string] = [*self.bindings.get(key_string, []), callback]
+
+    def unbind(self, key: str, callback):
+        """Stops calling the callback when the key is released.
+
+        Args:
+            key (str): The key it was bound to.
+            callback (callable): The callback that was bound.
+        """
+        if key is None:
+            return
+        key_string = key_to_string(KeyCode.from_char(key))
+        self.bindings[key_string] = [
+            bound_callback
+            for bound_callback in self.bindings.get(key_string, [])
+            if bound_callback is not callback
+        ]
+
+    def start(self):
+        """Starts listening to the keyboard on a background thread."""
+        self.listener = keyboard.Listener(on_release=self.on_release)
+        self.listener.daemon = True
+        self.listener.start()
+
+    def stop(self):
+        """Stops listening to the keyboard."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def on_release(self, key: KeyCode):
+        """Runs the callbacks bound to the released key.
+
+        Args:
+            key (KeyCode): The key that was released.
+        """
+        for callback in self.bindings.get(key_to_string(KeyCode.from_char(key)), []):
+            callback()
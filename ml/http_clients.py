@@ -0,0 +1,121 @@
+import asyncio
+import importlib.util
+
+from elevenlabs.client import ElevenLabs
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from rich import print
+import httpx
+
+ELEVENLABS_BASE_URL = "https://api.elevenlabs.io/"
+
+
+class SharedHttpClients:
+    """One pooled HTTP client per provider, shared by every character, so connections are reused between turns.
+
+    Connections are kept alive between requests, opened ahead of time by warm_up, and optionally kept open through quiet spells by keep_warm.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry_seconds: float = 120,
+        timeout_seconds: float = 60,
+        http2: bool = False,
+    ):
+        """Creates the HTTP clients without connecting anywhere yet.
+
+        Args:
+            max_connections (int, optional): The most connections open at once to each provider. Defaults to 20.
+            max_keepalive_connections (int, optional): The most idle connections kept open to each provider. Defaults to 10.
+            keepalive_expiry_seconds (float, optional): How long an idle connection is kept open. Defaults to 120.
+            timeout_seconds (float, optional): How long to wait for a response before giving up. Defaults to 60.
+            http2 (bool, optional): Use HTTP/2 where the provider supports it, requires the h2 package. Defaults to False.
+        """
+        if http2 and importlib.util.find_spec("h2") is None:
+            print(
+                "[red]\nHTTP/2 was enabled but the h2 package is not installed (pip install h2), using HTTP/1.1."
+            )
+            http2 = False
+        self.http2 = http2
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry_seconds,
+        )
+        timeout = httpx.Timeout(timeout_seconds, connect=10.0)
+
+        # used on the orchestrator's event loop
+        self.openai_http_client = DefaultAsyncHttpxClient(
+            limits=limits, timeout=timeout, http2=http2
+        )
+        # the 11labs SDK is synchronous and called from worker threads, httpx.Client is thread-safe
+        self.elevenlabs_http_client = httpx.Client(
+            limits=limits, timeout=timeout, http2=http2, follow_redirects=True
+        )
+        # (api key, base url) -> client
+        self.openai_clients = {}
+        self.elevenlabs_clients = {}
+
+    def openai_client(self, api_key: str, base_url: str = None) -> AsyncOpenAI:
+        """Returns the OpenAI client for the API key, sharing the pooled connections.
+
+        Args:
+            api_key (str): The API key for accessing OpenAI services.
+            base_url (str, optional): An OpenAI compatible endpoint to use instead of OpenAI's. Defaults to None.
+
+        Returns:
+            AsyncOpenAI: The client, the same one for every character using this key and endpoint.
+        """
+        client = self.openai_clients.get((api_key, base_url), None)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key, base_url=base_url, http_client=self.openai_http_client
+            )
+            self.openai_clients[(api_key, base_url)] = client
+        return client
+
+    def elevenlabs_client(self, api_key: str) -> ElevenLabs:
+        """Returns the ElevenLabs client for the API key, sharing the pooled connections.
+
+        Args:
+            api_key (str): The API key used to authenticate with ElevenLabs.
+
+        Returns:
+            ElevenLabs: The client, the same one for every caller using this key.
+        """
+        client = self.elevenlabs_clients.get(api_key, None)
+        if client is None:
+            client = ElevenLabs(
+                api_key=api_key, httpx_client=self.elevenlabs_http_client
+            )
+            self.elevenlabs_clients[api_key] = client
+        return client
+
+    async def warm_up(self):
+        """Opens a connection to each provider in use, so the first turn doesn't wait on DNS and the TLS handshake.
+
+        The requests are unauthenticated, any response at all means the connection is ready to be reused.
+        """
+        requests = []
+        if self.openai_clients:
+            base_url = str(next(iter(self.openai_clients.values())).base_url)
+            requests.append(self.openai_http_client.get(base_url))
+        if self.elevenlabs_clients:
+            requests.append(
+                asyncio.to_thread(self.elevenlabs_http_client.get, ELEVENLABS_BASE_URL)
+            )
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"[red]\nFailed to warm up a connection: {result}")
+
+    async def keep_warm(self, interval_seconds: float):
+        """Warms up the connections every interval until cancelled, so they aren't closed by the provider during quiet spells.
+
+        Args:
+            interval_seconds (float): How often to warm up, should be less than the providers' idle timeout.
+        """
+        while True:
+            await self.warm_up()
+            await asyncio.sleep(interval_seconds)
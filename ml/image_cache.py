@@ -0,0 +1,198 @@
+from collections import OrderedDict
+from tkinter import PhotoImage
+import base64
+import hashlib
+import queue
+import threading
+
+from rich import print
+
+
+class ImageCache:
+    """Shared cache of decoded character images.
+
+    Files are identified by a hash of their contents so byte-identical images (EG: every state using the same png)
+    are only decoded once, no matter how many states or characters point at them.
+    The decoded images are kept in least recently used order and evicted once the decoded memory budget is exceeded.
+    """
+
+    def __init__(self, max_decoded_bytes: int = 256 * 1024 * 1024):
+        """Initializes an empty image cache.
+
+        Args:
+            max_decoded_bytes (int, optional): How many bytes of decoded images to keep before evicting the least recently used ones. Defaults to 256MB.
+        """
+        self.max_decoded_bytes = max_decoded_bytes
+        # file path -> hash of the file's contents
+        self.digest_by_path = {}
+        # hash of the file's contents -> (PhotoImage, decoded size in bytes)
+        self.images = OrderedDict()
+        self.decoded_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.deduplicated = 0
+
+        # files read and hashed by the preload thread waiting to be decoded on the Tk thread
+        self.preload_queue = queue.SimpleQueue()
+        self.preload_remaining = 0
+        self.lock = threading.Lock()
+
+    def get(self, file_path: str) -> PhotoImage:
+        """Returns the decoded image for the given file, decoding it now if it has not been preloaded.
+
+        Must be called from the Tk thread.
+
+        Args:
+            file_path (str): The path to the image file.
+
+        Returns:
+            PhotoImage: The decoded image.
+        """
+        digest = self.digest_by_path.get(file_path, None)
+        if digest is not None and digest in self.images:
+            self.hits += 1
+            self.images.move_to_end(digest)
+            return self.images[digest][0]
+
+        self.misses += 1
+        with open(file_path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        return self.add(file_path, digest, base64.b64encode(data))
+
+    def add(self, file_path: str, digest: str, encoded_data: bytes) -> PhotoImage:
+        """Decodes and stores an image unless an identical one is already decoded.
+
+        Must be called from the Tk thread.
+
+        Args:
+            file_path (str): The path to the image file.
+            digest (str): The hash of the file's contents.
+            encoded_data (bytes): The base64 encoded contents of the file.
+
+        Returns:
+            PhotoImage: The decoded image.
+        """
+        self.digest_by_path[file_path] = digest
+        if digest in self.images:
+            self.deduplicated += 1
+            self.images.move_to_end(digest)
+            return self.images[digest][0]
+
+        image = PhotoImage(data=encoded_data)
+        # Tk stores decoded images as 32 bit RGBA
+        decoded_size = image.width() * image.height() * 4
+        self.images[digest] = (image, decoded_size)
+        self.decoded_bytes += decoded_size
+
+        # evict the least recently used images until we're back under budget, always keeping the newest one
+        while self.decoded_bytes > self.max_decoded_bytes and len(self.images) > 1:
+            _, (_, evicted_size) = self.images.popitem(last=False)
+            self.decoded_bytes -= evicted_size
+            self.evictions += 1
+        return image
+
+    def preload(self, root, file_paths: list[str]):
+        """Preloads the given images without blocking the Tk thread.
+
+        Reading and hashing the files happens on a background thread, and the Tk thread decodes one unique image per tick.
+
+        Args:
+            root (tk.Tk): The root Tkinter window, used to schedule decoding on its thread.
+            file_paths (list[str]): The image files to preload, duplicates are ignored.
+        """
+        unique_file_paths = [
+            file_path
+            for file_path in dict.fromkeys(file_paths)
+            if file_path is not None and file_path not in self.digest_by_path
+        ]
+        if len(unique_file_paths) <= 0:
+            return
+        with self.lock:
+            self.preload_remaining += len(unique_file_paths)
+
+        preload_thread = threading.Thread(
+            target=self.read_files,
+            daemon=True,
+            kwargs={"file_paths": unique_file_paths},
+        )
+        preload_thread.start()
+        root.after(0, self.decode_next, root)
+
+    def read_files(self, file_paths: list[str]):
+        """Reads and hashes each file, handing them to the Tk thread to be decoded.
+
+        Args:
+            file_paths (list[str]): The image files to read.
+        """
+        for file_path in file_paths:
+            try:
+                with open(file_path, "rb") as f:
+                    data = f.read()
+                digest = hashlib.sha1(data).hexdigest()
+                self.preload_queue.put((file_path, digest, base64.b64encode(data)))
+            except Exception as e:
+                print(f"[red]\nError preloading image {file_path}: {e}")
+                self.preload_queue.put((file_path, None, None))
+
+    def decode_next(self, root):
+        """Decodes the next preloaded image, then reschedules itself until all are done.
+
+        Args:
+            root (tk.Tk): The root Tkinter window.
+        """
+        try:
+            file_path, digest, encoded_data = self.preload_queue.get_nowait()
+        except queue.Empty:
+            # the reader thread hasn't caught up yet
+            root.after(10, self.decode_next, root)
+            return
+
+        if digest is not None and file_path not in self.digest_by_path:
+            try:
+                self.add(file_path, digest, encoded_data)
+            except Exception as e:
+                print(f"[red]\nError decoding image {file_path}: {e}")
+
+        with self.lock:
+            self.preload_remaining -= 1
+            remaining = self.preload_remaining
+        if remaining > 0:
+            root.after(1, self.decode_next, root)
+        else:
+            self.print_stats(prefix="Finished preloading images.")
+
+    def stats(self) -> dict:
+        """Returns statistics on how effective the cache is.
+
+        Returns:
+            dict: Hits, misses, hit rate, number of files and unique decoded images, decoded bytes, and evictions.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "files": len(self.digest_by_path),
+            "decoded_images": len(self.images),
+            "deduplicated": self.deduplicated,
+            "decoded_bytes": self.decoded_bytes,
+            "max_decoded_bytes": self.max_decoded_bytes,
+            "evictions": self.evictions,
+        }
+
+    def print_stats(self, prefix: str = "Image cache"):
+        """Prints the cache statistics.
+
+        Args:
+            prefix (str, optional): Text to print before the statistics.
+        """
+        stats = self.stats()
+        print(
+            f"[yellow]\n{prefix} {stats['files']} files, {stats['decoded_images']} unique images, "
+            f"{stats['decoded_bytes'] / (1024 * 1024):.1f}MB decoded, "
+            f"hit rate {stats['hit_rate']:.1%} ({stats['hits']} hits / {stats['misses']} misses), "
+            f"{stats['evictions']} evictions."
+        )
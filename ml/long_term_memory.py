@@ -0,0 +1,365 @@
+import json
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+from rich import print
+
+from .chat_message import ChatMessage
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """Embeds text by hashing its words, and pairs of words, into a fixed number of dimensions.
+
+    A stand-in that needs no model and is fast enough to use anywhere, but it only matches memories that share words with the prompt, not meaning.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        """Initializes the embedder.
+
+        Args:
+            dimensions (int, optional): The size of each vector. Defaults to 512.
+        """
+        self.dimensions = dimensions
+        self.name = f"hashing:{dimensions}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Returns a unit length vector for each text.
+
+        Args:
+            texts (list[str]): The texts.
+
+        Returns:
+            np.ndarray: Float32, shaped (len(texts), dimensions).
+        """
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = WORD_PATTERN.findall(text.lower())
+            features = words + [
+                f"{first} {second}" for first, second in zip(words, words[1:])
+            ]
+            for feature in features:
+                # crc32 rather than hash(), which changes every run, since the vectors are saved
+                feature_hash = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if feature_hash & 1 else -1.0
+                vectors[row, (feature_hash >> 1) % self.dimensions] += sign
+        return normalize_rows(vectors)
+
+
+class TransformersEmbedder:
+    """Embeds text with a sentence embedding model from huggingface, run locally, so memories about the same thing match even in different words."""
+
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        batch_size: int = 32,
+    ):
+        """Loads the model, downloading it the first time.
+
+        Args:
+            model_name (str, optional): The model on huggingface. Defaults to "sentence-transformers/all-MiniLM-L6-v2".
+            batch_size (int, optional): How many texts are embedded at once. Defaults to 32.
+        """
+        # only imported when a local model is actually used
+        from transformers import AutoModel, AutoTokenizer
+
+        print(f"[yellow]\nLoading {model_name} for long term memory...")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name)
+        self.model.eval()
+        self.batch_size = batch_size
+        self.name = f"transformers:{model_name}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Returns a unit length vector for each text, the mean of its tokens' embeddings.
+
+        Args:
+            texts (list[str]): The texts.
+
+        Returns:
+            np.ndarray: Float32, shaped (len(texts), the model's hidden size).
+        """
+        import torch
+
+        batches = []
+        with torch.no_grad():
+            for start in range(0, len(texts), self.batch_size):
+                inputs = self.tokenizer(
+                    texts[start : start + self.batch_size],
+                    padding=True,
+                    truncation=True,
+                    return_tensors="pt",
+                )
+                token_embeddings = self.model(**inputs).last_hidden_state
+                mask = inputs["attention_mask"].unsqueeze(-1).float()
+                mean = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(
+                    min=1e-9
+                )
+                batches.append(mean.numpy().astype(np.float32))
+        if not batches:
+            return np.zeros((0, 0), dtype=np.float32)
+        return normalize_rows(np.concatenate(batches))
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scales each row to unit length, so a dot product is the cosine similarity. Rows of zeros are left as they are."""
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(lengths, 1e-12)
+
+
+# the options for create_embedder()
+EMBEDDERS = ("hashing", "transformers")
+
+
+def create_embedder(embedder: str, model_name: str):
+    """Creates the embedder for the configured option.
+
+    Args:
+        embedder (str): "hashing" or "transformers".
+        model_name (str): The model on huggingface for "transformers".
+
+    Returns:
+        The embedder, with an embed(texts) method and a name.
+
+    Raises:
+        ValueError: If the embedder isn't one of the above.
+    """
+    if embedder == "hashing":
+        return HashingEmbedder()
+    if embedder == "transformers":
+        return TransformersEmbedder(model_name=model_name)
+    raise ValueError(
+        f"Unknown long term memory embedder {embedder}, expected hashing or transformers"
+    )
+
+
+class LongTermMemory:
+    """Remembers a character's messages that no longer fit in their chat history, and finds the ones relevant to a new prompt.
+
+    Messages are queued as they're trimmed from the history, then embedded and saved together on a worker thread after the turn.
+    The vectors are kept in one NumPy array, so a search is a single matrix product however many messages there are.
+    """
+
+    def __init__(
+        self,
+        index_filepath: str,
+        embedder: str = "hashing",
+        embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        top_k: int = 3,
+        min_similarity: float = 0.25,
+        max_snippet_characters: int = 400,
+    ):
+        """Initializes the memory, reading the index saved at index_filepath if there is one.
+
+        Args:
+            index_filepath (str): Where the index is saved, as a .npz file.
+            embedder (str, optional): "hashing" or "transformers", see create_embedder(). Defaults to "hashing".
+            embedding_model_name (str, optional): The model for the "transformers" embedder. Defaults to "sentence-transformers/all-MiniLM-L6-v2".
+            top_k (int, optional): The most memories added to a prompt. Defaults to 3.
+            min_similarity (float, optional): How similar a memory must be to the prompt to be added, from 0 to 1. Defaults to 0.25.
+            max_snippet_characters (int, optional): Memories longer than this are cut short. Defaults to 400.
+        """
+        self.index_filepath = index_filepath
+        self.embedder_option = embedder
+        self.embedding_model_name = embedding_model_name
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.max_snippet_characters = max_snippet_characters
+        # created the first time it's needed, on a worker thread, since a model can take a while to load
+        self.embedder = None
+        self.embedder_lock = threading.Lock()
+        self.lock = threading.Lock()
+        # one flush at a time, since they save to the same file
+        self.flush_lock = threading.Lock()
+        self.texts = []
+        # grown by doubling, only the first len(self.texts) rows are used
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.embedder_name = None
+        # snippets waiting to be embedded
+        self.pending = []
+        self.load()
+
+    def load(self):
+        """Reads the saved index, if there is one."""
+        if not os.path.exists(self.index_filepath):
+            return
+        try:
+            with np.load(self.index_filepath, allow_pickle=False) as index:
+                texts = json.loads(index["texts"].tobytes().decode("utf-8"))
+                embedder_name = index["embedder_name"].tobytes().decode("utf-8")
+                vectors = index["vectors"]
+        except Exception as e:
+            print(
+                f"[red]\nFailed to read the long term memory {self.index_filepath}: {e}"
+            )
+            return
+        with self.lock:
+            self.texts = texts
+            self.vectors = vectors
+            self.embedder_name = embedder_name
+
+    def save(self):
+        """Writes the index, replacing the saved one only once it's complete."""
+        with self.lock:
+            texts = list(self.texts)
+            vectors = self.vectors[: len(texts)]
+            embedder_name = self.embedder_name or ""
+        directory = os.path.dirname(self.index_filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_filepath = f"{self.index_filepath}.tmp.npz"
+        np.savez(
+            temporary_filepath,
+            vectors=vectors,
+            texts=np.frombuffer(json.dumps(texts).encode("utf-8"), dtype=np.uint8),
+            embedder_name=np.frombuffer(embedder_name.encode("utf-8"), dtype=np.uint8),
+        )
+        os.replace(temporary_filepath, self.index_filepath)
+
+    def remember(self, message: ChatMessage, ai_character_name: str):
+        """Queues a message to be embedded by the next flush(), EG: when it's trimmed from the chat history.
+
+        Args:
+            message (ChatMessage): The message.
+            ai_character_name (str): The name of the character whose memory this is, who said the messages without a speaker.
+        """
+        if message.role == "system" or message.raw_content is not None:
+            return
+        text = message.text.strip()
+        if not text:
+            return
+        snippet = f"{message.speaker or ai_character_name}: {text}"
+        with self.lock:
+            self.pending.append(snippet[: self.max_snippet_characters])
+
+    def pending_mark(self) -> tuple:
+        """Marks how many messages are queued, so the ones queued after it can be forgotten, EG: by a cancelled turn.
+
+        Returns:
+            tuple: The mark, to pass to forget_pending_since().
+        """
+        with self.lock:
+            return self.pending, len(self.pending)
+
+    def forget_pending_since(self, mark: tuple):
+        """Drops the messages queued since the mark that haven't been flushed yet.
+
+        Args:
+            mark (tuple): From pending_mark().
+        """
+        pending, count = mark
+        with self.lock:
+            if self.pending is pending:
+                del self.pending[count:]
+            else:
+                # a flush took the marked queue, so everything queued now came after the mark
+                self.pending = []
+
+    def flush(self) -> int:
+        """Embeds the queued messages, adds them to the index, and saves it. Blocks, so call it on a worker thread.
+
+        Returns:
+            int: How many messages were added.
+        """
+        with self.flush_lock:
+            return self.flush_pending()
+
+    def flush_pending(self) -> int:
+        """Does the work of flush(), which must hold flush_lock."""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        embedder = self.load_embedder()
+        if self.embedder_name != embedder.name:
+            # saved with a different embedder, so the old vectors can't be compared with new ones
+            with self.lock:
+                saved_texts, self.texts = self.texts, []
+                self.embedder_name = embedder.name
+            if saved_texts:
+                print(
+                    f"[yellow]\nRe-embedding {len(saved_texts)} memories with {embedder.name}."
+                )
+            pending = saved_texts + pending
+        if not pending:
+            return 0
+        new_vectors = embedder.embed(pending)
+        with self.lock:
+            count = len(self.texts)
+            if self.vectors.shape[1] != new_vectors.shape[1]:
+                self.vectors = np.zeros((0, new_vectors.shape[1]), dtype=np.float32)
+            if count + len(pending) > len(self.vectors):
+                capacity = max(64, 2 * (count + len(pending)))
+                grown = np.zeros((capacity, new_vectors.shape[1]), dtype=np.float32)
+                grown[:count] = self.vectors[:count]
+                self.vectors = grown
+            self.vectors[count : count + len(pending)] = new_vectors
+            self.texts.extend(pending)
+        self.save()
+        return len(pending)
+
+    def search(self, prompt: str) -> list[str]:
+        """Returns the memories most relevant to the prompt. Blocks, so call it on a worker thread.
+
+        Args:
+            prompt (str): The prompt being responded to.
+
+        Returns:
+            list[str]: Up to top_k memories, the most similar first.
+        """
+        embedder = self.load_embedder()
+        with self.lock:
+            count = len(self.texts)
+            if count == 0 or self.embedder_name != embedder.name:
+                return []
+            vectors = self.vectors[:count]
+            texts = self.texts[:count]
+        query_vector = embedder.embed([prompt])[0]
+        similarities = vectors @ query_vector
+        top_k = min(self.top_k, count)
+        best = np.argpartition(-similarities, top_k - 1)[:top_k]
+        best = best[np.argsort(-similarities[best])]
+        return [
+            texts[index] for index in best if similarities[index] >= self.min_similarity
+        ]
+
+    def load_embedder(self):
+        """Returns the embedder, creating it the first time."""
+        with self.embedder_lock:
+            if self.embedder is None:
+                self.embedder = create_embedder(
+                    self.embedder_option, self.embedding_model_name
+                )
+            return self.embedder
+
+    def prompt_message(self, memories: list[str]) -> ChatMessage:
+        """Returns a system message telling the character what they remember, to send with the prompt.
+
+        Args:
+            memories (list[str]): From search().
+
+        Returns:
+            ChatMessage: The message.
+        """
+        lines = "\n".join(f"- {memory}" for memory in memories)
+        return ChatMessage(
+            "system",
+            f"Things you remember from earlier in the conversation, which may be relevant:\n{lines}",
+        )
+
+
+def memory_filepath(chat_history_filepath: str) -> str:
+    """Returns where a character's long term memory is saved, next to their chat history.
+
+    Args:
+        chat_history_filepath (str): EG: "chat_history/commander_history.json".
+
+    Returns:
+        str: EG: "chat_history/commander_memory.npz".
+    """
+    base, _ = os.path.splitext(chat_history_filepath)
+    if base.endswith("_history"):
+        base = base[: -len("_history")]
+    return f"{base}_memory.npz"
@@ -0,0 +1,83 @@
+import numpy as np
+import soundfile as sf
+from rich import print
+
+
+class LoudnessEnvelope:
+    """How loud a clip is over time, computed once when it is decoded so the render loop can animate to the voice without analysing audio every frame."""
+
+    __slots__ = ("levels", "frame_seconds")
+
+    def __init__(self, levels: np.ndarray, frame_seconds: float):
+        """Initializes the envelope.
+
+        Args:
+            levels (np.ndarray): The loudness of each frame as float32, from 0 (silent) to 1 (the loudest frame).
+            frame_seconds (float): How long each frame is.
+        """
+        self.levels = levels
+        self.frame_seconds = frame_seconds
+
+    @classmethod
+    def from_samples(
+        cls, samples: np.ndarray, sample_rate: int, frame_seconds: float = 0.02
+    ) -> "LoudnessEnvelope":
+        """Computes the RMS loudness of each frame of the samples.
+
+        Args:
+            samples (np.ndarray): The samples, shaped (frames,) or (frames, channels).
+            sample_rate (int): The samples per second.
+            frame_seconds (float, optional): How long each frame of the envelope is. Defaults to 0.02.
+
+        Returns:
+            LoudnessEnvelope: The envelope, normalized so the loudest frame is 1.
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        frame_length = max(1, int(sample_rate * frame_seconds))
+        frame_count = -(-len(samples) // frame_length)
+        # pad the last frame with silence so every frame is the same length
+        padded = np.zeros(frame_count * frame_length, dtype=np.float32)
+        padded[: len(samples)] = samples
+        levels = np.sqrt(
+            np.mean(np.square(padded.reshape(frame_count, frame_length)), axis=1)
+        )
+        peak = levels.max() if frame_count > 0 else 0.0
+        if peak > 0:
+            levels /= peak
+        return cls(levels.astype(np.float32), frame_length / sample_rate)
+
+    @classmethod
+    def from_file(
+        cls, file_path: str, frame_seconds: float = 0.02
+    ) -> "LoudnessEnvelope":
+        """Decodes an audio file and computes its envelope.
+
+        Args:
+            file_path (str): The path to the audio file.
+            frame_seconds (float, optional): How long each frame of the envelope is. Defaults to 0.02.
+
+        Returns:
+            LoudnessEnvelope: The envelope, or None if the file couldn't be decoded.
+        """
+        try:
+            samples, sample_rate = sf.read(file_path, dtype="float32", always_2d=True)
+        except Exception as e:
+            print(f"[red]\nCouldn't decode {file_path} to animate to: {e}")
+            return None
+        return cls.from_samples(samples, sample_rate, frame_seconds)
+
+    def level(self, seconds: float) -> float:
+        """Returns the loudness at a playback position.
+
+        Args:
+            seconds (float): How far into the clip playback is.
+
+        Returns:
+            float: The loudness from 0 to 1, 0 before or after the clip.
+        """
+        index = int(seconds / self.frame_seconds)
+        if index < 0 or index >= len(self.levels):
+            return 0.0
+        return float(self.levels[index])
@@ -0,0 +1,438 @@
+from contextlib import contextmanager, nullcontext
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+
+from rich import print
+
+# upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 7.5, 10, 15, 30, 60)
+# upper bounds of the histogram buckets for sizes, in characters
+CHARACTER_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+class Histogram:
+    """A Prometheus style histogram of durations, or sizes with other buckets."""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        """Initializes an empty histogram.
+
+        Args:
+            buckets (tuple, optional): The upper bounds of each bucket, in increasing order.
+        """
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Adds a value to the histogram.
+
+        Args:
+            value (float): The value to add.
+        """
+        self.sum += value
+        self.count += 1
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[index] += 1
+                break
+
+
+class TurnTrace:
+    """Times the stages of a single character's turn, from when they were given the prompt."""
+
+    def __init__(
+        self,
+        recorder,
+        turn_id: int,
+        character: str,
+        llm_backend: str,
+        tts_backend: str,
+    ):
+        """Starts timing the turn.
+
+        Args:
+            recorder (MetricsRecorder): Where to record the spans.
+            turn_id (int): Identifies this turn in the spans file.
+            character (str): The name of the character taking the turn.
+            llm_backend (str): What generates the response, EG: "openai:gpt-4o".
+            tts_backend (str): What speaks the response, EG: "elevenlabs" or "azure".
+        """
+        self.recorder = recorder
+        self.turn_id = turn_id
+        self.character = character
+        self.llm_backend = llm_backend
+        self.tts_backend = tts_backend
+        self.start_time = time.monotonic()
+        self.marks = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str, backend: str = None):
+        """Times the code inside the with block as a stage of this turn.
+
+        Args:
+            stage (str): The name of the stage, EG: "llm" or "tts_synthesis".
+            backend (str, optional): The service used for this stage, if any.
+        """
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.recorder.record_span(
+                stage=stage,
+                start_time=start_time,
+                end_time=time.monotonic(),
+                character=self.character,
+                backend=backend or "",
+                turn_id=self.turn_id,
+            )
+
+    def mark(self, name: str):
+        """Records that a milestone of the turn was reached, only the first time it happens.
+
+        "first_token" and "first_audio" are also added to their histograms.
+
+        Args:
+            name (str): The milestone, EG: "first_token" or "first_audio".
+        """
+        with self.lock:
+            if name in self.marks:
+                return
+            elapsed = time.monotonic() - self.start_time
+            self.marks[name] = elapsed
+        if name == "first_token":
+            self.recorder.observe(
+                "time_to_first_token_seconds",
+                elapsed,
+                character=self.character,
+                backend=self.llm_backend,
+            )
+        elif name == "first_audio":
+            self.recorder.observe(
+                "time_to_first_audio_seconds",
+                elapsed,
+                character=self.character,
+                backend=self.tts_backend,
+            )
+
+    def observe(
+        self,
+        metric_name: str,
+        value: float,
+        buckets: tuple = DEFAULT_BUCKETS,
+        **labels,
+    ):
+        """Adds a value measured during this turn to a histogram labelled with the character, EG: how much was added to the prompt.
+
+        Args:
+            metric_name (str): The name of the metric, without the commander_gpt_ prefix.
+            value (float): The value to add.
+            buckets (tuple, optional): The histogram's buckets, if it's new. Defaults to DEFAULT_BUCKETS.
+            **labels: Any other labels of the metric.
+        """
+        self.recorder.observe(
+            metric_name, value, buckets=buckets, character=self.character, **labels
+        )
+
+    def increment(self, metric_name: str, **labels):
+        """Counts something that happened during this turn, labelled with the character, EG: a hedged request.
+
+        Args:
+            metric_name (str): The name of the counter, without the commander_gpt_ prefix.
+            **labels: Any other labels of the counter.
+        """
+        self.recorder.increment(metric_name, character=self.character, **labels)
+
+    def finish(self):
+        """Records how long the whole turn took along with its milestones."""
+        duration = time.monotonic() - self.start_time
+        self.recorder.observe(
+            "turn_duration_seconds", duration, character=self.character
+        )
+        self.recorder.write_record(
+            {
+                "type": "turn",
+                "turn_id": self.turn_id,
+                "character": self.character,
+                "llm_backend": self.llm_backend,
+                "tts_backend": self.tts_backend,
+                "duration_seconds": duration,
+                **{f"{name}_seconds": elapsed for name, elapsed in self.marks.items()},
+            }
+        )
+
+
+class MetricsRecorder:
+    """Collects timing spans of the dialogue pipeline.
+
+    Spans are appended to a JSONL file, and histograms of them (and counters of events) are served in the Prometheus text format.
+    """
+
+    def __init__(self, spans_filepath: str = None, prometheus_port: int = None):
+        """Initializes the recorder.
+
+        Args:
+            spans_filepath (str, optional): Where to append each span as a line of JSON. Not written if None.
+            prometheus_port (int, optional): The local port to serve /metrics on. Not served if None.
+        """
+        self.spans_filepath = spans_filepath
+        self.prometheus_port = prometheus_port
+        self.lock = threading.Lock()
+        self.turn_ids = itertools.count(1)
+        # (metric name, sorted label items) -> Histogram
+        self.histograms = {}
+        # (metric name, sorted label items) -> count
+        self.counters = {}
+        self.spans_file = None
+        if spans_filepath:
+            directory = os.path.dirname(spans_filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.spans_file = open(spans_filepath, "a", buffering=1)
+
+    def start_turn(
+        self, character: str, llm_backend: str, tts_backend: str
+    ) -> TurnTrace:
+        """Starts timing a character's turn.
+
+        Args:
+            character (str): The name of the character taking the turn.
+            llm_backend (str): What generates the response, EG: "openai:gpt-4o".
+            tts_backend (str): What speaks the response, EG: "elevenlabs" or "azure".
+
+        Returns:
+            TurnTrace: Used to time the stages of the turn.
+        """
+        return TurnTrace(
+            recorder=self,
+            turn_id=next(self.turn_ids),
+            character=character,
+            llm_backend=llm_backend,
+            tts_backend=tts_backend,
+        )
+
+    @contextmanager
+    def span(self, stage: str, character: str = "", backend: str = ""):
+        """Times the code inside the with block as a stage that isn't part of a turn, EG: speech to text.
+
+        Args:
+            stage (str): The name of the stage.
+            character (str, optional): Who the stage belongs to.
+            backend (str, optional): The service used for this stage, if any.
+        """
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_span(
+                stage=stage,
+                start_time=start_time,
+                end_time=time.monotonic(),
+                character=character,
+                backend=backend,
+            )
+
+    def record_span(
+        self,
+        stage: str,
+        start_time: float,
+        end_time: float,
+        character: str = "",
+        backend: str = "",
+        turn_id: int = None,
+    ):
+        """Records a completed span.
+
+        Args:
+            stage (str): The name of the stage.
+            start_time (float): When it started, from time.monotonic().
+            end_time (float): When it ended, from time.monotonic().
+            character (str, optional): Who the stage belongs to.
+            backend (str, optional): The service used for this stage, if any.
+            turn_id (int, optional): The turn the stage was part of.
+        """
+        duration = end_time - start_time
+        self.observe(
+            "stage_duration_seconds",
+            duration,
+            stage=stage,
+            character=character,
+            backend=backend,
+        )
+        self.write_record(
+            {
+                "type": "span",
+                "turn_id": turn_id,
+                "stage": stage,
+                "character": character,
+                "backend": backend,
+                # wall clock time so spans can be lined up with other logs
+                "timestamp": time.time() - (time.monotonic() - start_time),
+                "duration_seconds": duration,
+            }
+        )
+
+    def observe(
+        self,
+        metric_name: str,
+        value: float,
+        buckets: tuple = DEFAULT_BUCKETS,
+        **labels,
+    ):
+        """Adds a value to the histogram with the given name and labels.
+
+        Args:
+            metric_name (str): The name of the metric, without the commander_gpt_ prefix.
+            value (float): The value to add.
+            buckets (tuple, optional): The histogram's buckets, if it's new. Defaults to DEFAULT_BUCKETS.
+            **labels: The labels of the metric.
+        """
+        key = (metric_name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key, None)
+            if histogram is None:
+                histogram = Histogram(buckets)
+                self.histograms[key] = histogram
+            histogram.observe(value)
+
+    def increment(self, metric_name: str, **labels):
+        """Adds one to the counter with the given name and labels.
+
+        Args:
+            metric_name (str): The name of the counter, without the commander_gpt_ prefix, ending in _total.
+            **labels: The labels of the counter.
+        """
+        key = (metric_name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def write_record(self, record: dict):
+        """Appends a record to the spans file as a line of JSON, if one is configured.
+
+        Args:
+            record (dict): The record to write.
+        """
+        if self.spans_file is None:
+            return
+        line = json.dumps(record)
+        with self.lock:
+            self.spans_file.write(line + "\n")
+
+    def render_prometheus(self) -> str:
+        """Renders every histogram and counter in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+        with self.lock:
+            items = sorted(self.histograms.items())
+            described = set()
+            for (metric_name, labels), histogram in items:
+                name = f"commander_gpt_{metric_name}"
+                if name not in described:
+                    lines.append(f"# TYPE {name} histogram")
+                    described.add(name)
+                label_text = ",".join(
+                    f'{label}="{escape_label_value(value)}"' for label, value in labels
+                )
+                separator = "," if label_text else ""
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(
+                    histogram.buckets, histogram.bucket_counts
+                ):
+                    cumulative_count += bucket_count
+                    lines.append(
+                        f'{name}_bucket{{{label_text}{separator}le="{upper_bound}"}} {cumulative_count}'
+                    )
+                lines.append(
+                    f'{name}_bucket{{{label_text}{separator}le="+Inf"}} {histogram.count}'
+                )
+                lines.append(f"{name}_sum{{{label_text}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+            for (metric_name, labels), count in sorted(self.counters.items()):
+                name = f"commander_gpt_{metric_name}"
+                if name not in described:
+                    lines.append(f"# TYPE {name} counter")
+                    described.add(name)
+                label_text = ",".join(
+                    f'{label}="{escape_label_value(value)}"' for label, value in labels
+                )
+                lines.append(f"{name}{{{label_text}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    async def serve_prometheus(self):
+        """Serves the metrics at http://127.0.0.1:<prometheus_port>/metrics until cancelled."""
+        server = await asyncio.start_server(
+            self.handle_prometheus_request, host="127.0.0.1", port=self.prometheus_port
+        )
+        print(
+            f"[yellow]\nServing metrics at http://127.0.0.1:{self.prometheus_port}/metrics"
+        )
+        async with server:
+            await server.serve_forever()
+
+    async def handle_prometheus_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """Responds to a single HTTP request with the metrics.
+
+        Args:
+            reader (asyncio.StreamReader): The request.
+            writer (asyncio.StreamWriter): Where to write the response.
+        """
+        try:
+            request_line = await reader.readline()
+            # skip the headers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[1].split("?")[0] in ("/", "/metrics"):
+                status = "200 OK"
+                body = self.render_prometheus().encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode(
+                    "latin-1"
+                )
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+def optional_span(turn_trace: TurnTrace, stage: str, backend: str = None):
+    """Times a stage of the turn if there is one being traced, otherwise does nothing.
+
+    Args:
+        turn_trace (TurnTrace): The turn being traced, or None.
+        stage (str): The name of the stage.
+        backend (str, optional): The service used for this stage, if any.
+
+    Returns:
+        A context manager timing the code inside the with block.
+    """
+    if turn_trace is None:
+        return nullcontext()
+    return turn_trace.span(stage, backend=backend)
+
+
+def escape_label_value(value) -> str:
+    """Escapes a label value for the Prometheus text format.
+
+    Args:
+        value: The label value.
+
+    Returns:
+        str: The escaped value.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
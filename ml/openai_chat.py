@@ -1,22 +1,155 @@
-from openai import OpenAI
+from openai import AsyncOpenAI
 from rich import print
+import asyncio
+import time
+from .cancellation import CancellationToken, TurnCancelled, raise_if_cancelled
+from .chat_message import ChatMessage, messages_to_dicts
+from .metrics import CHARACTER_BUCKETS, optional_span
 from .utils import screenshot_encode_monitor
 
 
+class CompletionAttempt:
+    """One streamed request for a response, which may be racing another request for the same prompt.
+
+    What it receives is kept to itself until it's chosen as the answer, so a request that loses the race never reaches the subtitles or TTS.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        model: str,
+        messages: list[dict],
+        label: str,
+        cancellation_token: CancellationToken = None,
+    ):
+        """Starts the request.
+
+        Args:
+            client (AsyncOpenAI): The client to send it with.
+            model (str): The model to ask.
+            messages (list[dict]): The chat history and prompt, in the API's format.
+            label (str): "primary", or "hedge" for the request sent when the primary was too slow.
+            cancellation_token (CancellationToken, optional): Stops receiving the response when cancelled.
+        """
+        self.model = model
+        self.label = label
+        self.role = "assistant"
+        self.answer_parts = []
+        self.started_at = time.monotonic()
+        self.first_token = asyncio.Event()
+        # called with each part of the answer once this is chosen as the answer
+        self.on_content = None
+        self.task = asyncio.create_task(
+            self.stream_answer(client, messages, cancellation_token)
+        )
+        # the request that loses the race is cancelled, or may fail, and nothing waits for it
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def stream_answer(
+        self,
+        client: AsyncOpenAI,
+        messages: list[dict],
+        cancellation_token: CancellationToken = None,
+    ) -> tuple[str, str]:
+        """Streams the response, keeping each part of it.
+
+        Returns:
+            tuple[str, str]: The role the model answered with, and its answer.
+
+        Raises:
+            TurnCancelled: If the cancellation token was cancelled.
+        """
+        stream = await client.chat.completions.create(
+            model=self.model, messages=messages, stream=True
+        )
+        try:
+            async for chunk in stream:
+                if cancellation_token is not None and cancellation_token.cancelled:
+                    raise TurnCancelled()
+                if len(chunk.choices) <= 0:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.role:
+                    self.role = delta.role
+                if delta.content:
+                    self.answer_parts.append(delta.content)
+                    self.first_token.set()
+                    if self.on_content is not None:
+                        self.on_content(delta.content)
+        finally:
+            # stop receiving the rest and free the connection, if it was cancelled or lost the race
+            await stream.close()
+        return self.role, "".join(self.answer_parts)
+
+    async def wait_for_response(self):
+        """Waits until the first token arrives, or the request ends without one."""
+        first_token = asyncio.create_task(self.first_token.wait())
+        try:
+            await asyncio.wait(
+                {first_token, self.task}, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            first_token.cancel()
+
+    @property
+    def failed(self) -> bool:
+        """Whether the request ended without any of an answer, EG: from an error."""
+        return self.task.done() and not self.first_token.is_set()
+
+
+async def first_to_respond(
+    attempts: list[CompletionAttempt], timeout: float = None
+) -> CompletionAttempt:
+    """Waits for the first of the requests to receive a token or end.
+
+    Args:
+        attempts (list[CompletionAttempt]): The requests.
+        timeout (float, optional): The most seconds to wait, or None to wait as long as it takes.
+
+    Returns:
+        CompletionAttempt: The first request to respond, or None if none did within the timeout.
+    """
+    waiters = {
+        asyncio.create_task(attempt.wait_for_response()): attempt
+        for attempt in attempts
+    }
+    try:
+        done, _ = await asyncio.wait(
+            waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+    if not done:
+        return None
+    # a token may have arrived for more than one, prefer the one that was asked first
+    return next(waiters[waiter] for waiter in waiters if waiter in done)
+
+
 class OpenAiManager:
     """Manager for interacting with OpenAI's GPT models, handling chat history and image input."""
 
-    def __init__(self, openai_api_key: str, local_model=None, local_tokenizer=None):
+    def __init__(
+        self,
+        openai_api_key: str,
+        local_model=None,
+        local_tokenizer=None,
+        client: AsyncOpenAI = None,
+        hedge_client: AsyncOpenAI = None,
+    ):
         """Initializes the OpenAiManager with an API key for OpenAI access.
 
         Args:
             openai_api_key (str): The API key for accessing OpenAI services.
+            client (AsyncOpenAI, optional): The client to use instead of creating one, EG: one shared by every character.
+            hedge_client (AsyncOpenAI, optional): The client for requests hedging a slow one, EG: for a different endpoint. Defaults to the client.
 
         Raises:
             Exception: If the OpenAI client setup fails.
         """
         self.chat_history = []
         self.first_time_run = True
+        self.hedge_client = hedge_client
         if local_model and local_tokenizer:
             try:
                 self.local_model = local_model
@@ -26,12 +159,12 @@ class OpenAiManager:
                 exit(e)
         else:
             try:
-                self.client = OpenAI(api_key=openai_api_key)
+                self.client = client or AsyncOpenAI(api_key=openai_api_key)
             except Exception as e:
                 print("Failed to setup OpenAI")
                 exit(e)
 
-    def chat_with_history(
+    async def chat_with_history(
         self,
         ai_character,
         prompt="",
@@ -39,6 +172,11 @@ class OpenAiManager:
         max_history_length_messages=100,
         model="gpt-4o",
         other_ai_characters=[],
+        turn_trace=None,
+        record_prompt=True,
+        chat_history=None,
+        response_stream=None,
+        cancellation_token: CancellationToken = None,
     ):
         """Asks a question to the OpenAI model, including the full conversation history, with optional image input.
 
@@ -49,26 +187,35 @@ class OpenAiManager:
             max_history_length_messages (int, optional): The maximum number of messages to keep in the conversation history. Older messages will be discarded. Defaults to 100.
             model (str, optional): The model to use for the completion request. Defaults to "gpt-4o".
             other_ai_characters (list[AICharacter]): A list of other characters to also give the chat history to.
+            turn_trace (TurnTrace, optional): Records when the first token of the response arrives.
+            record_prompt (bool, optional): Whether to add the prompt to this and the other characters' histories, False if another character answering the same prompt already did. Defaults to True.
+            chat_history (list[ChatMessage], optional): The history to send instead of this character's, EG: from before another character answering the same prompt added it. Defaults to their history.
+            response_stream (ResponseFilterStream, optional): Fed the response as it streams in, so it's filtered by the time it finishes.
+            cancellation_token (CancellationToken, optional): Stops generating the response when cancelled, without adding it to the history.
         Returns:
             str: The model's response to the prompt.
 
         Raises:
-            None: Prints errors or details if the prompt is empty or if history exceeds the configured limit.
+            TurnCancelled: If the cancellation token was cancelled.
         """
         # if no prompt was given the AI should be told to just continue.
         if not prompt:
             prompt = "Continue."
 
-        chat_history_to_send = self.chat_history.copy()
+        chat_history_to_send = messages_to_dicts(
+            self.chat_history if chat_history is None else chat_history
+        )
         # Add our prompt into the chat history which will not include images
-        prompt_for_our_history = [
-            {"type": "text", "text": f"\n[{ai_character.users_name}]\n{prompt}"}
-        ]
+        prompt_for_our_history = ChatMessage(
+            "user", prompt, speaker=ai_character.users_name, as_parts=True
+        )
         # prompt we will send which includes text history + any new image
         prompt_json = []
         if monitor_to_screenshot > 0:
             print(f"[yellow]\nIncluding screenshot of monitor {monitor_to_screenshot}")
-            base64_image = screenshot_encode_monitor(monitor_to_screenshot)
+            base64_image = await asyncio.to_thread(
+                screenshot_encode_monitor, monitor_to_screenshot
+            )
             prompt_json.append(
                 {
                     "type": "image_url",
@@ -78,13 +225,14 @@ class OpenAiManager:
         # Add the text prompt as well
         prompt_json.append({"type": "text", "text": prompt})
 
-        self.chat_history.append({"role": "user", "content": prompt_for_our_history})
         chat_history_to_send.append({"role": "user", "content": prompt_json})
-        # share what we said to the other AI's as well
-        for other_ai_character in other_ai_characters:
-            other_ai_character.openai_manager.chat_history.append(
-                {"role": "user", "content": prompt_for_our_history}
-            )
+        if record_prompt:
+            self.chat_history.append(prompt_for_our_history)
+            # share what we said to the other AI's as well
+            for other_ai_character in other_ai_characters:
+                other_ai_character.openai_manager.chat_history.append(
+                    prompt_for_our_history
+                )
 
         # Trim the chat history if it exceeds the maximum length
         if len(self.chat_history) > max_history_length_messages:
@@ -93,69 +241,275 @@ class OpenAiManager:
             )
             # remove the 2nd history entry, leaving the 1st because it is the system message with their personality
             # and we don't want them to forget that
-            self.chat_history.pop(1)
+            trimmed_message = self.chat_history.pop(1)
+            if ai_character.long_term_memory is not None:
+                ai_character.long_term_memory.remember(
+                    trimmed_message, ai_character.name
+                )
+        memory_message = None
+        if ai_character.long_term_memory is not None:
+            memory_message = await self.recall(ai_character, prompt, turn_trace)
+            if memory_message is not None:
+                # after their personality, before the conversation
+                chat_history_to_send.insert(1, memory_message.to_dict())
         if ai_character.local_model_name:
             print(f"[yellow]\nAsking {ai_character.local_model_name} a question...")
             full_prompt = ""
             if self.first_time_run:
                 print("First message sent, so including any chat history as well.")
                 for chat in self.chat_history:
-                    text = chat["content"][0]["text"]
+                    text = chat.content_text
                     full_prompt = f"{full_prompt}\n{text}"
                 self.first_time_run = False
             else:
                 full_prompt = prompt
+            if memory_message is not None:
+                full_prompt = f"{memory_message.text}\n{full_prompt}"
             print("full_prompt: ", full_prompt)
-            input_ids = self.local_tokenizer.encode(full_prompt, return_tensors="pt")
-            local_output = self.local_model.generate(input_ids, max_new_tokens=100)
-            openai_answer = (
-                str(
-                    self.local_tokenizer.decode(
-                        local_output[0], skip_special_tokens=True
-                    )
-                )
-                .replace(full_prompt, "")
-                .replace("<think>", "")
-                .replace("</think>", "")
-            )
-            # Add the model's response to the chat history
-            self.chat_history.append(
-                {
-                    "role": "assistant",
-                    "content": openai_answer,
-                }
+            # generating blocks, so keep it off of the event loop
+            openai_answer = await asyncio.to_thread(
+                self.generate_local, full_prompt, cancellation_token
             )
-            # share what we said to the other AI's as well
-            for other_ai_character in other_ai_characters:
-                other_ai_character.openai_manager.chat_history.append(
-                    {
-                        "role": "user",
-                        "content": f"\n[{ai_character.name}]\n{openai_answer}",
-                    }
-                )
+            raise_if_cancelled(cancellation_token)
+            if turn_trace is not None:
+                # the local model returns its whole answer at once
+                turn_trace.mark("first_token")
+            if response_stream is not None:
+                response_stream.feed(openai_answer)
+            role = "assistant"
         else:
             print("[yellow]\nAsking ChatGPT a question...")
-            completion = self.client.chat.completions.create(
-                model=model, messages=chat_history_to_send
+            role, openai_answer = await self.request_answer(
+                ai_character,
+                chat_history_to_send,
+                model,
+                turn_trace=turn_trace,
+                response_stream=response_stream,
+                cancellation_token=cancellation_token,
             )
-            # Add the model's response to the chat history
-            self.chat_history.append(
-                {
-                    "role": completion.choices[0].message.role,
-                    "content": completion.choices[0].message.content,
-                }
+
+        if not openai_answer:
+            # an empty answer is treated as no response, so keep it out of the history sent with later requests
+            return openai_answer
+        # Add the model's response to the chat history
+        self.record_answer(ai_character, role, openai_answer, other_ai_characters)
+        print(f"[green]\n{openai_answer}\n")
+        return openai_answer
+
+    async def request_answer(
+        self,
+        ai_character,
+        messages: list[dict],
+        model: str,
+        turn_trace=None,
+        response_stream=None,
+        cancellation_token: CancellationToken = None,
+    ) -> tuple[str, str]:
+        """Streams a response from OpenAI, hedging with a second request if the first is too slow to start.
+
+        If the character's first_token_deadline_seconds passes without a token, or the request fails before then,
+        the same messages are sent to their hedge_model_name. The first request to receive a token is the answer and the other is cancelled.
+
+        Args:
+            ai_character (AICharacter): The character being prompted.
+            messages (list[dict]): The chat history and prompt, in the API's format.
+            model (str): The model to ask first.
+            turn_trace (TurnTrace, optional): Records when the first token arrives, and which requests were hedged.
+            response_stream (ResponseFilterStream, optional): Fed the answer as it streams in.
+            cancellation_token (CancellationToken, optional): Stops receiving the answer when cancelled.
+
+        Returns:
+            tuple[str, str]: The role the model answered with, and its answer.
+
+        Raises:
+            TurnCancelled: If the cancellation token was cancelled.
+        """
+        deadline_seconds = ai_character.first_token_deadline_seconds
+        attempts = [
+            CompletionAttempt(
+                self.client, model, messages, "primary", cancellation_token
             )
-            # share what we said to the other AI's as well
+        ]
+        if turn_trace is not None:
+            turn_trace.increment("llm_requests_total", model=model, attempt="primary")
+        try:
+            while True:
+                raise_if_cancelled(cancellation_token)
+                waiting = [attempt for attempt in attempts if not attempt.failed]
+                if not waiting:
+                    # every request failed, raise the last one's error
+                    return await attempts[-1].task
+                can_hedge = deadline_seconds > 0 and len(attempts) == 1
+                responded = await first_to_respond(
+                    waiting, deadline_seconds if can_hedge else None
+                )
+                if responded is not None and not responded.failed:
+                    break
+                if responded is not None and turn_trace is not None:
+                    turn_trace.increment(
+                        "llm_request_failures_total",
+                        model=responded.model,
+                        attempt=responded.label,
+                    )
+                if can_hedge:
+                    raise_if_cancelled(cancellation_token)
+                    if responded is None:
+                        reason = "deadline"
+                        problem = f"has no response after {deadline_seconds} seconds"
+                    else:
+                        reason = "error"
+                        problem = "failed"
+                    hedge_model = ai_character.hedge_model_name or model
+                    print(
+                        f"[yellow]\n{ai_character.name}'s request to {model} {problem}, also asking {hedge_model}."
+                    )
+                    attempts.append(
+                        CompletionAttempt(
+                            self.hedge_client or self.client,
+                            hedge_model,
+                            messages,
+                            "hedge",
+                            cancellation_token,
+                        )
+                    )
+                    if turn_trace is not None:
+                        turn_trace.increment(
+                            "llm_requests_total", model=hedge_model, attempt="hedge"
+                        )
+                        turn_trace.increment("llm_hedges_total", reason=reason)
+
+            for attempt in attempts:
+                if attempt is not responded:
+                    attempt.task.cancel()
+            if turn_trace is not None:
+                turn_trace.observe(
+                    "llm_request_first_token_seconds",
+                    time.monotonic() - responded.started_at,
+                    model=responded.model,
+                    attempt=responded.label,
+                )
+                if responded.label == "hedge":
+                    turn_trace.increment("llm_hedge_wins_total", model=responded.model)
+                    turn_trace.llm_backend = f"openai:{responded.model}"
+
+            def deliver(content: str):
+                if turn_trace is not None:
+                    turn_trace.mark("first_token")
+                if response_stream is not None:
+                    response_stream.feed(content)
+
+            # what arrived before it won, then the rest as it streams in
+            for content in responded.answer_parts:
+                deliver(content)
+            responded.on_content = deliver
+            return await responded.task
+        finally:
+            for attempt in attempts:
+                attempt.task.cancel()
+
+    async def recall(self, ai_character, prompt: str, turn_trace=None) -> ChatMessage:
+        """Searches the character's long term memory for what's relevant to the prompt.
+
+        Args:
+            ai_character (AICharacter): The character being prompted.
+            prompt (str): The prompt.
+            turn_trace (TurnTrace, optional): Times the search, and records how much it adds to the prompt.
+
+        Returns:
+            ChatMessage: A system message with the memories found, or None if there were none.
+        """
+        long_term_memory = ai_character.long_term_memory
+        with optional_span(turn_trace, "memory_retrieval"):
+            # embedding the prompt may run a model, so keep it off of the event loop
+            memories = await asyncio.to_thread(long_term_memory.search, prompt)
+        if not memories:
+            return None
+        memory_message = long_term_memory.prompt_message(memories)
+        added_characters = len(memory_message.text)
+        if turn_trace is not None:
+            turn_trace.observe(
+                "memory_prompt_characters", added_characters, CHARACTER_BUCKETS
+            )
+        print(
+            f"[yellow]\n{ai_character.name} remembered {len(memories)} things from earlier, adding {added_characters} characters to the prompt."
+        )
+        return memory_message
+
+    def record_answer(
+        self, ai_character, role: str, answer: str, other_ai_characters=[]
+    ):
+        """Adds the character's answer to their chat history, and to the other characters' as something the character said.
+
+        Args:
+            ai_character (AICharacter): The character who answered.
+            role (str): The role the model answered with, usually "assistant".
+            answer (str): The answer.
+            other_ai_characters (list[AICharacter]): A list of other characters to also give the chat history to.
+        """
+        self.chat_history.append(ChatMessage(role, answer))
+        # share what we said to the other AI's as well, the same message in each of their histories
+        shared_answer = ChatMessage("user", answer, speaker=ai_character.name)
+        for other_ai_character in other_ai_characters:
+            other_ai_character.openai_manager.chat_history.append(shared_answer)
+
+    def record_cached_response(
+        self,
+        ai_character,
+        prompt: str,
+        answer: str,
+        other_ai_characters=[],
+        record_prompt=True,
+    ):
+        """Adds a prompt and a response that was reused rather than generated to the chat history, the same way chat_with_history would.
+
+        Args:
+            ai_character (AICharacter): The character responding.
+            prompt (str): The prompt that was responded to.
+            answer (str): The reused response.
+            other_ai_characters (list[AICharacter]): A list of other characters to also give the chat history to.
+            record_prompt (bool, optional): Whether to add the prompt to this and the other characters' histories. Defaults to True.
+        """
+        if not prompt:
+            prompt = "Continue."
+        if record_prompt:
+            prompt_for_our_history = ChatMessage(
+                "user", prompt, speaker=ai_character.users_name, as_parts=True
+            )
+            self.chat_history.append(prompt_for_our_history)
             for other_ai_character in other_ai_characters:
                 other_ai_character.openai_manager.chat_history.append(
-                    {
-                        "role": "user",
-                        "content": f"\n[{ai_character.name}]\n{completion.choices[0].message.content}",
-                    }
+                    prompt_for_our_history
                 )
+        self.record_answer(ai_character, "assistant", answer, other_ai_characters)
+        print(f"[green]\n{answer}\n")
 
-            # Process and return the answer
-            openai_answer = completion.choices[0].message.content
+    def generate_local(
+        self, full_prompt: str, cancellation_token: CancellationToken = None
+    ) -> str:
+        """Generates a response to the prompt using the local model.
 
-        print(f"[green]\n{openai_answer}\n")
-        return openai_answer
+        Args:
+            full_prompt (str): The prompt to respond to.
+            cancellation_token (CancellationToken, optional): Stops generating after the current token when cancelled.
+
+        Returns:
+            str: The model's response.
+        """
+        input_ids = self.local_tokenizer.encode(full_prompt, return_tensors="pt")
+        stopping_criteria = None
+        if cancellation_token is not None:
+            # only imported when a local model is actually used
+            from transformers import StoppingCriteriaList
+
+            stopping_criteria = StoppingCriteriaList(
+                [lambda input_ids, scores, **kwargs: cancellation_token.cancelled]
+            )
+        local_output = self.local_model.generate(
+            input_ids, max_new_tokens=100, stopping_criteria=stopping_criteria
+        )
+        return (
+            str(self.local_tokenizer.decode(local_output[0], skip_special_tokens=True))
+            .replace(full_prompt, "")
+            .replace("<think>", "")
+            .replace("</think>", "")
+        )
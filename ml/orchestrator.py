@@ -0,0 +1,1447 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+
+from rich import print
+
+from .ai_character import AICharacter
+from .cancellation import CancellationToken, TurnCancelled
+from .chat_message import write_chat_history
+from .eleven_labs import audio_duration_seconds
+from .endpointing import EndpointDetector, normalize_transcript
+from .hotkeys import HotkeyListener
+from .long_term_memory import LongTermMemory
+from .loudness_envelope import LoudnessEnvelope
+from .metrics import TurnTrace, optional_span
+from .response_filter import FilteredResponse
+from .tts_router import TtsRouteChange, TtsRouter
+
+# how often the hands free mode checks whether the user has stopped talking
+END_OF_SPEECH_POLL_SECONDS = 0.02
+
+
+class SpeculativeTurn:
+    """A character's turn started on the user's transcript before they're done talking in the hands free mode.
+    It's spoken if they stop there, or cancelled if they keep talking, with the characters' histories put back as they were.
+    """
+
+    def __init__(
+        self,
+        ai_character: AICharacter,
+        prompt: str,
+        turn_trace: TurnTrace,
+        task: asyncio.Task,
+        chat_histories: dict,
+        pending_memories: dict,
+    ):
+        """Initializes the turn.
+
+        Args:
+            ai_character (AICharacter): The AI Character responding.
+            prompt (str): The transcript they're responding to.
+            turn_trace (TurnTrace): Times each stage of the turn.
+            task (asyncio.Task): The task preparing the turn.
+            chat_histories (dict): AICharacter -> a copy of their chat history from before the turn started.
+            pending_memories (dict): LongTermMemory -> its pending_mark() from before the turn started.
+        """
+        self.ai_character = ai_character
+        self.prompt = prompt
+        self.turn_trace = turn_trace
+        self.task = task
+        self.chat_histories = chat_histories
+        self.pending_memories = pending_memories
+
+
+def delete_abandoned_audio(synthesis: asyncio.Future):
+    """Deletes the audio saved by a synthesis that was given up on, since nothing will play it.
+
+    Args:
+        synthesis (asyncio.Future): The synthesis, once it's done.
+    """
+    if synthesis.cancelled() or synthesis.exception() is not None:
+        return
+    synthesized_audio = synthesis.result()
+    if synthesized_audio is not None and os.path.exists(synthesized_audio[1]):
+        os.remove(synthesized_audio[1])
+
+
+class DialogueOrchestrator:
+    """Runs the dialogue logic (mic input, the activation queue, LLM calls, TTS, and twitch chat) on a single asyncio event loop.
+
+    The event loop runs on its own thread next to the Tk mainloop.
+    Key presses arrive from a single HotkeyListener thread and are handed to the event loop,
+    and anything the UI draws is passed back to it through the app's StateHandoff.
+    """
+
+    def __init__(self, commander_gpt, loop: asyncio.AbstractEventLoop = None):
+        """Initializes the orchestrator, creating the event loop without starting it.
+
+        Args:
+            commander_gpt (CommanderGPTApp): The commander gpt app, used for its configs, characters, and libraries. Or a server's session, which provides the same.
+            loop (asyncio.AbstractEventLoop, optional): An event loop that's already running to share, EG: the server's, instead of creating one to run on its own thread. Defaults to None.
+        """
+        self.commander_gpt = commander_gpt
+        self.loop = loop or asyncio.new_event_loop()
+        self.thread = None
+        self.hotkeys = HotkeyListener()
+        # AICharacter -> the callback bound to their activation key, so it can be rebound when their config changes
+        self.activation_callbacks = {}
+
+        self.activation_queue: asyncio.Queue = None
+        # characters currently in the activation queue, so they aren't queued twice
+        self.queued_characters = set()
+        # runs activate_next_character, and is cancelled to interrupt the characters
+        self.activation_task: asyncio.Task = None
+        self.interrupted = False
+        # whether a character taken from the queue is still responding
+        self.turn_in_progress = False
+        # cancels the blocking work of the turns in progress, replaced with a new one after each interrupt
+        self.cancellation_token = CancellationToken()
+        # whether the user is recording from the mic
+        self.is_talking = False
+        self.mic_lock: asyncio.Lock = None
+        self.last_characters_response = None
+        # decides when the user is done talking in the hands free mode
+        self.endpoint_detector = EndpointDetector()
+        # picks 11labs or Azure for each line, failing over while 11labs is slow
+        self.tts_router = TtsRouter()
+        # waits for the user to stop talking in the hands free mode
+        self.end_of_speech_task: asyncio.Task = None
+        # a turn started before the user was done talking in the hands free mode
+        self.speculative_turn: SpeculativeTurn = None
+        # the long term memories being saved in the background, kept so they aren't garbage collected
+        self.memory_flush_tasks = set()
+        # when the user stopped talking, from time.monotonic(), until the first character starts talking
+        self.speech_ended_at: float = None
+        # "manual" when the user stopped with the mic key, "hands_free" when they stopped talking
+        self.speech_end_mode: str = None
+        # whether the next message sent to an ai_character would include a screenshot or not
+        self.screen_shot_enabled = False
+
+        system_config = commander_gpt.system_config
+        self.apply_system_config(system_config)
+        # without a window there may be no display to listen to the keyboard on
+        headless_config = system_config.get("headless", {})
+        self.listen_for_keys = not headless_config.get(
+            "enabled", False
+        ) or headless_config.get("listen_for_keys", False)
+        http_clients_config = system_config.get("http_clients", {})
+        self.warm_up_connections = http_clients_config.get("warm_up", True)
+        self.keep_warm_interval_seconds = http_clients_config.get(
+            "keep_warm_interval_seconds", 45
+        )
+
+    def apply_system_config(self, system_config: dict):
+        """Reads the settings that can change while the app runs, at startup and whenever system_config.json is edited.
+
+        Args:
+            system_config (dict): The contents of system_config.json.
+        """
+        self.llm_timeout_seconds = system_config.get("llm_timeout_seconds", 60)
+        self.tts_timeout_seconds = system_config.get("tts_timeout_seconds", 30)
+        # "sequential" or "ensemble"
+        self.activation_mode = system_config.get("activation_mode", "sequential")
+        hands_free_config = system_config.get("hands_free", {})
+        self.hands_free = hands_free_config.get("enabled", False)
+        self.endpoint_detector.stable_seconds = hands_free_config.get(
+            "stable_partial_seconds", 0.4
+        )
+        self.endpoint_detector.end_of_speech_seconds = hands_free_config.get(
+            "end_of_speech_seconds", 0.8
+        )
+        self.hands_free_respond_with = hands_free_config.get("respond_with", [])
+        tts_routing_config = system_config.get("tts_routing", {})
+        self.tts_router.enabled = tts_routing_config.get("enabled", False)
+        self.tts_router.latency_budget_seconds = tts_routing_config.get(
+            "latency_budget_seconds", 2.0
+        )
+        self.tts_router.window_size = tts_routing_config.get("window_size", 5)
+        self.tts_router.max_consecutive_failures = tts_routing_config.get(
+            "max_consecutive_failures", 2
+        )
+        self.tts_router.recovery_seconds = tts_routing_config.get(
+            "recovery_seconds", 60
+        )
+        self.tts_router.attempt_timeout_seconds = tts_routing_config.get(
+            "attempt_timeout_seconds", 6.0
+        )
+
+    def start(self):
+        """Starts the event loop on its own thread, which then starts listening for key presses."""
+        if self.listen_for_keys:
+            self.bind_keys()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def bind_keys(self):
+        """Binds the mic, screenshot, render profiler, and character activation keys."""
+        commander_gpt = self.commander_gpt
+        self.hotkeys.bind(
+            commander_gpt.mic_activation_key,
+            lambda: self.call_soon(
+                self.loop.create_task, self.toggle_mic(pressed_at=time.monotonic())
+            ),
+        )
+        self.hotkeys.bind(
+            commander_gpt.enable_screenshot_toggle_key,
+            lambda: self.call_soon(self.toggle_screenshot),
+        )
+        if commander_gpt.render_profiler is not None:
+            # the overlay is toggled on the Tk thread before the next frame
+            self.hotkeys.bind(
+                commander_gpt.render_profiler_toggle_key,
+                lambda: commander_gpt.state_handoff.post(
+                    commander_gpt.render_profiler, toggle_requested=True
+                ),
+            )
+        ai_character: AICharacter
+        for ai_character in commander_gpt.ai_characters:
+            print(
+                f"[green]\nStarting the loop for {ai_character.name}, press num {ai_character.activation_key} to begin"
+            )
+            self.bind_activation_key(ai_character, ai_character.activation_key)
+
+    def bind_activation_key(self, ai_character: AICharacter, activation_key: str):
+        """Binds the key that activates the character.
+
+        Args:
+            ai_character (AICharacter): The AI Character to activate.
+            activation_key (str): The key to bind, in the same format as the configs.
+        """
+        # bind the current character rather than the loop variable
+        callback = functools.partial(
+            self.call_soon, self.on_activation_key, ai_character
+        )
+        self.activation_callbacks[ai_character] = callback
+        self.hotkeys.bind(activation_key, callback)
+
+    def rebind_activation_key(
+        self,
+        ai_character: AICharacter,
+        previous_activation_key: str,
+        activation_key: str,
+    ):
+        """Moves the character's activation to a different key, EG: after their config is edited.
+
+        Args:
+            ai_character (AICharacter): The AI Character to activate.
+            previous_activation_key (str): The key they were bound to, passed in since the character's own may already be the new one.
+            activation_key (str): The new key, in the same format as the configs.
+        """
+        if not self.listen_for_keys:
+            return
+        self.hotkeys.unbind(
+            previous_activation_key, self.activation_callbacks.get(ai_character)
+        )
+        self.bind_activation_key(ai_character, activation_key)
+
+    def run(self):
+        """Runs the event loop until the app exits."""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.main(listen_for_keys=self.listen_for_keys))
+
+    def call_soon(self, callback, *args):
+        """Schedules a callback on the event loop from any thread.
+
+        Args:
+            callback (callable): The function to call on the event loop.
+            *args: Arguments to call it with.
+        """
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    async def main(self, listen_for_keys: bool = True, shared_services: bool = True):
+        """Creates the loop's primitives and runs the activation queue and twitch chat until the app exits.
+
+        Args:
+            listen_for_keys (bool, optional): Whether to listen to the keyboard, disabled when driven headlessly. Defaults to True.
+            shared_services (bool, optional): Whether to also run the connection warm up, metrics, and config reloading, False for a server's session since the server runs them once for every session. Defaults to True.
+        """
+        self.activation_queue = asyncio.Queue()
+        self.mic_lock = asyncio.Lock()
+        if listen_for_keys:
+            # only listen for keys once there's a queue to add characters to
+            self.hotkeys.start()
+            print(
+                f"[green]\nWaiting. Press {self.commander_gpt.mic_activation_key} to start talking or the activation key for any character to hear them talk."
+            )
+
+        tasks = [self.run_activation_queue()]
+        if shared_services:
+            tasks.extend(self.shared_service_tasks())
+        twitch_bot = self.commander_gpt.twitch_bot
+        if self.commander_gpt.enable_twitch_integration and twitch_bot is not None:
+            # the bot reads chat on this same event loop
+            tasks.append(twitch_bot.start())
+            for ai_character in self.commander_gpt.ai_characters:
+                tasks.append(self.handle_twitch_chat_responses(ai_character))
+        await asyncio.gather(*tasks)
+
+    def shared_service_tasks(self) -> list:
+        """Returns the services that run once per app rather than per scene.
+
+        Returns:
+            list[Awaitable]: The connection warm up, metrics server, and config reloading, whichever are enabled.
+        """
+        tasks = []
+        if self.warm_up_connections:
+            http_clients = self.commander_gpt.http_clients
+            if self.keep_warm_interval_seconds > 0:
+                tasks.append(http_clients.keep_warm(self.keep_warm_interval_seconds))
+            else:
+                tasks.append(http_clients.warm_up())
+        if self.commander_gpt.metrics.prometheus_port:
+            tasks.append(self.commander_gpt.metrics.serve_prometheus())
+        config_watcher = self.commander_gpt.config_watcher
+        if config_watcher is not None:
+            tasks.append(config_watcher.watch(self.commander_gpt.reload_config))
+        return tasks
+
+    async def run_activation_queue(self):
+        """Runs activate_next_character until the app exits, starting it again after each interrupt."""
+        while True:
+            self.activation_task = self.loop.create_task(self.activate_next_character())
+            try:
+                await self.activation_task
+            except asyncio.CancelledError:
+                if not self.interrupted:
+                    raise
+                self.interrupted = False
+
+    def is_busy(self) -> bool:
+        """Whether any character is responding, queued to respond, or still talking."""
+        return (
+            self.turn_in_progress
+            or not self.activation_queue.empty()
+            or any(
+                ai_character.state in ("thinking", "talking")
+                for ai_character in self.commander_gpt.ai_characters
+            )
+        )
+
+    def interrupt(self):
+        """Stops the characters mid turn and empties the activation queue, EG: when the user starts talking over them.
+        The requests, synthesis, and playback already running on worker threads are cancelled too.
+        Must be called on the event loop.
+        """
+        self.cancellation_token.cancel()
+        self.cancellation_token = CancellationToken()
+        self.discard_speculative_turn()
+        while not self.activation_queue.empty():
+            self.activation_queue.get_nowait()
+            self.activation_queue.task_done()
+        self.queued_characters.clear()
+        if self.activation_task is not None and not self.activation_task.done():
+            self.interrupted = True
+            self.activation_task.cancel()
+        commander_gpt = self.commander_gpt
+        commander_gpt.audio_manager.stop()
+        for ai_character in commander_gpt.ai_characters:
+            commander_gpt.state_handoff.post(
+                ai_character, state="idle", subtitles=None, loudness_envelope=None
+            )
+        commander_gpt.state_handoff.post(commander_gpt, audio_with_timestamps=None)
+        print("[yellow]\nInterrupted the characters.")
+
+    def set_prompt(self, prompt: str):
+        """Sets what the next character responds to, EG: what the user said into the mic.
+
+        Args:
+            prompt (str): The prompt, empty or None if nothing was said.
+        """
+        self.last_characters_response = prompt
+
+    async def toggle_mic(self, pressed_at: float = None):
+        """Handles the mic input.
+        The first press of the mic activation key starts recording the audio as text using Azure,
+        stopping any characters that are responding, and the next press stops recording and saves the result as the next prompt.
+        In the hands free mode recording also stops once the user stops talking, see watch_for_end_of_speech().
+
+        Args:
+            pressed_at (float, optional): When the key was pressed, from time.monotonic(), to report how long the characters took to go quiet. Defaults to None.
+        """
+        commander_gpt = self.commander_gpt
+        state_handoff = commander_gpt.state_handoff
+        async with self.mic_lock:
+            if not self.is_talking:
+                if self.is_busy():
+                    # the user talking takes priority, so stop the characters mid reply
+                    self.interrupt()
+                    if pressed_at is not None:
+                        silence_seconds = time.monotonic() - pressed_at
+                        commander_gpt.metrics.observe(
+                            "barge_in_silence_seconds", silence_seconds
+                        )
+                        print(
+                            f"[yellow]\nThe characters went quiet {silence_seconds * 1000:.0f}ms after the mic key was pressed."
+                        )
+                self.is_talking = True
+                if self.hands_free:
+                    print(
+                        f"[yellow]\nListening to mic until you stop talking, or press {commander_gpt.mic_activation_key} again."
+                    )
+                else:
+                    print(
+                        f"[yellow]\nListening to mic. Press {commander_gpt.mic_activation_key} again to stop talking."
+                    )
+                # clear state of ALL characters if you start talking
+                ai_char: AICharacter
+                for ai_char in commander_gpt.ai_characters:
+                    state_handoff.post(ai_char, state="listening", subtitles=None)
+                    # ensure to reset the user's name to the original configured one
+                    ai_char.users_name = ai_char.original_users_name
+
+                on_transcript = None
+                if self.hands_free:
+                    self.endpoint_detector.reset()
+                    on_transcript = self.endpoint_detector.update
+                await asyncio.to_thread(
+                    commander_gpt.speech_recognizer.start_speechtotext_from_mic,
+                    commander_gpt,
+                    on_transcript,
+                )
+                if self.hands_free:
+                    self.end_of_speech_task = self.loop.create_task(
+                        self.watch_for_end_of_speech()
+                    )
+                return
+
+            if self.end_of_speech_task is not None:
+                # pressed before the end of speech was detected, so stop listening straight away
+                self.end_of_speech_task.cancel()
+                self.end_of_speech_task = None
+            # get mic result
+            speech_recognizer = commander_gpt.speech_recognizer
+            with commander_gpt.metrics.span(
+                "stt_finalize", backend=speech_recognizer.backend_name
+            ):
+                mic_result = await asyncio.to_thread(
+                    speech_recognizer.stop_speechtotext_from_mic
+                )
+            state_handoff.post(commander_gpt, subtitles=mic_result)
+            self.set_prompt(mic_result)
+            self.speech_ended_at = pressed_at
+            self.speech_end_mode = "manual"
+            print("[green]\nDone listening to mic.")
+            self.is_talking = False
+            if self.hands_free and mic_result:
+                self.activate_hands_free_responders()
+                return
+            print(
+                f"[green]\nWaiting. Press {commander_gpt.mic_activation_key} to start talking or the activation key for any character to hear them talk."
+            )
+
+    async def watch_for_end_of_speech(self):
+        """Stops recording once the user stops talking in the hands free mode, then activates the characters who respond.
+
+        Once the transcript stops changing for a moment the first of them starts responding to it speculatively,
+        so the response is already on its way when the user is done. If they keep talking instead it's cancelled.
+        """
+        speculative_turn = None
+        try:
+            while True:
+                await asyncio.sleep(END_OF_SPEECH_POLL_SECONDS)
+                status, transcript = self.endpoint_detector.poll()
+                if speculative_turn is not None and normalize_transcript(
+                    transcript
+                ) != normalize_transcript(speculative_turn.prompt):
+                    # they kept talking, so the response is to the wrong prompt
+                    self.cancel_speculative_turn(speculative_turn)
+                    speculative_turn = None
+                if status == "ended":
+                    break
+                if status == "stable" and speculative_turn is None:
+                    speculative_turn = self.start_speculative_turn(transcript)
+
+            commander_gpt = self.commander_gpt
+            async with self.mic_lock:
+                self.end_of_speech_task = None
+                self.speech_ended_at = self.endpoint_detector.last_changed_at
+                self.speech_end_mode = "hands_free"
+                commander_gpt.state_handoff.post(commander_gpt, subtitles=transcript)
+                if speculative_turn is not None:
+                    # respond to the same words the speculative turn was started on, so it's used
+                    transcript = speculative_turn.prompt
+                    self.speculative_turn, speculative_turn = speculative_turn, None
+                self.set_prompt(transcript)
+                print(f"[green]\nDone listening to mic.\n> {transcript}")
+                self.is_talking = False
+                self.activate_hands_free_responders()
+                # the transcript is already known, so the characters don't wait for the recognizer to finish stopping
+                await asyncio.to_thread(
+                    commander_gpt.speech_recognizer.stop_speechtotext_from_mic
+                )
+        except asyncio.CancelledError:
+            if speculative_turn is not None:
+                self.cancel_speculative_turn(speculative_turn)
+            raise
+
+    def hands_free_responders(self) -> list:
+        """Returns the characters who respond when the user stops talking in the hands free mode.
+
+        Returns:
+            list[AICharacter]: The characters listed in the hands_free config's respond_with, by name or key, or else the first character.
+        """
+        commander_gpt = self.commander_gpt
+        respond_with = self.hands_free_respond_with
+        ai_characters = [
+            ai_character
+            for ai_character in commander_gpt.ai_characters
+            if ai_character.name in respond_with
+            or commander_gpt.character_config_keys.get(ai_character) in respond_with
+        ]
+        return ai_characters or commander_gpt.ai_characters[:1]
+
+    def activate_hands_free_responders(self):
+        """Activates the characters who respond when the user stops talking in the hands free mode."""
+        for ai_character in self.hands_free_responders():
+            print(f"[yellow]\n{ai_character.name} has been queued up to talk.")
+            self.activate_character(ai_character)
+
+    def start_speculative_turn(self, prompt: str) -> SpeculativeTurn:
+        """Starts preparing the first hands free responder's turn before the user is done talking.
+
+        Args:
+            prompt (str): The transcript so far.
+
+        Returns:
+            SpeculativeTurn: The turn being prepared.
+        """
+        # a turn confirmed earlier that was never spoken is stale now
+        self.discard_speculative_turn()
+        ai_character = self.hands_free_responders()[0]
+        chat_histories = {
+            other_ai_character: other_ai_character.openai_manager.chat_history.copy()
+            for other_ai_character in self.commander_gpt.ai_characters
+        }
+        # the messages it trims from the histories are queued to be remembered, and forgotten if it's cancelled
+        pending_memories = {
+            other_ai_character.long_term_memory: other_ai_character.long_term_memory.pending_mark()
+            for other_ai_character in self.commander_gpt.ai_characters
+            if other_ai_character.long_term_memory is not None
+        }
+        turn_trace = self.start_turn_trace(ai_character)
+        task = self.loop.create_task(
+            self.prepare_turn(ai_character, prompt, turn_trace)
+        )
+        # a failure is reported when the turn is delivered, or doesn't matter if it's cancelled
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return SpeculativeTurn(
+            ai_character, prompt, turn_trace, task, chat_histories, pending_memories
+        )
+
+    def cancel_speculative_turn(self, speculative_turn: SpeculativeTurn):
+        """Cancels a turn that was started before the user was done talking, undoing its changes to the characters' histories.
+
+        Args:
+            speculative_turn (SpeculativeTurn): The turn to cancel.
+        """
+        speculative_turn.task.cancel()
+        # stop its requests and synthesis on the worker threads too, nothing else runs while the user is talking
+        self.cancellation_token.cancel()
+        self.cancellation_token = CancellationToken()
+        for ai_character, chat_history in speculative_turn.chat_histories.items():
+            ai_character.openai_manager.chat_history[:] = chat_history
+        for long_term_memory, mark in speculative_turn.pending_memories.items():
+            long_term_memory.forget_pending_since(mark)
+        self.commander_gpt.state_handoff.post(
+            speculative_turn.ai_character,
+            state="listening" if self.is_talking else "idle",
+            subtitles=None,
+        )
+
+    def discard_speculative_turn(self):
+        """Cancels the confirmed speculative turn if it hasn't been spoken yet."""
+        if self.speculative_turn is not None:
+            speculative_turn, self.speculative_turn = self.speculative_turn, None
+            self.cancel_speculative_turn(speculative_turn)
+
+    def take_speculative_turn(
+        self, ai_character: AICharacter, prompt: str
+    ) -> SpeculativeTurn:
+        """Returns the turn already being prepared for the character, if it was started on the same prompt.
+
+        Args:
+            ai_character (AICharacter): The AI Character about to respond.
+            prompt (str): What they're responding to.
+
+        Returns:
+            SpeculativeTurn: The turn, or None to prepare one as usual.
+        """
+        speculative_turn = self.speculative_turn
+        if (
+            speculative_turn is None
+            or speculative_turn.ai_character is not ai_character
+            or speculative_turn.prompt != prompt
+        ):
+            return None
+        self.speculative_turn = None
+        return speculative_turn
+
+    def on_activation_key(self, ai_character: AICharacter):
+        """Adds the character to the queue to respond when their activation key is pressed.
+
+        Args:
+            ai_character (AICharacter): The AI Character whose key was pressed.
+        """
+        print(f"[yellow]\n{ai_character.name} has been queued up to talk.")
+        self.activate_character(ai_character)
+
+    def activate_character(self, ai_character: AICharacter):
+        """Activates a given AI Character by adding them to the queue.
+        Will only add them to the queue if the user is not actively recording from the mic.
+        Must be called on the event loop.
+
+        Args:
+            ai_character (AICharacter): The AI Character to activate.
+        """
+        if self.is_talking:
+            print(
+                f"[red]\nMic is active, cannot activate character. Stop talking by pressing {self.commander_gpt.mic_activation_key} again."
+            )
+            return
+        # queue up the given character
+        if ai_character not in self.queued_characters:
+            self.queued_characters.add(ai_character)
+            self.activation_queue.put_nowait(ai_character)
+
+    async def activate_next_character(self):
+        """Handles activating each character in the queue, in the order they were added.
+
+        In the "sequential" activation mode each character responds in turn, to the response of the character before them.
+        In the "ensemble" mode the characters activated for the same prompt all generate their responses at once,
+        then speak one at a time in the order they were added.
+        """
+        while True:
+            ai_character: AICharacter = await self.activation_queue.get()
+            self.queued_characters.discard(ai_character)
+            self.turn_in_progress = True
+            try:
+                if self.activation_mode == "ensemble":
+                    await self.run_ensemble(ai_character)
+                else:
+                    try:
+                        await self.run_guarded(
+                            ai_character, self.run_turn(ai_character)
+                        )
+                    finally:
+                        self.activation_queue.task_done()
+            finally:
+                self.turn_in_progress = False
+
+            if self.activation_queue.empty():
+                print(
+                    f"[green]\n---\nFinished processing queue, press {self.commander_gpt.mic_activation_key} to talk again.\n---\n"
+                )
+
+    async def run_guarded(self, ai_character: AICharacter, turn):
+        """Runs a character's turn, showing the error state if it fails rather than stopping the queue.
+
+        Args:
+            ai_character (AICharacter): The AI Character responding.
+            turn (Awaitable): The turn to run.
+
+        Returns:
+            The turn's result, or None if it failed.
+        """
+        try:
+            return await turn
+        except TurnCancelled:
+            print(f"[yellow]\n{ai_character.name} was stopped mid reply.")
+        except asyncio.TimeoutError:
+            print(f"[red]\n{ai_character.name} timed out while responding.")
+            self.commander_gpt.state_handoff.post(ai_character, state="error")
+        except Exception as e:
+            print(f"[red]\nError while {ai_character.name} was responding: {e}")
+            self.commander_gpt.state_handoff.post(ai_character, state="error")
+
+    def start_turn_trace(self, ai_character: AICharacter) -> TurnTrace:
+        """Starts timing a character's turn.
+
+        Args:
+            ai_character (AICharacter): The AI Character responding.
+
+        Returns:
+            TurnTrace: Times each stage of the turn.
+        """
+        if ai_character.local_model_name:
+            llm_backend = f"local:{ai_character.local_model_name}"
+        else:
+            llm_backend = f"openai:{ai_character.openai_model_name}"
+        return self.commander_gpt.metrics.start_turn(
+            character=ai_character.name,
+            llm_backend=llm_backend,
+            tts_backend="elevenlabs" if ai_character.use_elevenlabs_voice else "azure",
+        )
+
+    async def run_turn(self, ai_character: AICharacter):
+        """Has a character respond to the most recent prompt.
+        It is sent to OpenAI to generate a response.
+        The character's response is then fed into the TTS configured for that character.
+        Lastly the returned audio is played.
+
+        Args:
+            ai_character (AICharacter): The AI Character to respond.
+        """
+        speculative_turn = self.take_speculative_turn(
+            ai_character, self.last_characters_response
+        )
+        if speculative_turn is not None:
+            turn_trace = speculative_turn.turn_trace
+            preparing = speculative_turn.task
+        else:
+            turn_trace = self.start_turn_trace(ai_character)
+            preparing = self.prepare_turn(
+                ai_character, self.last_characters_response, turn_trace
+            )
+        playback_seconds = 0.0
+        try:
+            prepared_turn = await preparing
+            if prepared_turn is not None:
+                playback_seconds = await self.deliver_turn(
+                    ai_character, prepared_turn, turn_trace
+                )
+        finally:
+            turn_trace.finish()
+        # audio plays in the background, so wait for it to finish before the next character speaks
+        await self.finish_playback(ai_character, playback_seconds)
+
+    async def finish_playback(self, ai_character: AICharacter, playback_seconds: float):
+        """Waits for the character's audio to finish playing in the background, then returns them to idle.
+
+        Args:
+            ai_character (AICharacter): The AI Character speaking.
+            playback_seconds (float): How much longer the audio plays for, in seconds, or None if nothing is playing.
+        """
+        if not playback_seconds:
+            return
+        await asyncio.sleep(playback_seconds)
+        state_handoff = self.commander_gpt.state_handoff
+        state_handoff.post(
+            ai_character, state="idle", subtitles=None, loudness_envelope=None
+        )
+        state_handoff.post(self.commander_gpt, audio_with_timestamps=None)
+
+    async def run_ensemble(self, first_ai_character: AICharacter):
+        """Has every character activated for the same prompt generate their response at once, then speak in queue order.
+
+        Characters activated before the first character's response is ready join in, later ones wait for the next prompt.
+
+        Args:
+            first_ai_character (AICharacter): The first AI Character taken from the queue.
+        """
+        prompt = self.last_characters_response
+        # (ai_character, turn_trace, task preparing their turn) in queue order
+        turns = []
+        # AICharacter -> a copy of their chat history from before the first character added the prompt to it
+        chat_histories = None
+
+        def start_preparing(ai_character: AICharacter):
+            nonlocal chat_histories
+            # the first turn may have been started before the user was done talking
+            speculative_turn = (
+                self.take_speculative_turn(ai_character, prompt)
+                if len(turns) == 0
+                else None
+            )
+            if speculative_turn is not None:
+                chat_histories = speculative_turn.chat_histories
+                turns.append(
+                    (ai_character, speculative_turn.turn_trace, speculative_turn.task)
+                )
+                return
+            if chat_histories is None:
+                chat_histories = {
+                    other_ai_character: other_ai_character.openai_manager.chat_history.copy()
+                    for other_ai_character in self.commander_gpt.ai_characters
+                }
+            turn_trace = self.start_turn_trace(ai_character)
+            task = self.loop.create_task(
+                self.prepare_turn(
+                    ai_character,
+                    prompt,
+                    turn_trace,
+                    # the prompt only needs adding to everyone's history once,
+                    # the others send their history from before it was so they don't send it twice
+                    record_prompt=len(turns) == 0,
+                    chat_history=(
+                        None if len(turns) == 0 else chat_histories.get(ai_character)
+                    ),
+                )
+            )
+            turns.append((ai_character, turn_trace, task))
+
+        start_preparing(first_ai_character)
+        first_task = turns[0][2]
+        next_activation = None
+        delivered_count = 0
+        try:
+            while not first_task.done():
+                next_activation = self.loop.create_task(self.activation_queue.get())
+                await asyncio.wait(
+                    {first_task, next_activation}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_activation.done():
+                    ai_character = next_activation.result()
+                    self.queued_characters.discard(ai_character)
+                    start_preparing(ai_character)
+                else:
+                    # getting from the queue can be cancelled without losing anything
+                    next_activation.cancel()
+            if len(turns) > 1:
+                print(
+                    f"[green]\n{', '.join(turn[0].name for turn in turns)} are responding to the same prompt together."
+                )
+
+            for ai_character, turn_trace, task in turns:
+                playback_seconds = await self.run_guarded(
+                    ai_character,
+                    self.deliver_prepared_turn(ai_character, task, turn_trace),
+                )
+                delivered_count += 1
+                self.activation_queue.task_done()
+                # audio plays in the background, so wait for each character to finish before the next speaks
+                await self.finish_playback(ai_character, playback_seconds)
+        finally:
+            # when interrupted, stop preparing the turns that won't be spoken
+            if next_activation is not None:
+                next_activation.cancel()
+            for ai_character, turn_trace, task in turns[delivered_count:]:
+                task.cancel()
+                self.activation_queue.task_done()
+
+    async def deliver_prepared_turn(
+        self, ai_character: AICharacter, task: asyncio.Task, turn_trace: TurnTrace
+    ):
+        """Waits for a turn being prepared, then speaks it.
+
+        Args:
+            ai_character (AICharacter): The AI Character responding.
+            task (asyncio.Task): The task preparing the turn.
+            turn_trace (TurnTrace): Times each stage of the turn.
+
+        Returns:
+            float: How much longer the audio plays for in the background, in seconds.
+        """
+        try:
+            prepared_turn = await task
+            if prepared_turn is None:
+                return 0.0
+            return await self.deliver_turn(ai_character, prepared_turn, turn_trace)
+        finally:
+            turn_trace.finish()
+
+    async def prepare_turn(
+        self,
+        ai_character: AICharacter,
+        prompt: str,
+        turn_trace: TurnTrace,
+        record_prompt: bool = True,
+        chat_history: list = None,
+    ) -> tuple:
+        """Generates the character's response and the audio for it, without speaking it yet.
+        If the character has a response cache and was asked the same thing recently, the cached response (and audio) is reused.
+
+        Args:
+            ai_character (AICharacter): The AI Character to respond.
+            prompt (str): What to respond to.
+            turn_trace (TurnTrace): Times each stage of the turn.
+            record_prompt (bool, optional): Whether to add the prompt to the characters' histories. Defaults to True.
+            chat_history (list[ChatMessage], optional): The history to send instead of the character's, EG: from before another character added the prompt to it. Defaults to their history.
+
+        Returns:
+            tuple: The FilteredResponse, its synthesized audio, and the TTS provider that synthesized it, or None if there was no response.
+        """
+        commander_gpt = self.commander_gpt
+        state_handoff = commander_gpt.state_handoff
+        print(f"[green]\n---\nStart processing dialogue for {ai_character.name}.\n---")
+        state_handoff.post(ai_character, state="thinking")
+
+        if chat_history is None:
+            chat_history = ai_character.openai_manager.chat_history
+        response_cache = ai_character.response_cache
+        cache_key = None
+        cache_entry = None
+        if response_cache is not None:
+            cache_key = response_cache.key(
+                prompt,
+                chat_history,
+                ai_character.openai_model_name,
+            )
+            cache_entry = response_cache.get(cache_key)
+
+        if cache_entry is not None:
+            print(f"[green]\n{ai_character.name} reused a cached response.")
+            turn_trace.mark("first_token")
+            response = cache_entry.response
+            state_handoff.post(ai_character, subtitles=None)
+            ai_character.openai_manager.record_cached_response(
+                ai_character=ai_character,
+                prompt=prompt,
+                answer=response.text,
+                other_ai_characters=ai_character.other_ai_characters,
+                record_prompt=record_prompt,
+            )
+        else:
+            llm_start_time = time.monotonic()
+            response = await self.generate_response(
+                ai_character, prompt, turn_trace, record_prompt, chat_history
+            )
+            if response is None:
+                return None
+            if response_cache is not None:
+                cache_entry = response_cache.put(
+                    cache_key, response, time.monotonic() - llm_start_time
+                )
+
+        # write the results to chat_history as a backup
+        with turn_trace.span("history_write"):
+            await asyncio.to_thread(
+                write_chat_history,
+                ai_character.chat_history_filepath,
+                ai_character.openai_manager.chat_history.copy(),
+            )
+
+        if (
+            cache_entry is not None
+            and cache_entry.synthesized_audio is not None
+            and os.path.exists(cache_entry.synthesized_audio[1])
+        ):
+            synthesized_audio = cache_entry.synthesized_audio
+            tts_provider = cache_entry.tts_provider
+            response_cache.record_audio_hit(cache_entry)
+        else:
+            tts_start_time = time.monotonic()
+            tts_provider, synthesized_audio = await self.synthesize(
+                ai_character, response, turn_trace
+            )
+            if synthesized_audio is not None:
+                # decode the clip once now, rather than analysing it while drawing each frame
+                with turn_trace.span("loudness_envelope"):
+                    loudness_envelope = await asyncio.to_thread(
+                        LoudnessEnvelope.from_file, synthesized_audio[1]
+                    )
+                synthesized_audio = (*synthesized_audio, loudness_envelope)
+            if cache_entry is not None:
+                cache_entry.synthesized_audio = synthesized_audio
+                cache_entry.tts_provider = tts_provider
+                cache_entry.tts_seconds = time.monotonic() - tts_start_time
+        # the first audio is timed against whichever provider spoke
+        turn_trace.tts_backend = tts_provider
+        return response, synthesized_audio, tts_provider
+
+    async def generate_response(
+        self,
+        ai_character: AICharacter,
+        prompt: str,
+        turn_trace: TurnTrace,
+        record_prompt: bool = True,
+        chat_history: list = None,
+    ) -> str:
+        """Asks the character's model for a response, filtering it with the character's message replacements, triggers, and voice prefixes as it streams in.
+
+        Args:
+            ai_character (AICharacter): The AI Character to respond.
+            prompt (str): What to respond to.
+            turn_trace (TurnTrace): Times each stage of the turn.
+            record_prompt (bool, optional): Whether to add the prompt to the characters' histories. Defaults to True.
+            chat_history (list[ChatMessage], optional): The history to send instead of the character's. Defaults to their history.
+
+        Returns:
+            FilteredResponse: The response, or None if there was no response.
+        """
+        state_handoff = self.commander_gpt.state_handoff
+        response_stream = ai_character.response_filter.stream()
+        # determine if screenshots are enabled, if so what monitor to screenshot
+        # -1 means it will not send one in this case
+        monitor_number = -1
+        if self.screen_shot_enabled:
+            monitor_number = ai_character.monitor_to_screenshot
+
+        # send question to openai
+        try:
+            with turn_trace.span("llm", backend=turn_trace.llm_backend):
+                openai_result = await asyncio.wait_for(
+                    ai_character.openai_manager.chat_with_history(
+                        ai_character=ai_character,
+                        prompt=prompt,
+                        monitor_to_screenshot=monitor_number,
+                        max_history_length_messages=ai_character.max_history_length_messages,
+                        model=ai_character.openai_model_name,
+                        other_ai_characters=ai_character.other_ai_characters,
+                        turn_trace=turn_trace,
+                        record_prompt=record_prompt,
+                        chat_history=chat_history,
+                        response_stream=response_stream,
+                        cancellation_token=self.cancellation_token,
+                    ),
+                    timeout=self.llm_timeout_seconds,
+                )
+        except asyncio.TimeoutError:
+            print(
+                f"[red]\nNo response from the AI after {self.llm_timeout_seconds} seconds."
+            )
+            openai_result = None
+        state_handoff.post(ai_character, subtitles=None)
+        if not openai_result:
+            print(
+                "[red]\nThe AI had nothing to say or something went wrong, if you simply pressed the key too early press it again."
+            )
+            state_handoff.post(ai_character, state="error")
+            return None
+        return response_stream.finish()
+
+    async def deliver_turn(
+        self, ai_character: AICharacter, prepared_turn: tuple, turn_trace: TurnTrace
+    ):
+        """Speaks a prepared response with the character's TTS.
+
+        Args:
+            ai_character (AICharacter): The AI Character responding.
+            prepared_turn (tuple): The response, its synthesized audio, and the TTS provider that synthesized it, from prepare_turn.
+            turn_trace (TurnTrace): Times each stage of the turn.
+
+        Returns:
+            float: How much longer the audio plays for in the background, in seconds.
+        """
+        commander_gpt = self.commander_gpt
+        response, synthesized_audio, tts_provider = prepared_turn
+        # hide any mic input shown on screen
+        commander_gpt.state_handoff.post(commander_gpt, subtitles=None)
+        self.last_characters_response = response.text
+
+        if tts_provider == "elevenlabs":
+            playback_seconds = await self.speak_with_elevenlabs(
+                ai_character, response.text, synthesized_audio, turn_trace
+            )
+        else:
+            playback_seconds = await self.speak_with_azure(
+                ai_character, response, synthesized_audio, turn_trace
+            )
+        if self.speech_ended_at is not None:
+            # the first character to speak since the user stopped talking
+            commander_gpt.metrics.observe(
+                "mic_release_to_first_audio_seconds",
+                time.monotonic() - self.speech_ended_at,
+                mode=self.speech_end_mode,
+            )
+            self.speech_ended_at = None
+
+        if ai_character.long_term_memory is not None:
+            # save the messages trimmed from the history while the audio plays, rather than before it
+            task = self.loop.create_task(
+                self.flush_long_term_memory(
+                    ai_character.name, ai_character.long_term_memory
+                )
+            )
+            self.memory_flush_tasks.add(task)
+            task.add_done_callback(self.memory_flush_tasks.discard)
+
+        print(
+            f"[green]\n---\nFinished processing dialogue for {ai_character.name}.\n---\n"
+        )
+        return playback_seconds
+
+    async def flush_long_term_memory(
+        self, character_name: str, long_term_memory: LongTermMemory
+    ):
+        """Embeds and saves the messages trimmed from a character's history since the last time.
+
+        Args:
+            character_name (str): The name of the character the memory belongs to.
+            long_term_memory (LongTermMemory): Their memory.
+        """
+        try:
+            with self.commander_gpt.metrics.span(
+                "memory_index", character=character_name
+            ):
+                await asyncio.to_thread(long_term_memory.flush)
+        except Exception as e:
+            print(
+                f"[red]\nFailed to save the long term memory of {character_name}: {e}"
+            )
+
+    async def synthesize(
+        self,
+        ai_character: AICharacter,
+        response: FilteredResponse,
+        turn_trace: TurnTrace = None,
+    ) -> tuple:
+        """Synthesizes the response with the TTS provider the router picks, falling back to the next one if it fails or takes too long.
+
+        Args:
+            ai_character (AICharacter): The AI Character speaking.
+            response (FilteredResponse): The response to speak.
+            turn_trace (TurnTrace, optional): Times each stage of the turn.
+
+        Returns:
+            tuple: The provider used, "elevenlabs" or "azure", and the synthesized audio from it.
+        """
+        providers = self.tts_router.providers_to_try(
+            ai_character,
+            fallback_available=self.commander_gpt.speechtotext_manager is not None,
+        )
+        for index, provider in enumerate(providers):
+            is_last = index == len(providers) - 1
+            # give up on a slow provider sooner when there's another to try
+            timeout_seconds = (
+                self.tts_timeout_seconds
+                if is_last
+                else min(
+                    self.tts_timeout_seconds, self.tts_router.attempt_timeout_seconds
+                )
+            )
+            start_time = time.monotonic()
+            try:
+                if provider == "elevenlabs":
+                    synthesized_audio = await self.synthesize_with_elevenlabs(
+                        ai_character, response.text, turn_trace, timeout_seconds
+                    )
+                else:
+                    synthesized_audio = await self.synthesize_with_azure(
+                        ai_character, response, turn_trace, timeout_seconds
+                    )
+            except TurnCancelled:
+                raise
+            except Exception as e:
+                self.log_tts_route_change(
+                    self.tts_router.record_failure(ai_character, provider)
+                )
+                if is_last:
+                    raise
+                print(
+                    f"[red]\n{provider} failed to speak for {ai_character.name} ({e!r}), using {providers[index + 1]} instead."
+                )
+                continue
+            if synthesized_audio is None and response.spoken_text and not is_last:
+                # Azure returns no audio when it fails
+                self.log_tts_route_change(
+                    self.tts_router.record_failure(ai_character, provider)
+                )
+                continue
+            self.log_tts_route_change(
+                self.tts_router.record_success(
+                    ai_character, provider, time.monotonic() - start_time
+                )
+            )
+            return provider, synthesized_audio
+
+    def log_tts_route_change(self, route_change: TtsRouteChange):
+        """Prints a character switching TTS providers, and records it in the metrics.
+
+        Args:
+            route_change (TtsRouteChange): The change, or None if there wasn't one.
+        """
+        if route_change is None:
+            return
+        if route_change.reason == "recovered":
+            print(
+                f"[yellow]\n{route_change.to_provider} was fast for {route_change.character_name} again, "
+                f"characters with the voice {route_change.voice} are switching back to it from {route_change.from_provider}."
+            )
+        else:
+            problem = "slow" if route_change.reason == "slow" else "failing"
+            print(
+                f"[red]\n{route_change.from_provider} is {problem} for {route_change.character_name}, "
+                f"characters with the voice {route_change.voice} are switching to {route_change.to_provider} "
+                f"for at least {self.tts_router.recovery_seconds} seconds."
+            )
+        metrics = self.commander_gpt.metrics
+        metrics.increment(
+            "tts_route_changes_total",
+            voice=route_change.voice,
+            to=route_change.to_provider,
+            reason=route_change.reason,
+        )
+        metrics.write_record(route_change.to_dict())
+
+    async def synthesize_with_elevenlabs(
+        self,
+        ai_character: AICharacter,
+        text: str,
+        turn_trace: TurnTrace = None,
+        timeout_seconds: float = None,
+    ) -> tuple:
+        """Submits the response to 11labs to get audio with timestamps, saving it to play later.
+
+        Args:
+            ai_character (AICharacter): The AI Character speaking.
+            text (str): The response to speak.
+            turn_trace (TurnTrace, optional): Times each stage of the turn.
+            timeout_seconds (float, optional): How long to wait for the audio. Defaults to tts_timeout_seconds.
+
+        Returns:
+            tuple: The audio with timestamps and the path it was saved to.
+        """
+        print("convert text to audio")
+        return await self.run_synthesis(
+            self.commander_gpt.elevenlabs_manager.synthesize_with_timestamps,
+            timeout_seconds or self.tts_timeout_seconds,
+            input_text=text,
+            voice=ai_character.elevenlabs_voice,
+            save_as_wave=True,
+            subdirectory="assets/audio",
+            model_id=ai_character.elevenlabs_model_id,
+            turn_trace=turn_trace,
+        )
+
+    async def run_synthesis(self, synthesize, timeout_seconds: float, **kwargs):
+        """Runs a blocking synthesis on a worker thread, with its own cancellation token so giving up on it stops the thread too.
+
+        The token is cancelled when the turn is, or once the timeout passes.
+        Audio saved by a synthesis that was given up on is deleted.
+
+        Args:
+            synthesize (callable): EG: ElevenLabsManager.synthesize_with_timestamps, returning the audio's details and the path it was saved to, or None.
+            timeout_seconds (float): How long to wait for it.
+            **kwargs: Its arguments, besides the cancellation_token.
+
+        Returns:
+            tuple: What the synthesis returned.
+
+        Raises:
+            asyncio.TimeoutError: If it took longer than timeout_seconds.
+        """
+        attempt_cancellation_token = CancellationToken()
+        synthesis = asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                synthesize, cancellation_token=attempt_cancellation_token, **kwargs
+            ),
+        )
+        with self.cancellation_token.on_cancel(attempt_cancellation_token.cancel):
+            try:
+                # shielded so the synthesis' result is still seen if it's given up on
+                return await asyncio.wait_for(
+                    asyncio.shield(synthesis), timeout=timeout_seconds
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                attempt_cancellation_token.cancel()
+                synthesis.add_done_callback(delete_abandoned_audio)
+                raise
+
+    async def speak_with_elevenlabs(
+        self,
+        ai_character: AICharacter,
+        text: str,
+        synthesized_audio: tuple,
+        turn_trace: TurnTrace = None,
+    ):
+        """Starts playing the response's audio from 11labs.
+        The subtitles are shown in time with the audio, see finish_playback for returning the character to idle.
+
+        Args:
+            ai_character (AICharacter): The AI Character speaking.
+            text (str): The response to speak.
+            synthesized_audio (tuple): The audio with timestamps, the path it was saved to, and its loudness envelope, from prepare_turn.
+            turn_trace (TurnTrace, optional): Times each stage of the turn.
+
+        Returns:
+            float: How long the audio plays for, in seconds.
+        """
+        commander_gpt = self.commander_gpt
+        print("play audio from 11labs")
+        audio_with_timestamps, tts_file, loudness_envelope = synthesized_audio
+        ai_character.voice_style = None
+        # generic talking by default
+        commander_gpt.state_handoff.post(
+            ai_character, voice_image=ai_character.images_by_state.get("talking")
+        )
+        await asyncio.to_thread(
+            commander_gpt.elevenlabs_manager.play_with_timestamps,
+            ai_character=ai_character,
+            input_text=text,
+            tts_file=tts_file,
+            turn_trace=turn_trace,
+            audio_manager=commander_gpt.audio_manager,
+            cancellation_token=self.cancellation_token,
+        )
+        # playback has just started, so time the subtitles and animation from now
+        commander_gpt.state_handoff.post(
+            ai_character, loudness_envelope=loudness_envelope
+        )
+        commander_gpt.state_handoff.post(
+            commander_gpt,
+            current_subtitile_timing=time.monotonic(),
+            audio_with_timestamps=audio_with_timestamps,
+        )
+        return audio_duration_seconds(audio_with_timestamps)
+
+    def azure_voice_style(self, ai_character: AICharacter, voice_prefix: str) -> tuple:
+        """Finds the Azure voice style and image matching the response's prefix, if it has one.
+
+        Args:
+            ai_character (AICharacter): The AI Character speaking.
+            voice_prefix (str): The prefix the response started with, or None.
+
+        Returns:
+            tuple: The voice style (or None), and the image to show while talking.
+        """
+        if voice_prefix is None:
+            # generic talking by default
+            return None, ai_character.images_by_state.get("talking")
+        voice_style = ai_character.supported_prefixes.get(voice_prefix, None)
+        if ai_character.use_elevenlabs_voice:
+            # only speaking with Azure while 11labs is slow, the voice style images aren't loaded for 11labs characters
+            return voice_style, ai_character.images_by_state.get("talking")
+        # Azure TTS support more voice styles, so use those images if they exist
+        voice_image_file_name = voice_prefix.replace("(", "").replace(")", "")
+        voice_image = ai_character.images_by_state.get(
+            voice_image_file_name, ai_character.images_by_state.get("error")
+        )
+        return voice_style, voice_image
+
+    async def synthesize_with_azure(
+        self,
+        ai_character: AICharacter,
+        response: FilteredResponse,
+        turn_trace: TurnTrace = None,
+        timeout_seconds: float = None,
+    ) -> tuple:
+        """Submits the response to Azure to get audio with a subtitle timeline, saving it to play later.
+
+        Args:
+            ai_character (AICharacter): The AI Character speaking.
+            response (FilteredResponse): The response to speak.
+            turn_trace (TurnTrace, optional): Times each stage of the turn.
+            timeout_seconds (float, optional): How long to wait for the audio. Defaults to tts_timeout_seconds.
+
+        Returns:
+            tuple: The subtitle timeline and the path the audio was saved to, or None if there was no audio.
+        """
+        print("convert text to audio using azure tts")
+        voice_style, _ = self.azure_voice_style(ai_character, response.voice_prefix)
+        return await self.run_synthesis(
+            self.commander_gpt.speechtotext_manager.synthesize_with_word_boundaries,
+            timeout_seconds or self.tts_timeout_seconds,
+            azure_voice_name=ai_character.azure_voice_name,
+            azure_voice_style=voice_style,
+            text_to_speak=response.spoken_text,
+            subdirectory="assets/audio",
+            turn_trace=turn_trace,
+        )
+
+    async def speak_with_azure(
+        self,
+        ai_character: AICharacter,
+        response: FilteredResponse,
+        synthesized_audio: tuple,
+        turn_trace: TurnTrace = None,
+    ):
+        """Starts playing the response's audio from Azure, using the voice style and image matching its prefix if it has one.
+        The subtitles are shown in time with the audio, see finish_playback for returning the character to idle.
+        Also queues up any other characters the response triggers.
+
+        Args:
+            ai_character (AICharacter): The AI Character speaking.
+            response (FilteredResponse): The response to speak.
+            synthesized_audio (tuple): The subtitle timeline, the path the audio was saved to, and its loudness envelope, from prepare_turn.
+            turn_trace (TurnTrace, optional): Times each stage of the turn.
+
+        Returns:
+            float: How long the audio plays for, in seconds.
+        """
+        commander_gpt = self.commander_gpt
+        state_handoff = commander_gpt.state_handoff
+        print("play audio from azure tts")
+        text = response.spoken_text
+        ai_character.voice_style, voice_image = self.azure_voice_style(
+            ai_character, response.voice_prefix
+        )
+        for character_name in response.triggered_character_names:
+            # trigger the character specified based on their name
+            other_ai_character: AICharacter
+            for other_ai_character in ai_character.other_ai_characters:
+                # if the name matches another character in the scene
+                if other_ai_character.name == character_name:
+                    # add them to the queue to talk next
+                    self.activate_character(other_ai_character)
+                    break
+
+        if synthesized_audio is None:
+            # an empty message has nothing to say, anything else failed
+            state_handoff.post(ai_character, state="error" if text else "idle")
+            return 0.0
+        subtitle_timeline, tts_file, loudness_envelope = synthesized_audio
+
+        ai_character.voice_color = ai_character.character_text_color
+        state_handoff.post(
+            ai_character, state="talking", voice_image=voice_image, subtitles=text
+        )
+        # while this character talks, the others listen
+        for other_ai_character in ai_character.other_ai_characters:
+            state_handoff.post(other_ai_character, state="listening", subtitles=None)
+
+        with optional_span(turn_trace, "playback_start"):
+            await asyncio.to_thread(
+                commander_gpt.audio_manager.play_audio,
+                file_path=tts_file,
+                sleep_during_playback=False,
+                delete_file=False,
+                play_using_music=True,
+                cancellation_token=self.cancellation_token,
+            )
+        if turn_trace is not None:
+            turn_trace.mark("first_audio")
+        # playback has just started, so time the subtitles and animation from now
+        state_handoff.post(ai_character, loudness_envelope=loudness_envelope)
+        state_handoff.post(
+            commander_gpt,
+            current_subtitile_timing=time.monotonic(),
+            audio_with_timestamps=subtitle_timeline,
+        )
+        return audio_duration_seconds(subtitle_timeline)
+
+    async def handle_twitch_chat_responses(self, ai_character: AICharacter):
+        """Queues the character up to answer twitch chat whenever nothing else is happening.
+
+        Args:
+            ai_character (AICharacter): The AI Character to answer chat.
+        """
+        commander_gpt = self.commander_gpt
+        while True:
+            # if user is talking through their mic we won't respond to twitch chat
+            # we will only respond to twitch chat if we're idle
+            # and if there's a queue of characters talking already don't respond to chat
+            if (
+                self.is_talking
+                or ai_character.state != "idle"
+                or not self.activation_queue.empty()
+            ):
+                await asyncio.sleep(0.1)
+                continue
+
+            # get the next message, or all recent ones together
+            if commander_gpt.twitch_digest_mode:
+                twitch_message = commander_gpt.twitch_bot.pick_digest(
+                    ai_character=ai_character,
+                    max_messages=commander_gpt.twitch_digest_max_messages,
+                )
+            else:
+                twitch_message = commander_gpt.twitch_bot.pick_message(
+                    ai_character=ai_character, remove_after=True
+                )
+            # only respond if there's a message
+            if twitch_message is not None:
+                commander_gpt.state_handoff.post(
+                    commander_gpt, subtitles=twitch_message
+                )
+                self.last_characters_response = twitch_message
+                print(
+                    f"[yellow]\n{ai_character.name} has been queued up to respond to twitch chat's message {twitch_message}'"
+                )
+                self.activate_character(ai_character)
+                # give the queue a moment to pick them up
+                await asyncio.sleep(0.1)
+            else:
+                # only check once a second at most
+                await asyncio.sleep(1)
+
+    def toggle_screenshot(self):
+        """Toggles enabling of sending screenshots."""
+        self.screen_shot_enabled = not self.screen_shot_enabled
+        if self.screen_shot_enabled:
+            print("[green]\nScreenshot will be sent with your next message.")
+        else:
+            print("[yellow]\nYour next message will be text-only.")
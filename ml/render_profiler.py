@@ -0,0 +1,221 @@
+from collections import deque
+import json
+import os
+import time
+
+from rich import print
+
+from .utils import percentile
+
+# upper bounds of the frame time histogram buckets, in milliseconds
+FRAME_TIME_BUCKETS_MS = (1, 2, 4, 8, 16, 33, 50, 100, 250)
+
+
+class RenderProfiler:
+    """Measures the Tk render loop: how long each frame takes to draw, and how late each frame starts.
+
+    A frame starting late means the Tk thread couldn't run when its root.after callback was due,
+    EG: because a background thread was holding the GIL.
+    Summaries are shown in an optional overlay and appended to a JSONL log, and a histogram of frame times is printed at exit.
+    """
+
+    def __init__(
+        self,
+        show_overlay: bool = False,
+        log_filepath: str = None,
+        log_interval_seconds: float = 5.0,
+        window_frames: int = 1000,
+        summary_interval_seconds: float = 0.5,
+    ):
+        """Initializes the profiler without any frames.
+
+        Args:
+            show_overlay (bool, optional): Whether the overlay starts visible. Defaults to False.
+            log_filepath (str, optional): Where to append a summary every log_interval_seconds as a line of JSON. Not written if None.
+            log_interval_seconds (float, optional): How often to write a summary to the log. Defaults to 5.
+            window_frames (int, optional): How many of the most recent frames the summaries and histogram cover. Defaults to 1000.
+            summary_interval_seconds (float, optional): How often the overlay's summary is recalculated. Defaults to 0.5.
+        """
+        self.show_overlay = show_overlay
+        # set from the hotkey thread through the StateHandoff, then applied at the start of the next frame
+        self.toggle_requested = False
+        self.log_interval_seconds = log_interval_seconds
+        self.summary_interval_seconds = summary_interval_seconds
+
+        # durations of the most recent frames, in seconds
+        self.frame_times = deque(maxlen=window_frames)
+        # how long after it was due each recent frame started, in seconds
+        self.lateness_times = deque(maxlen=window_frames)
+        self.frames = 0
+        self.frame_start_time = None
+        self.next_frame_due_time = None
+        self.canvas_items = 0
+        self.image_cache_stats = {}
+
+        self.summary = {}
+        self.next_summary_time = 0.0
+        self.frames_at_last_log = 0
+        self.last_log_time = time.monotonic()
+        self.log_file = None
+        if log_filepath:
+            directory = os.path.dirname(log_filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.log_file = open(log_filepath, "a", buffering=1)
+
+    def frame_started(self):
+        """Records the start of a frame, and how late it was. Call before drawing anything."""
+        if self.toggle_requested:
+            self.toggle_requested = False
+            self.show_overlay = not self.show_overlay
+        now = time.monotonic()
+        if self.next_frame_due_time is not None:
+            self.lateness_times.append(max(0.0, now - self.next_frame_due_time))
+        self.frame_start_time = now
+
+    def frame_finished(self, canvas_items: int, image_cache_stats: dict):
+        """Records the end of the frame started by frame_started.
+
+        Args:
+            canvas_items (int): How many items are on the canvas after drawing.
+            image_cache_stats (dict): The ImageCache's stats.
+        """
+        now = time.monotonic()
+        self.frame_times.append(now - self.frame_start_time)
+        self.frames += 1
+        self.canvas_items = canvas_items
+        self.image_cache_stats = image_cache_stats
+
+        if now >= self.next_summary_time:
+            self.summary = self.summarize()
+            self.next_summary_time = now + self.summary_interval_seconds
+        if self.log_file is not None and now - self.last_log_time >= (
+            self.log_interval_seconds
+        ):
+            self.write_log(now)
+
+    def frame_scheduled(self, delay_seconds: float):
+        """Records when the next frame should start. Call right after scheduling it with root.after.
+
+        Args:
+            delay_seconds (float): The delay the next frame was scheduled with.
+        """
+        self.next_frame_due_time = time.monotonic() + delay_seconds
+
+    def summarize(self) -> dict:
+        """Summarizes the recent frames.
+
+        Returns:
+            dict: Percentiles of frame time and lateness in milliseconds, the canvas item count, and the image cache size.
+        """
+        frame_times = list(self.frame_times)
+        lateness_times = list(self.lateness_times)
+        summary = {
+            "frames": self.frames,
+            "canvas_items": self.canvas_items,
+            "image_cache_images": self.image_cache_stats.get("decoded_images", 0),
+            "image_cache_megabytes": self.image_cache_stats.get("decoded_bytes", 0)
+            / (1024 * 1024),
+        }
+        for name, values in (("frame", frame_times), ("late", lateness_times)):
+            for label, fraction in (("p50", 0.50), ("p95", 0.95)):
+                value = percentile(values, fraction)
+                summary[f"{name}_ms_{label}"] = None if value is None else value * 1000
+            summary[f"{name}_ms_max"] = max(values) * 1000 if values else None
+        return summary
+
+    def overlay_text(self) -> str:
+        """Returns the text to draw in the overlay.
+
+        Returns:
+            str: The latest summary, one measurement per line.
+        """
+        summary = self.summary
+        if not summary:
+            return "Render profiler: waiting for frames"
+
+        def milliseconds(name: str) -> str:
+            value = summary.get(name, None)
+            return "-" if value is None else f"{value:.1f}"
+
+        return (
+            f"frame ms  p50 {milliseconds('frame_ms_p50')}  p95 {milliseconds('frame_ms_p95')}  max {milliseconds('frame_ms_max')}\n"
+            f"late ms   p50 {milliseconds('late_ms_p50')}  p95 {milliseconds('late_ms_p95')}  max {milliseconds('late_ms_max')}\n"
+            f"canvas items {summary['canvas_items']}\n"
+            f"image cache {summary['image_cache_images']} images, {summary['image_cache_megabytes']:.1f}MB"
+        )
+
+    def write_log(self, now: float):
+        """Appends a summary of the recent frames to the log.
+
+        Args:
+            now (float): The current time, from time.monotonic().
+        """
+        elapsed = now - self.last_log_time
+        record = {
+            "type": "frames",
+            "timestamp": time.time(),
+            "fps": (self.frames - self.frames_at_last_log) / elapsed if elapsed else 0,
+            **self.summarize(),
+        }
+        self.log_file.write(json.dumps(record) + "\n")
+        self.frames_at_last_log = self.frames
+        self.last_log_time = now
+
+    def histogram(self) -> list[tuple]:
+        """Buckets the recent frame times.
+
+        Returns:
+            list[tuple]: (upper bound in milliseconds, or None for the overflow bucket, frame count) for each bucket.
+        """
+        counts = [0] * (len(FRAME_TIME_BUCKETS_MS) + 1)
+        for frame_time in self.frame_times:
+            frame_ms = frame_time * 1000
+            for index, upper_bound in enumerate(FRAME_TIME_BUCKETS_MS):
+                if frame_ms <= upper_bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return list(zip(FRAME_TIME_BUCKETS_MS + (None,), counts))
+
+    def print_stats(self, prefix: str = "Render profiler"):
+        """Prints a histogram of the recent frame times, and writes it to the log.
+
+        Args:
+            prefix (str, optional): Text to print before the statistics.
+        """
+        histogram = self.histogram()
+        total = max(1, len(self.frame_times))
+        lines = [
+            f"[yellow]\n{prefix} {self.frames} frames, last {len(self.frame_times)} frame times:"
+        ]
+        previous_bound = 0
+        for upper_bound, count in histogram:
+            label = (
+                f"> {previous_bound}ms"
+                if upper_bound is None
+                else f"{previous_bound}-{upper_bound}ms"
+            )
+            bar = "#" * round(40 * count / total)
+            lines.append(f"{label:>11} {count:>6} {bar}")
+            previous_bound = upper_bound
+        print("\n".join(lines))
+
+        if self.log_file is not None:
+            record = {
+                "type": "frame_time_histogram",
+                "timestamp": time.time(),
+                "frames": self.frames,
+                "buckets_ms": [
+                    {
+                        "le": "+Inf" if upper_bound is None else upper_bound,
+                        "count": count,
+                    }
+                    for upper_bound, count in histogram
+                ],
+                **self.summarize(),
+            }
+            self.log_file.write(json.dumps(record) + "\n")
+            self.log_file.close()
+            self.log_file = None
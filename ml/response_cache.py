@@ -0,0 +1,174 @@
+from collections import OrderedDict
+import hashlib
+import json
+import time
+
+from rich import print
+
+from .chat_intake import normalize_chat_message
+from .chat_message import messages_to_dicts
+
+
+class ResponseCacheEntry:
+    """A cached response, and how long it originally took to generate."""
+
+    __slots__ = (
+        "response",
+        "synthesized_audio",
+        "tts_provider",
+        "created_at",
+        "llm_seconds",
+        "tts_seconds",
+    )
+
+    def __init__(self, response, created_at: float, llm_seconds: float):
+        # FilteredResponse
+        self.response = response
+        # (audio with timestamps or subtitle timeline, saved file path, loudness envelope), if it was saved
+        self.synthesized_audio = None
+        # "elevenlabs" or "azure", whichever synthesized the audio
+        self.tts_provider = None
+        self.created_at = created_at
+        self.llm_seconds = llm_seconds
+        self.tts_seconds = 0.0
+
+
+class ResponseCache:
+    """A bounded cache of a character's responses, so repeated questions (EG: from twitch chat) don't cost another completion and TTS.
+
+    Responses are keyed on the normalized prompt plus a fingerprint of the character's recent history,
+    expire after a time to live, and the least recently used ones are evicted once full.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 200,
+        ttl_seconds: float = 3600,
+        context_messages: int = 0,
+        clock=time.monotonic,
+    ):
+        """Initializes an empty cache.
+
+        Args:
+            max_entries (int, optional): The most responses to keep. Defaults to 200.
+            ttl_seconds (float, optional): How long a response can be reused for. Defaults to an hour.
+            context_messages (int, optional): How many of the most recent history messages must also match, 0 only matches the prompt. Defaults to 0.
+            clock (callable, optional): Returns the current time in seconds. Defaults to time.monotonic.
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.context_messages = context_messages
+        self.clock = clock
+        # key -> ResponseCacheEntry, least recently used first
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.audio_hits = 0
+        self.saved_seconds = 0.0
+
+    def key(self, prompt: str, chat_history: list[dict], model: str) -> str:
+        """Returns the cache key for a prompt asked with the given history.
+
+        Args:
+            prompt (str): The prompt being responded to.
+            chat_history (list[ChatMessage]): The character's history before the prompt, the first message is their personality.
+            model (str): The model that would generate the response.
+
+        Returns:
+            str: The key, or None if the prompt is empty once normalized.
+        """
+        normalized_prompt = normalize_chat_message(prompt or "")
+        if not normalized_prompt:
+            return None
+        # a different personality, model, or recent context shouldn't reuse responses
+        context = chat_history[:1]
+        if self.context_messages > 0:
+            context = context + chat_history[1:][-self.context_messages :]
+        fingerprint = hashlib.sha1(
+            json.dumps(
+                [model, messages_to_dicts(context)], sort_keys=True, default=str
+            ).encode("utf-8")
+        ).hexdigest()
+        return f"{fingerprint}:{normalized_prompt}"
+
+    def get(self, key: str) -> ResponseCacheEntry:
+        """Returns the cached response for the key, if there is one that hasn't expired.
+
+        Args:
+            key (str): The key from key().
+
+        Returns:
+            ResponseCacheEntry: The response, or None on a miss.
+        """
+        entry = self.entries.get(key, None) if key is not None else None
+        if entry is not None and self.clock() - entry.created_at > self.ttl_seconds:
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += entry.llm_seconds
+        return entry
+
+    def put(self, key: str, response, llm_seconds: float) -> ResponseCacheEntry:
+        """Caches a response, evicting the least recently used one if full.
+
+        Args:
+            key (str): The key from key().
+            response (FilteredResponse): The response, already filtered so reusing it doesn't apply the character's replacements again.
+            llm_seconds (float): How long the response took to generate.
+
+        Returns:
+            ResponseCacheEntry: The new entry, which the response's audio can be added to.
+        """
+        if key is None:
+            return None
+        entry = ResponseCacheEntry(
+            response=response, created_at=self.clock(), llm_seconds=llm_seconds
+        )
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def record_audio_hit(self, entry: ResponseCacheEntry):
+        """Records that the entry's cached audio was reused too.
+
+        Args:
+            entry (ResponseCacheEntry): The entry whose audio was reused.
+        """
+        self.audio_hits += 1
+        self.saved_seconds += entry.tts_seconds
+
+    def stats(self) -> dict:
+        """Returns statistics on how effective the cache is.
+
+        Returns:
+            dict: Hits, misses, hit rate, audio reuses, cached responses, and the seconds of generation saved.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "audio_hits": self.audio_hits,
+            "entries": len(self.entries),
+            "saved_seconds": self.saved_seconds,
+        }
+
+    def print_stats(self, prefix: str = "Response cache"):
+        """Prints the cache statistics.
+
+        Args:
+            prefix (str, optional): Text to print before the statistics.
+        """
+        stats = self.stats()
+        print(
+            f"[yellow]\n{prefix} hit rate {stats['hit_rate']:.1%} ({stats['hits']} hits / {stats['misses']} misses), "
+            f"{stats['audio_hits']} reused audio, {stats['entries']} responses cached, "
+            f"saved {stats['saved_seconds']:.1f}s of generation."
+        )
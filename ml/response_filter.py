@@ -0,0 +1,237 @@
+import re
+
+TRIGGER_OPEN = "[trigger]"
+TRIGGER_CLOSE = "[/trigger]"
+TRIGGER_PATTERN = r"\[trigger\](?P<triggered_name>.*?)\[\/trigger\]"
+
+
+class FilteredResponse:
+    """A response with the character's message replacements applied, and split into what is spoken and the markup around it."""
+
+    __slots__ = ("text", "spoken_text", "voice_prefix", "triggered_character_names")
+
+    def __init__(
+        self,
+        text: str,
+        spoken_text: str,
+        voice_prefix: str,
+        triggered_character_names: list[str],
+    ):
+        """Initializes the response.
+
+        Args:
+            text (str): The response with replacements applied, still including any voice prefix and [trigger]NAME[/trigger].
+            spoken_text (str): The same without the voice prefix or triggers, as Azure TTS speaks it and the subtitles show it.
+            voice_prefix (str): The supported prefix the response started with, EG: "(happy)", or None.
+            triggered_character_names (list[str]): The names of the characters the response triggers, in order.
+        """
+        self.text = text
+        self.spoken_text = spoken_text
+        self.voice_prefix = voice_prefix
+        self.triggered_character_names = triggered_character_names
+
+
+class ResponseFilter:
+    """A character's message replacements, trigger markup, and voice prefixes, compiled once into a single pattern.
+
+    Every rule is applied in one pass over the response, which can be fed in as it streams from the model.
+    Replacements are made once each, left to right, so one replacement's output is never replaced again.
+    """
+
+    def __init__(
+        self, message_replacements: list[dict] = None, supported_prefixes: dict = None
+    ):
+        """Compiles the rules.
+
+        Args:
+            message_replacements (list[dict], optional): Entries of "to_replace" and "replace_with", the first entry wins if two replace the same text. Defaults to None.
+            supported_prefixes (dict, optional): The voice prefixes a response may start with, EG: "(happy)", mapped to their voice style. Defaults to None.
+        """
+        self.replacements = {}
+        for replacement_info in message_replacements or []:
+            to_replace = replacement_info.get("to_replace", None)
+            replace_with = replacement_info.get("replace_with", None)
+            if to_replace and replace_with:
+                self.replacements.setdefault(to_replace, replace_with)
+        self.supported_prefixes = supported_prefixes or {}
+        self.max_prefix_length = max(map(len, self.supported_prefixes), default=0)
+
+        alternatives = [TRIGGER_PATTERN]
+        if self.replacements:
+            # longest first, so the longest replacement starting at a position wins
+            alternatives.append(
+                "|".join(
+                    re.escape(to_replace)
+                    for to_replace in sorted(self.replacements, key=len, reverse=True)
+                )
+            )
+        self.pattern = re.compile("|".join(alternatives))
+
+        # the text a streamed response could end with that might still become a replacement or trigger
+        self.partial_matches = {
+            to_replace[:length]
+            for to_replace in [*self.replacements, TRIGGER_OPEN]
+            for length in range(1, len(to_replace))
+        }
+        self.max_partial_length = max(map(len, self.partial_matches), default=0)
+
+    def stream(self) -> "ResponseFilterStream":
+        """Starts filtering a new response as it streams in."""
+        return ResponseFilterStream(self)
+
+    def apply(self, text: str) -> FilteredResponse:
+        """Filters a whole response at once.
+
+        Args:
+            text (str): The response from the model.
+
+        Returns:
+            FilteredResponse: The filtered response.
+        """
+        response_stream = self.stream()
+        response_stream.feed(text)
+        return response_stream.finish()
+
+    def ready_length(self, pending: str) -> int:
+        """Returns how much of the pending text can be filtered without knowing what comes next.
+
+        Args:
+            pending (str): The text streamed in but not filtered yet.
+
+        Returns:
+            int: The length of the start of the text that's safe to filter.
+        """
+        ready_length = len(pending)
+        # a trigger that hasn't closed yet is held until it does
+        trigger_start = pending.rfind(TRIGGER_OPEN)
+        if trigger_start >= 0 and pending.find(TRIGGER_CLOSE, trigger_start) < 0:
+            ready_length = trigger_start
+        # as is the start of a replacement or trigger cut off at the end
+        for start in range(
+            max(0, len(pending) - self.max_partial_length), ready_length
+        ):
+            if pending[start:] in self.partial_matches:
+                return start
+        return ready_length
+
+
+class ResponseFilterStream:
+    """Filters one response as it streams in, holding back only the end of it that could still become a replacement, trigger, or voice prefix."""
+
+    def __init__(self, response_filter: ResponseFilter):
+        """Initializes the stream.
+
+        Args:
+            response_filter (ResponseFilter): The character's compiled rules.
+        """
+        self.response_filter = response_filter
+        # streamed in but not filtered yet
+        self.pending = ""
+        self.text_parts = []
+        self.spoken_parts = []
+        self.triggered_character_names = []
+        self.voice_prefix = None
+        # the start of the spoken text, held until it's known whether it starts with a voice prefix
+        self.spoken_head = ""
+        self.spoken_head_resolved = not response_filter.supported_prefixes
+
+    def feed(self, chunk: str) -> str:
+        """Filters the next chunk of the response.
+
+        Args:
+            chunk (str): The next part of the response, EG: a token from the model.
+
+        Returns:
+            str: The spoken text that is now ready, which may be empty while text is held back.
+        """
+        self.pending += chunk
+        return self.filter_pending(self.response_filter.ready_length(self.pending))
+
+    def finish(self) -> FilteredResponse:
+        """Filters whatever is still held back, once the whole response has streamed in.
+
+        Returns:
+            FilteredResponse: The filtered response.
+        """
+        self.filter_pending(len(self.pending), final=True)
+        return FilteredResponse(
+            text="".join(self.text_parts),
+            spoken_text="".join(self.spoken_parts),
+            voice_prefix=self.voice_prefix,
+            triggered_character_names=self.triggered_character_names,
+        )
+
+    def filter_pending(self, length: int, final: bool = False) -> str:
+        """Filters the start of the pending text.
+
+        Args:
+            length (int): How much of the pending text to filter.
+            final (bool, optional): Whether the response has finished streaming in. Defaults to False.
+
+        Returns:
+            str: The spoken text that is now ready.
+        """
+        response_filter = self.response_filter
+        spoken_parts = []
+        last_end = 0
+        for match in response_filter.pattern.finditer(self.pending):
+            if match.end() > length:
+                # a match cut off by the held back text waits for it
+                length = min(length, match.start())
+                break
+            unmatched = self.pending[last_end : match.start()]
+            self.text_parts.append(unmatched)
+            spoken_parts.append(unmatched)
+            triggered_name = match.group("triggered_name")
+            if triggered_name is not None:
+                # triggers stay in the text, but aren't spoken
+                self.triggered_character_names.append(triggered_name)
+                self.text_parts.append(match.group(0))
+            else:
+                replace_with = response_filter.replacements[match.group(0)]
+                self.text_parts.append(replace_with)
+                spoken_parts.append(replace_with)
+            last_end = match.end()
+        unmatched = self.pending[last_end:length]
+        self.text_parts.append(unmatched)
+        spoken_parts.append(unmatched)
+        self.pending = self.pending[length:]
+
+        spoken = "".join(spoken_parts)
+        if not self.spoken_head_resolved:
+            spoken = self.resolve_voice_prefix(spoken, final)
+        self.spoken_parts.append(spoken)
+        return spoken
+
+    def resolve_voice_prefix(self, spoken: str, final: bool) -> str:
+        """Holds the start of the spoken text until it's known whether it starts with voice prefixes, removing them if it does.
+
+        Args:
+            spoken (str): The spoken text just filtered.
+            final (bool): Whether the response has finished streaming in.
+
+        Returns:
+            str: The spoken text that is now ready.
+        """
+        head = self.spoken_head + spoken
+        # models sometimes chain prefixes, EG: "(happy)(excited)", the last one is used
+        while head.startswith("("):
+            closing_index = head.find(")")
+            if closing_index < 0:
+                if not final and len(head) < self.response_filter.max_prefix_length:
+                    # could still be a prefix
+                    self.spoken_head = head
+                    return ""
+                break
+            prefix = head[: closing_index + 1]
+            if prefix not in self.response_filter.supported_prefixes:
+                break
+            self.voice_prefix = prefix
+            head = head[len(prefix) :]
+        if head == "" and not final:
+            # another prefix could follow
+            self.spoken_head = head
+            return ""
+        self.spoken_head = ""
+        self.spoken_head_resolved = True
+        return head
@@ -0,0 +1,798 @@
+import asyncio
+import json
+import os
+import re
+import secrets
+
+from aiohttp import WSCloseCode, WSMsgType, web
+from rich import print
+
+from .ai_character import AICharacter
+from .azure_connections import AzureConnectionsManager
+from .cancellation import CancellationToken, raise_if_cancelled
+from .eleven_labs import ElevenLabsManager
+from .http_clients import SharedHttpClients
+from .loudness_envelope import LoudnessEnvelope
+from .metrics import MetricsRecorder
+from .orchestrator import DialogueOrchestrator
+from .state_handoff import StateHandoff
+from .utils import read_config_file
+
+TOKEN_CONFIG_FILEPATH = "configs/token_config.json"
+CHARACTER_CONFIG_FILEPATH = "configs/character_config.json"
+SYSTEM_CONFIG_FILEPATH = "configs/system_config.json"
+# session ids become part of their characters' chat history file names
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+# the state clients are sent when it changes, anything else (EG: fonts) only matters to the server
+PUBLISHED_ATTRIBUTES = {
+    "state",
+    "subtitles",
+    "voice_image",
+    "voice_color",
+    "voice_style",
+    "loudness_envelope",
+    "audio_with_timestamps",
+}
+
+
+def serialize_state(value):
+    """Converts a published state value to JSON.
+
+    Args:
+        value: The value, EG: a character's state, their LoudnessEnvelope, or the subtitle timing of the audio being spoken.
+
+    Returns:
+        The value as something json.dumps accepts.
+    """
+    if isinstance(value, LoudnessEnvelope):
+        return {
+            "frame_seconds": value.frame_seconds,
+            "levels": value.levels.round(3).tolist(),
+        }
+    if hasattr(value, "alignment"):
+        # 11labs' AudioWithTimestampsResponseModel or Azure's SubtitleTimeline, without the audio itself
+        alignment = value.alignment
+        if alignment is None:
+            return None
+        return {
+            "characters": list(alignment.characters),
+            "character_start_times_seconds": list(
+                alignment.character_start_times_seconds
+            ),
+            "character_end_times_seconds": list(
+                getattr(alignment, "character_end_times_seconds", None) or []
+            ),
+        }
+    return value
+
+
+class SessionStateHandoff(StateHandoff):
+    """Applies a session's state changes on the server's event loop as soon as they're posted, and publishes them to its clients.
+
+    There's no drawing thread to wait for, the clients draw the state themselves.
+    """
+
+    def __init__(self, session: "ServerSession"):
+        """Initializes the handoff.
+
+        Args:
+            session (ServerSession): The session whose state changes.
+        """
+        super().__init__()
+        self.session = session
+
+    def post(self, target, **changes):
+        """Applies attribute changes to the target on the event loop, from any thread.
+
+        Args:
+            target (object): The object to change, EG: an AICharacter or the ServerSession.
+            **changes: The attribute names and their new values.
+        """
+        self.session.loop.call_soon_threadsafe(
+            self.session.apply_changes, target, changes
+        )
+
+    def post_call(self, callback, *args):
+        """Calls a function on the event loop, from any thread.
+
+        Args:
+            callback (callable): The function to call.
+            *args: Arguments to call it with.
+        """
+        self.session.loop.call_soon_threadsafe(callback, *args)
+
+
+class SessionAudioManager:
+    """Streams a session's audio to its clients instead of playing it on the server."""
+
+    def __init__(self, session: "ServerSession"):
+        """Initializes the audio manager.
+
+        Args:
+            session (ServerSession): The session whose clients receive the audio.
+        """
+        self.session = session
+
+    def play_audio(
+        self,
+        file_path: str,
+        sleep_during_playback: bool = True,
+        delete_file: bool = False,
+        play_using_music: bool = True,
+        cancellation_token: CancellationToken = None,
+    ):
+        """Sends an audio file to the session's clients, which play it themselves.
+        Called from a worker thread, like AudioManager.play_audio.
+
+        Args:
+            file_path (str): The path to the audio file.
+            sleep_during_playback (bool, optional): Unused, the audio plays on the clients so there's nothing to wait for.
+            delete_file (bool, optional): Unused, the file may still be reused from the response cache.
+            play_using_music (bool, optional): Unused, only one clip plays at a time.
+            cancellation_token (CancellationToken, optional): Doesn't send the audio when cancelled.
+
+        Raises:
+            TurnCancelled: If the cancellation token was cancelled.
+        """
+        raise_if_cancelled(cancellation_token)
+        with open(file_path, "rb") as audio_file:
+            audio = audio_file.read()
+        self.session.loop.call_soon_threadsafe(
+            self.session.publish_audio, file_path, audio, cancellation_token
+        )
+
+    def stop(self):
+        """Tells the clients to stop playing the audio, EG: when the characters are interrupted."""
+        self.session.loop.call_soon_threadsafe(self.session.publish, {"type": "stop"})
+
+
+class ServerSession:
+    """One independent scene of characters, with its own activation queue, chat histories, and clients.
+
+    Provides the parts of CommanderGPTApp the orchestrator and characters use,
+    sharing the server's pooled connections, TTS managers, and metrics with every other session.
+    """
+
+    def __init__(
+        self,
+        server: "DialogueServer",
+        session_id: str,
+        character_configs: dict,
+        activation_mode: str = None,
+    ):
+        """Creates the session's characters and orchestrator, without starting it.
+
+        Args:
+            server (DialogueServer): The server hosting the session.
+            session_id (str): Identifies the session in the API and its characters' chat history files.
+            character_configs (dict): The config key -> config of each character in the scene.
+            activation_mode (str, optional): "sequential" or "ensemble", overriding system_config.json for this session. Defaults to None.
+        """
+        self.session_id = session_id
+        self.loop = server.loop
+        self.client_queue_size = server.client_queue_size
+        self.system_config = server.system_config
+        if activation_mode is not None:
+            self.system_config = {
+                **server.system_config,
+                "activation_mode": activation_mode,
+            }
+        self.token_config = server.token_config
+        self.metrics = server.metrics
+        self.http_clients = server.http_clients
+        self.elevenlabs_manager = server.elevenlabs_manager
+        self.speechtotext_manager = server.speechtotext_manager
+
+        # there's no keyboard, mic, window, or twitch chat, everything arrives from the clients
+        self.mic_activation_key = None
+        self.speech_recognizer = None
+        self.enable_screenshot_toggle_key = None
+        self.render_profiler = None
+        self.compositor = None
+        self.config_watcher = None
+        self.twitch_bot = None
+        self.enable_twitch_integration = False
+
+        self.subtitles = None
+        self.audio_with_timestamps = None
+        self.current_subtitile_timing: float = 0
+        self.state_handoff = SessionStateHandoff(self)
+        self.audio_manager = SessionAudioManager(self)
+        # websocket -> the queue of messages waiting to be sent to it
+        self.clients = {}
+
+        self.ai_characters = []
+        self.character_config_keys = {}
+        for character_config_key, character_info in character_configs.items():
+            ai_character = AICharacter(
+                commander_gpt=self,
+                config=character_info,
+                chat_history_filepath=f"chat_history/{session_id}_{character_config_key}_history.json",
+            )
+            self.ai_characters.append(ai_character)
+            self.character_config_keys[ai_character] = character_config_key
+        for ai_character in self.ai_characters:
+            for other_ai_character in self.ai_characters:
+                if ai_character.name != other_ai_character.name:
+                    ai_character.other_ai_characters.append(other_ai_character)
+
+        self.orchestrator = DialogueOrchestrator(commander_gpt=self, loop=self.loop)
+        self.task: asyncio.Task = None
+
+    async def start(self):
+        """Starts running the session's activation queue on the server's event loop."""
+        self.task = self.loop.create_task(
+            self.orchestrator.main(listen_for_keys=False, shared_services=False)
+        )
+        # let main create the activation queue before any commands arrive
+        await asyncio.sleep(0)
+
+    async def close(self):
+        """Stops the session and disconnects its clients."""
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        for websocket in list(self.clients):
+            await websocket.close(
+                code=WSCloseCode.GOING_AWAY, message=b"Session closed"
+            )
+        self.clients.clear()
+
+    def preload_images(self, file_paths: list[str]):
+        """Does nothing, the clients draw the characters so there's nothing to decode on the server."""
+
+    def find_character(self, name: str) -> AICharacter:
+        """Finds one of the session's characters.
+
+        Args:
+            name (str): The character's name or their key in character_config.json.
+
+        Returns:
+            AICharacter: The character.
+
+        Raises:
+            ValueError: If no character in the session has that name.
+        """
+        for ai_character in self.ai_characters:
+            if name in (ai_character.name, self.character_config_keys[ai_character]):
+                return ai_character
+        raise ValueError(f"There's no character named {name} in this session.")
+
+    def handle_command(self, command: dict):
+        """Runs a command from a client.
+
+        Args:
+            command (dict): The command, EG: {"type": "prompt", "text": "Hello", "activate": ["commander"]},
+                {"type": "activate", "character": "commander"}, or {"type": "interrupt"}.
+
+        Raises:
+            ValueError: If the command isn't valid.
+        """
+        command_type = command.get("type", None)
+        if command_type == "prompt":
+            self.prompt(command.get("text", None), command.get("activate", []))
+        elif command_type == "activate":
+            self.orchestrator.activate_character(
+                self.find_character(command.get("character", None))
+            )
+        elif command_type == "interrupt":
+            self.orchestrator.interrupt()
+        else:
+            raise ValueError(f"Unknown command type {command_type}.")
+
+    def prompt(self, text: str, character_names: list[str]):
+        """Sets what the next character responds to, like speaking into the mic does, and activates the given characters.
+
+        Args:
+            text (str): The prompt.
+            character_names (list[str]): The names of the characters to respond, in order.
+
+        Raises:
+            ValueError: If the prompt is empty or a character isn't in the session.
+        """
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError("The prompt's text must be a non-empty string.")
+        if not isinstance(character_names, list):
+            raise ValueError("activate must be a list of character names.")
+        # check them all before changing anything
+        ai_characters = [self.find_character(name) for name in character_names]
+        self.orchestrator.last_characters_response = text
+        self.state_handoff.post(self, subtitles=text)
+        for ai_character in ai_characters:
+            self.orchestrator.activate_character(ai_character)
+
+    def snapshot(self) -> dict:
+        """Returns the session's current state, sent to each client when it connects.
+
+        Returns:
+            dict: The session id, activation mode, the user's subtitles, and each character's state.
+        """
+        return {
+            "type": "snapshot",
+            "session_id": self.session_id,
+            "activation_mode": self.orchestrator.activation_mode,
+            "subtitles": self.subtitles,
+            "characters": [
+                {
+                    "key": self.character_config_keys[ai_character],
+                    "name": ai_character.name,
+                    **{
+                        name: serialize_state(getattr(ai_character, name, None))
+                        for name in PUBLISHED_ATTRIBUTES
+                        if name != "audio_with_timestamps"
+                    },
+                }
+                for ai_character in self.ai_characters
+            ],
+        }
+
+    def apply_changes(self, target, changes: dict):
+        """Applies state changes posted by the orchestrator, and publishes them to the clients.
+
+        Args:
+            target (object): The AICharacter or ServerSession to change.
+            changes (dict): The attribute names and their new values.
+        """
+        for name, value in changes.items():
+            setattr(target, name, value)
+        published_changes = {
+            name: serialize_state(value)
+            for name, value in changes.items()
+            if name in PUBLISHED_ATTRIBUTES
+        }
+        if published_changes:
+            event = {"type": "state", "changes": published_changes}
+            if isinstance(target, AICharacter):
+                event["character"] = target.name
+            self.publish(event)
+
+    def connect(self, websocket: web.WebSocketResponse) -> asyncio.Queue:
+        """Starts publishing the session's events to a client, beginning with a snapshot of its state.
+
+        Args:
+            websocket (web.WebSocketResponse): The client's connection.
+
+        Returns:
+            asyncio.Queue: The client's queue of messages to send.
+        """
+        client_queue = asyncio.Queue(maxsize=self.client_queue_size)
+        client_queue.put_nowait(json.dumps(self.snapshot()))
+        self.clients[websocket] = client_queue
+        return client_queue
+
+    def disconnect(self, websocket: web.WebSocketResponse):
+        """Stops publishing to a client.
+
+        Args:
+            websocket (web.WebSocketResponse): The client's connection.
+        """
+        self.clients.pop(websocket, None)
+
+    def publish(self, message):
+        """Queues a message to every client.
+
+        Args:
+            message (dict | bytes): An event, sent as JSON, or binary audio.
+        """
+        if not isinstance(message, bytes):
+            message = json.dumps(message)
+        for websocket in list(self.clients):
+            self.publish_to(websocket, message)
+
+    def publish_to(self, websocket: web.WebSocketResponse, message):
+        """Queues a message to one client.
+        A client that falls so far behind its queue fills up is disconnected, rather than holding up the others or using unbounded memory.
+
+        Args:
+            websocket (web.WebSocketResponse): The client's connection.
+            message (dict | str | bytes): An event, sent as JSON, or binary audio.
+        """
+        client_queue = self.clients.get(websocket, None)
+        if client_queue is None:
+            return
+        if isinstance(message, dict):
+            message = json.dumps(message)
+        try:
+            client_queue.put_nowait(message)
+        except asyncio.QueueFull:
+            print(
+                f"[red]\nDisconnecting a client of session {self.session_id}, it fell too far behind."
+            )
+            self.disconnect(websocket)
+            self.loop.create_task(
+                websocket.close(
+                    code=WSCloseCode.POLICY_VIOLATION, message=b"Fell too far behind"
+                )
+            )
+
+    def publish_audio(
+        self,
+        file_path: str,
+        audio: bytes,
+        cancellation_token: CancellationToken = None,
+    ):
+        """Sends audio to the clients, as an "audio" event followed by the file's bytes in a binary message.
+
+        Args:
+            file_path (str): The path of the audio file, its extension is the format.
+            audio (bytes): The contents of the file.
+            cancellation_token (CancellationToken, optional): The audio isn't sent if this was cancelled since it was read, so it never arrives after the "stop" event.
+        """
+        if cancellation_token is not None and cancellation_token.cancelled:
+            return
+        self.publish(
+            {
+                "type": "audio",
+                "format": os.path.splitext(file_path)[1].lstrip(".").lower(),
+                "bytes": len(audio),
+            }
+        )
+        self.publish(audio)
+
+
+class DialogueServer:
+    """Serves independent dialogue sessions over a local HTTP and WebSocket API, so the characters can be driven by other tools instead of the keyboard.
+
+    Every session runs on the server's single event loop, sharing the pooled connections, TTS managers, and metrics.
+    """
+
+    def __init__(self, system_config: dict, token_config: dict):
+        """Initializes the server without starting it.
+
+        Args:
+            system_config (dict): The contents of system_config.json.
+            token_config (dict): The contents of token_config.json.
+        """
+        self.system_config = system_config
+        self.token_config = token_config
+        server_config = system_config.get("server", {})
+        self.host = server_config.get("host", "127.0.0.1")
+        self.port = server_config.get("port", 8765)
+        self.max_sessions = server_config.get("max_sessions", 16)
+        self.client_queue_size = server_config.get("client_queue_size", 256)
+
+        # session id -> ServerSession
+        self.sessions = {}
+        self.sessions_lock: asyncio.Lock = None
+        self.loop: asyncio.AbstractEventLoop = None
+        self.background_tasks = []
+
+        http_clients_config = system_config.get("http_clients", {})
+        self.warm_up_connections = http_clients_config.get("warm_up", True)
+        self.keep_warm_interval_seconds = http_clients_config.get(
+            "keep_warm_interval_seconds", 45
+        )
+        self.http_clients = SharedHttpClients(
+            max_connections=http_clients_config.get("max_connections", 20),
+            max_keepalive_connections=http_clients_config.get(
+                "max_keepalive_connections", 10
+            ),
+            keepalive_expiry_seconds=http_clients_config.get(
+                "keepalive_expiry_seconds", 120
+            ),
+            http2=http_clients_config.get("http2", False),
+        )
+        metrics_config = system_config.get("metrics", {})
+        enable_metrics = metrics_config.get("enabled", False)
+        self.metrics = MetricsRecorder(
+            spans_filepath=(
+                metrics_config.get("spans_filepath", "logs/turn_spans.jsonl")
+                if enable_metrics
+                else None
+            ),
+            prometheus_port=(
+                metrics_config.get("prometheus_port", 9464) if enable_metrics else None
+            ),
+        )
+        # created when the first session needs them
+        self.elevenlabs_manager: ElevenLabsManager = None
+        self.speechtotext_manager: AzureConnectionsManager = None
+
+    def create_app(self) -> web.Application:
+        """Creates the aiohttp application serving the API.
+
+        Returns:
+            web.Application: The application, EG: for web.run_app.
+        """
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/sessions", self.list_sessions),
+                web.post("/sessions", self.create_session),
+                web.get("/sessions/{session_id}", self.get_session_state),
+                web.delete("/sessions/{session_id}", self.delete_session),
+                web.get("/sessions/{session_id}/events", self.stream_events),
+                web.post(
+                    "/sessions/{session_id}/{command_type:prompt|activate|interrupt}",
+                    self.post_command,
+                ),
+            ]
+        )
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+    async def on_startup(self, app: web.Application):
+        """Starts the services every session shares, the connection warm up and metrics server."""
+        self.loop = asyncio.get_running_loop()
+        self.sessions_lock = asyncio.Lock()
+        if self.warm_up_connections:
+            if self.keep_warm_interval_seconds > 0:
+                self.background_tasks.append(
+                    self.loop.create_task(
+                        self.http_clients.keep_warm(self.keep_warm_interval_seconds)
+                    )
+                )
+            else:
+                self.background_tasks.append(
+                    self.loop.create_task(self.http_clients.warm_up())
+                )
+        if self.metrics.prometheus_port:
+            self.background_tasks.append(
+                self.loop.create_task(self.metrics.serve_prometheus())
+            )
+        print(f"[green]\nServing dialogue sessions at http://{self.host}:{self.port}")
+
+    async def on_cleanup(self, app: web.Application):
+        """Closes every session and stops the shared services."""
+        for session in list(self.sessions.values()):
+            await session.close()
+        self.sessions.clear()
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+
+    def prepare_tts(self, character_configs: dict):
+        """Creates the TTS managers the characters need if no session has needed them yet, and looks up any 11labs voices not used before.
+        Called from a worker thread, since it may wait on 11labs.
+
+        Args:
+            character_configs (dict): The config key -> config of each character in the new session.
+        """
+        elevenlabs_voices = [
+            character_info.get("elevenlabs_voice", None)
+            for character_info in character_configs.values()
+            if character_info.get("use_elevenlabs_voice", True)
+            and character_info.get("elevenlabs_voice", None)
+        ]
+        if elevenlabs_voices and self.elevenlabs_manager is None:
+            elevenlabs_api_key = self.token_config.get("elevenlabs_api_key", None)
+            self.elevenlabs_manager = ElevenLabsManager(
+                elevenlabs_api_key=elevenlabs_api_key,
+                client=self.http_clients.elevenlabs_client(elevenlabs_api_key),
+                voice_names=elevenlabs_voices,
+                voice_cache_filepath=self.system_config.get(
+                    "elevenlabs_voice_cache_filepath", "cache/elevenlabs_voices.json"
+                ),
+                voice_cache_ttl_seconds=self.system_config.get(
+                    "elevenlabs_voice_cache_ttl_hours", 24
+                )
+                * 60
+                * 60,
+                output_format=self.system_config.get(
+                    "elevenlabs_output_format", "pcm_24000"
+                ),
+            )
+        elif elevenlabs_voices:
+            self.elevenlabs_manager.voice_catalog.resolve(elevenlabs_voices)
+
+        uses_azure = any(
+            not character_info.get("use_elevenlabs_voice", True)
+            for character_info in character_configs.values()
+        )
+        if uses_azure and self.speechtotext_manager is None:
+            self.speechtotext_manager = AzureConnectionsManager(
+                azure_tts_key=self.token_config.get("azure_tts_key", None),
+                azure_tts_region=self.token_config.get("azure_tts_region", None),
+                speech_recognition_language=self.system_config.get(
+                    "speech_recognition_language", "en-US"
+                ),
+            )
+
+    def build_session(
+        self, session_id: str, character_config_keys: list[str], activation_mode: str
+    ) -> ServerSession:
+        """Creates a session's characters, reading character_config.json again so edits apply to new sessions.
+        Called from a worker thread, since it reads files and may load local models.
+
+        Args:
+            session_id (str): The new session's id.
+            character_config_keys (list[str]): The characters' keys in character_config.json.
+            activation_mode (str): "sequential" or "ensemble", or None for the one in system_config.json.
+
+        Returns:
+            ServerSession: The session, not started yet.
+
+        Raises:
+            ValueError: If a character isn't defined or their config is invalid.
+        """
+        character_config = read_config_file(CHARACTER_CONFIG_FILEPATH)
+        character_configs = {}
+        for character_config_key in character_config_keys:
+            character_info = character_config.get(character_config_key, None)
+            if character_info is None:
+                raise ValueError(
+                    f"The character {character_config_key} is not defined in character_config.json."
+                )
+            character_configs[character_config_key] = character_info
+        self.prepare_tts(character_configs)
+        try:
+            return ServerSession(
+                server=self,
+                session_id=session_id,
+                character_configs=character_configs,
+                activation_mode=activation_mode,
+            )
+        except SystemExit as e:
+            # the characters' configs exit when they're invalid, which shouldn't stop the server
+            raise ValueError(str(e)) from None
+
+    def find_session(self, request: web.Request) -> ServerSession:
+        """Returns the session a request is for.
+
+        Raises:
+            web.HTTPNotFound: If there's no session with the requested id.
+        """
+        session = self.sessions.get(request.match_info["session_id"], None)
+        if session is None:
+            raise web.HTTPNotFound(text="There's no session with that id.")
+        return session
+
+    async def read_json(self, request: web.Request) -> dict:
+        """Returns the JSON object in a request's body, or an empty one if it has no body.
+
+        Raises:
+            web.HTTPBadRequest: If the body isn't a JSON object.
+        """
+        if not request.can_read_body:
+            return {}
+        try:
+            body = await request.json()
+        except json.JSONDecodeError as e:
+            raise web.HTTPBadRequest(text=f"The body isn't valid JSON: {e}")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="The body must be a JSON object.")
+        return body
+
+    async def list_sessions(self, request: web.Request) -> web.Response:
+        """GET /sessions, lists each session's id and characters."""
+        return web.json_response(
+            {
+                "sessions": [
+                    {
+                        "session_id": session.session_id,
+                        "characters": list(session.character_config_keys.values()),
+                    }
+                    for session in self.sessions.values()
+                ]
+            }
+        )
+
+    async def create_session(self, request: web.Request) -> web.Response:
+        """POST /sessions {"characters": [...], "session_id"?, "activation_mode"?}, starts a new session.
+        Reusing the id of an earlier session carries on from its characters' chat histories.
+        """
+        body = await self.read_json(request)
+        character_config_keys = body.get("characters", None)
+        if not isinstance(character_config_keys, list) or not character_config_keys:
+            raise web.HTTPBadRequest(
+                text="characters must be a list of the keys of characters in character_config.json."
+            )
+        session_id = body.get("session_id", None) or secrets.token_hex(6)
+        if not isinstance(session_id, str) or not SESSION_ID_PATTERN.fullmatch(
+            session_id
+        ):
+            raise web.HTTPBadRequest(
+                text="session_id may only contain letters, numbers, _ and -, up to 64 of them."
+            )
+        activation_mode = body.get("activation_mode", None)
+        if activation_mode not in (None, "sequential", "ensemble"):
+            raise web.HTTPBadRequest(
+                text='activation_mode must be "sequential" or "ensemble".'
+            )
+
+        async with self.sessions_lock:
+            if session_id in self.sessions:
+                raise web.HTTPConflict(text="A session with that id already exists.")
+            if len(self.sessions) >= self.max_sessions:
+                raise web.HTTPServiceUnavailable(
+                    text=f"The server is already running its limit of {self.max_sessions} sessions."
+                )
+            try:
+                session = await asyncio.to_thread(
+                    self.build_session,
+                    session_id,
+                    character_config_keys,
+                    activation_mode,
+                )
+            except ValueError as e:
+                raise web.HTTPBadRequest(text=str(e))
+            await session.start()
+            self.sessions[session_id] = session
+        print(
+            f"[green]\nStarted session {session_id} with {', '.join(character_config_keys)}."
+        )
+        return web.json_response(session.snapshot(), status=201)
+
+    async def get_session_state(self, request: web.Request) -> web.Response:
+        """GET /sessions/{session_id}, the session's current state."""
+        return web.json_response(self.find_session(request).snapshot())
+
+    async def delete_session(self, request: web.Request) -> web.Response:
+        """DELETE /sessions/{session_id}, stops the session and disconnects its clients."""
+        session = self.find_session(request)
+        self.sessions.pop(session.session_id, None)
+        await session.close()
+        print(f"[yellow]\nClosed session {session.session_id}.")
+        return web.Response(status=204)
+
+    async def post_command(self, request: web.Request) -> web.Response:
+        """POST /sessions/{session_id}/prompt {"text", "activate"?}, /activate {"character"}, or /interrupt."""
+        session = self.find_session(request)
+        command = await self.read_json(request)
+        command["type"] = request.match_info["command_type"]
+        try:
+            session.handle_command(command)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response(session.snapshot())
+
+    async def stream_events(self, request: web.Request) -> web.WebSocketResponse:
+        """GET /sessions/{session_id}/events, a WebSocket of the session's state and audio.
+
+        Clients are sent a snapshot, then each state change and clip of audio as it happens,
+        and may send the same commands as the HTTP API, EG: {"type": "interrupt"}.
+        """
+        session = self.find_session(request)
+        websocket = web.WebSocketResponse(heartbeat=30)
+        await websocket.prepare(request)
+        client_queue = session.connect(websocket)
+        sender = self.loop.create_task(self.send_events(websocket, client_queue))
+        try:
+            async for message in websocket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    command = json.loads(message.data)
+                    if not isinstance(command, dict):
+                        raise ValueError("Commands must be JSON objects.")
+                    session.handle_command(command)
+                except ValueError as e:
+                    # json.JSONDecodeError is a ValueError too
+                    session.publish_to(websocket, {"type": "error", "message": str(e)})
+        finally:
+            session.disconnect(websocket)
+            sender.cancel()
+        return websocket
+
+    async def send_events(
+        self, websocket: web.WebSocketResponse, client_queue: asyncio.Queue
+    ):
+        """Sends a client its queued messages until it disconnects.
+
+        Args:
+            websocket (web.WebSocketResponse): The client's connection.
+            client_queue (asyncio.Queue): The client's queue of messages to send.
+        """
+        try:
+            while True:
+                message = await client_queue.get()
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_str(message)
+        except ConnectionError:
+            # the client went away, stream_events cleans up
+            pass
+
+
+def main():
+    """Runs the server until interrupted, EG: with Ctrl+C."""
+    server = DialogueServer(
+        system_config=read_config_file(SYSTEM_CONFIG_FILEPATH),
+        token_config=read_config_file(TOKEN_CONFIG_FILEPATH),
+    )
+    web.run_app(server.create_app(), host=server.host, port=server.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
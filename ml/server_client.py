@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+import time
+
+import aiohttp
+import numpy as np
+from rich import print
+
+from .ai_character import AICharacter
+from .loudness_envelope import LoudnessEnvelope
+from .orchestrator import DialogueOrchestrator
+from .subtitle_timeline import SubtitleAlignment, SubtitleTimeline
+
+
+def deserialize_state(name: str, value):
+    """Converts a state value published by the server back to what the app draws, the reverse of server.serialize_state.
+
+    Args:
+        name (str): The attribute's name, EG: "state" or "loudness_envelope".
+        value: The value from the JSON event.
+
+    Returns:
+        The value, with loudness envelopes and subtitle timing as the objects the app uses.
+    """
+    if value is None:
+        return None
+    if name == "loudness_envelope":
+        return LoudnessEnvelope(
+            levels=np.asarray(value["levels"], dtype=np.float32),
+            frame_seconds=value["frame_seconds"],
+        )
+    if name == "audio_with_timestamps":
+        return SubtitleTimeline(
+            SubtitleAlignment(
+                characters=value["characters"],
+                character_start_times_seconds=value["character_start_times_seconds"],
+                character_end_times_seconds=value["character_end_times_seconds"],
+            )
+        )
+    return value
+
+
+class ServerClientOrchestrator(DialogueOrchestrator):
+    """Runs the window app as a client of a dialogue server's session, instead of running the characters' turns itself.
+
+    The mic and hotkeys work as usual, but prompts, activations, and interrupts are sent to the session,
+    and its state changes and audio are drawn and played here as they arrive.
+    """
+
+    def __init__(self, commander_gpt):
+        """Initializes the client, creating the event loop without starting it or connecting.
+
+        Args:
+            commander_gpt (CommanderGPTApp): The commander gpt app, whose characters are drawn for the session's.
+        """
+        super().__init__(commander_gpt=commander_gpt)
+        server_client_config = commander_gpt.system_config.get("server_client", {})
+        self.server_url = server_client_config.get(
+            "url", "http://127.0.0.1:8765"
+        ).rstrip("/")
+        self.session_id = server_client_config.get("session_id", "window")
+        self.reconnect_seconds = server_client_config.get("reconnect_seconds", 5)
+        # the commands waiting to be sent, in order, while connected
+        self.commands: asyncio.Queue = None
+        # the audio file playing, deleted once the next one starts
+        self.audio_filepath: str = None
+        self.audio_count = 0
+        # when the latest audio started playing here, from time.monotonic(), to time its subtitles from
+        self.playback_started_at: float = 0
+
+    async def main(self, listen_for_keys: bool = True, shared_services: bool = True):
+        """Joins the server's session and applies its events until the app exits, connecting again whenever the connection is lost.
+
+        Args:
+            listen_for_keys (bool, optional): Whether to listen to the keyboard, disabled when driven headlessly. Defaults to True.
+            shared_services (bool, optional): Unused, the server runs the connection warm up and metrics for its sessions.
+        """
+        self.mic_lock = asyncio.Lock()
+        if listen_for_keys:
+            self.hotkeys.start()
+        async with aiohttp.ClientSession() as http_session:
+            while True:
+                try:
+                    await self.join_session(http_session)
+                    await self.receive_events(http_session)
+                    print(
+                        f"[red]\nThe server closed session {self.session_id}, connecting again in {self.reconnect_seconds}s."
+                    )
+                except aiohttp.ClientError as e:
+                    print(
+                        f"[red]\nCouldn't connect to the server at {self.server_url}, trying again in {self.reconnect_seconds}s. {e}"
+                    )
+                self.commands = None
+                await asyncio.sleep(self.reconnect_seconds)
+
+    async def join_session(self, http_session: aiohttp.ClientSession):
+        """Starts the session for the app's characters, or joins it if the server is already running it.
+
+        Args:
+            http_session (aiohttp.ClientSession): The connection to the server.
+
+        Raises:
+            aiohttp.ClientError: If the server can't be reached or refused the session.
+        """
+        commander_gpt = self.commander_gpt
+        character_config_keys = [
+            commander_gpt.character_config_keys[ai_character]
+            for ai_character in commander_gpt.ai_characters
+        ]
+        async with http_session.post(
+            f"{self.server_url}/sessions",
+            json={
+                "characters": character_config_keys,
+                "session_id": self.session_id,
+                "activation_mode": self.activation_mode,
+            },
+        ) as response:
+            if response.status == 409:
+                # already running, EG: after reconnecting, so carry on with it
+                print(f"[yellow]\nJoining session {self.session_id}.")
+                return
+            if response.status >= 400:
+                print(f"[red]\nThe server refused the session: {await response.text()}")
+            response.raise_for_status()
+        print(
+            f"[green]\nStarted session {self.session_id} on the server with {', '.join(character_config_keys)}."
+        )
+
+    async def receive_events(self, http_session: aiohttp.ClientSession):
+        """Connects to the session's events, applying them and playing its audio until the connection closes.
+
+        Args:
+            http_session (aiohttp.ClientSession): The connection to the server.
+
+        Raises:
+            aiohttp.ClientError: If the connection fails.
+        """
+        async with http_session.ws_connect(
+            f"{self.server_url}/sessions/{self.session_id}/events", heartbeat=30
+        ) as websocket:
+            self.commands = asyncio.Queue()
+            sender = self.loop.create_task(self.send_commands(websocket))
+            print(
+                f"[green]\nConnected to session {self.session_id}. Press {self.commander_gpt.mic_activation_key} to start talking or the activation key for any character to hear them talk."
+            )
+            try:
+                # the format of the audio in the next binary message
+                audio_format = None
+                async for message in websocket:
+                    if message.type == aiohttp.WSMsgType.BINARY:
+                        if audio_format is not None:
+                            await self.play_audio(message.data, audio_format)
+                            audio_format = None
+                    elif message.type == aiohttp.WSMsgType.TEXT:
+                        event = json.loads(message.data)
+                        if event.get("type", None) == "audio":
+                            audio_format = event.get("format", "wav")
+                        else:
+                            self.apply_event(event)
+            finally:
+                sender.cancel()
+                self.commander_gpt.audio_manager.stop()
+
+    async def send_commands(self, websocket: aiohttp.ClientWebSocketResponse):
+        """Sends the queued commands to the session one at a time, so they arrive in the order they were made.
+
+        Args:
+            websocket (aiohttp.ClientWebSocketResponse): The connection to the session's events.
+        """
+        commands = self.commands
+        while True:
+            command = await commands.get()
+            await websocket.send_json(command)
+
+    def send(self, command: dict):
+        """Queues a command to the session. Must be called on the event loop.
+
+        Args:
+            command (dict): The command, EG: {"type": "interrupt"}.
+        """
+        if self.commands is None:
+            print(
+                f"[red]\nNot connected to the server at {self.server_url}, ignoring the {command['type']}."
+            )
+            return
+        self.commands.put_nowait(command)
+
+    def find_character(self, name: str) -> AICharacter:
+        """Finds one of the app's characters.
+
+        Args:
+            name (str): The character's name or their key in character_config.json.
+
+        Returns:
+            AICharacter: The character, or None if the app doesn't have them.
+        """
+        commander_gpt = self.commander_gpt
+        for ai_character in commander_gpt.ai_characters:
+            if name in (
+                ai_character.name,
+                commander_gpt.character_config_keys[ai_character],
+            ):
+                return ai_character
+        return None
+
+    def apply_event(self, event: dict):
+        """Applies an event from the session to the app's state, through its StateHandoff.
+
+        Args:
+            event (dict): The event, EG: {"type": "state", "character": "NoiR", "changes": {"state": "talking"}}.
+        """
+        commander_gpt = self.commander_gpt
+        state_handoff = commander_gpt.state_handoff
+        event_type = event.get("type", None)
+        if event_type == "snapshot":
+            for character_state in event.get("characters", []):
+                ai_character = self.find_character(character_state.get("key", None))
+                if ai_character is None:
+                    continue
+                changes = {
+                    name: deserialize_state(name, value)
+                    for name, value in character_state.items()
+                    if name not in ("key", "name")
+                }
+                state_handoff.post(ai_character, **self.local_changes(changes))
+            state_handoff.post(commander_gpt, subtitles=event.get("subtitles", None))
+        elif event_type == "state":
+            target = commander_gpt
+            if "character" in event:
+                target = self.find_character(event["character"])
+                if target is None:
+                    return
+            changes = {
+                name: deserialize_state(name, value)
+                for name, value in event.get("changes", {}).items()
+            }
+            if changes.get("audio_with_timestamps", None) is not None:
+                # time the subtitles from when the audio started playing here
+                changes["current_subtitile_timing"] = self.playback_started_at
+            state_handoff.post(target, **self.local_changes(changes))
+        elif event_type == "stop":
+            commander_gpt.audio_manager.stop()
+        elif event_type == "error":
+            print(f"[red]\nThe server couldn't run a command: {event.get('message')}")
+
+    def local_changes(self, changes: dict) -> dict:
+        """Adjusts state changes from the session for what's happening here, EG: the user talking into the mic, which the server doesn't know about.
+
+        Args:
+            changes (dict): The attribute names and their new values.
+
+        Returns:
+            dict: The changes to apply.
+        """
+        if self.is_talking and changes.get("state", None) == "idle":
+            # characters stopped by the user talking keep listening until they're done
+            return {**changes, "state": "listening"}
+        return changes
+
+    async def play_audio(self, audio: bytes, audio_format: str):
+        """Plays a clip of audio from the session, deleting the one played before it.
+
+        Args:
+            audio (bytes): The contents of the audio file.
+            audio_format (str): Its format, EG: "wav".
+        """
+        self.audio_count += 1
+        file_path = f"assets/audio/___Server_{self.session_id}_{self.audio_count}.{audio_format}"
+        try:
+            await asyncio.to_thread(self.write_audio, file_path, audio)
+            await asyncio.to_thread(
+                self.commander_gpt.audio_manager.play_audio,
+                file_path=file_path,
+                sleep_during_playback=False,
+                delete_file=False,
+                play_using_music=True,
+            )
+        except Exception as e:
+            print(f"[red]\nFailed to play the audio from the server: {e}")
+        self.playback_started_at = time.monotonic()
+        previous_filepath, self.audio_filepath = self.audio_filepath, file_path
+        if previous_filepath is not None:
+            try:
+                os.remove(previous_filepath)
+            except OSError:
+                pass
+
+    def write_audio(self, file_path: str, audio: bytes):
+        """Saves a clip of audio from the session so it can be played.
+
+        Args:
+            file_path (str): Where to save it.
+            audio (bytes): The contents of the audio file.
+        """
+        with open(file_path, "wb") as audio_file:
+            audio_file.write(audio)
+
+    def is_busy(self) -> bool:
+        """Whether any character is responding or talking, the session's activation queue is on the server."""
+        return any(
+            ai_character.state in ("thinking", "talking")
+            for ai_character in self.commander_gpt.ai_characters
+        )
+
+    def interrupt(self):
+        """Stops the audio straight away, and the session's characters mid turn. Must be called on the event loop."""
+        self.commander_gpt.audio_manager.stop()
+        self.send({"type": "interrupt"})
+        print("[yellow]\nInterrupted the characters.")
+
+    def set_prompt(self, prompt: str):
+        """Sends what the next character responds to, EG: what the user said into the mic, to the session.
+
+        Args:
+            prompt (str): The prompt, empty or None if nothing was said.
+        """
+        self.last_characters_response = prompt
+        if prompt:
+            self.send({"type": "prompt", "text": prompt, "activate": []})
+
+    def activate_character(self, ai_character: AICharacter):
+        """Activates a character in the session, unless the user is recording from the mic.
+        Must be called on the event loop.
+
+        Args:
+            ai_character (AICharacter): The AI Character to activate.
+        """
+        if self.is_talking:
+            print(
+                f"[red]\nMic is active, cannot activate character. Stop talking by pressing {self.commander_gpt.mic_activation_key} again."
+            )
+            return
+        self.send(
+            {
+                "type": "activate",
+                "character": self.commander_gpt.character_config_keys[ai_character],
+            }
+        )
+
+    def start_speculative_turn(self, prompt: str):
+        """Does nothing, the session's turns only start once the prompt is sent.
+
+        Args:
+            prompt (str): The transcript so far.
+
+        Returns:
+            None: There's no turn to cancel if the user keeps talking.
+        """
+        return None
@@ -0,0 +1,309 @@
+import threading
+import time
+
+import numpy as np
+import pyaudio
+from rich import print
+
+from .endpointing import normalize_transcript
+
+# Whisper models expect 16kHz mono audio
+SAMPLE_RATE = 16000
+FRAMES_PER_BUFFER = 1024
+# Whisper can only transcribe up to 30 seconds at once
+MAX_CHUNK_SECONDS = 25
+# chunks quieter than this (the loudest sample, from 0 to 1) are skipped, Whisper tends to make up words for silence
+SILENCE_PEAK = 0.01
+# the most words the end of one chunk and the start of the next are checked for repeating
+MAX_OVERLAP_WORDS = 8
+
+
+class AudioRingBuffer:
+    """Holds the most recent mic audio, overwriting the oldest once full, so recording never allocates or waits on transcription."""
+
+    def __init__(self, capacity_seconds: float, sample_rate: int = SAMPLE_RATE):
+        """Initializes an empty buffer.
+
+        Args:
+            capacity_seconds (float): How much audio to keep.
+            sample_rate (int, optional): The audio's sample rate. Defaults to SAMPLE_RATE.
+        """
+        self.samples = np.zeros(int(capacity_seconds * sample_rate), dtype=np.float32)
+        self.lock = threading.Lock()
+        # how many samples have ever been written, positions are counted from the first
+        self.written = 0
+
+    def write(self, samples: np.ndarray):
+        """Adds audio to the end of the buffer.
+
+        Args:
+            samples (np.ndarray): Float32 samples from -1 to 1.
+        """
+        capacity = len(self.samples)
+        samples = samples[-capacity:]
+        with self.lock:
+            start = self.written % capacity
+            first_part = min(len(samples), capacity - start)
+            self.samples[start : start + first_part] = samples[:first_part]
+            self.samples[: len(samples) - first_part] = samples[first_part:]
+            self.written += len(samples)
+
+    def read(self, start: int, end: int = None) -> np.ndarray:
+        """Copies audio out of the buffer, starting later if the start was already overwritten.
+
+        Args:
+            start (int): The position of the first sample.
+            end (int, optional): The position after the last sample. Defaults to everything written.
+
+        Returns:
+            np.ndarray: The samples.
+        """
+        capacity = len(self.samples)
+        with self.lock:
+            end = self.written if end is None else min(end, self.written)
+            start = max(start, end - capacity, 0)
+            indices = np.arange(start, end) % capacity
+            return self.samples[indices]
+
+
+def merge_overlap(transcript_words: list[str], chunk_words: list[str]) -> list[str]:
+    """Returns the chunk's words without those that repeat the end of the transcript, since chunks overlap.
+
+    Args:
+        transcript_words (list[str]): The words transcribed before the chunk.
+        chunk_words (list[str]): The chunk's words.
+
+    Returns:
+        list[str]: The chunk's new words.
+    """
+    normalized_transcript = [normalize_transcript(word) for word in transcript_words]
+    normalized_chunk = [normalize_transcript(word) for word in chunk_words]
+    for overlap in range(
+        min(MAX_OVERLAP_WORDS, len(transcript_words), len(chunk_words)), 0, -1
+    ):
+        if normalized_transcript[-overlap:] == normalized_chunk[:overlap]:
+            return chunk_words[overlap:]
+    return chunk_words
+
+
+class LocalWhisperSpeechToText:
+    """Transcribes the mic locally with a Whisper model from huggingface, so it works offline without a round trip per prompt.
+
+    The mic is recorded into a ring buffer, and a worker thread transcribes the current chunk every partial_interval_seconds for the in-progress subtitles.
+    Once a chunk is chunk_seconds long its words are kept and the next chunk starts overlap_seconds before its end,
+    so a word cut in half at the edge is heard whole in one of them.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "openai/whisper-base.en",
+        language: str = None,
+        device: str = "cpu",
+        chunk_seconds: float = 8.0,
+        overlap_seconds: float = 1.0,
+        partial_interval_seconds: float = 0.5,
+    ):
+        """Loads the model, downloading it the first time.
+
+        Args:
+            model_name (str, optional): The Whisper model on huggingface. Defaults to "openai/whisper-base.en".
+            language (str, optional): The language spoken, EG: "en", or None to detect it. Ignored by the English only ".en" models. Defaults to None.
+            device (str, optional): Where to run the model, EG: "cpu" or "cuda". Defaults to "cpu".
+            chunk_seconds (float, optional): How much audio is transcribed at once. Defaults to 8.
+            overlap_seconds (float, optional): How much of the end of each chunk starts the next. Defaults to 1.
+            partial_interval_seconds (float, optional): How often the in-progress transcript is updated. Defaults to 0.5.
+        """
+        from transformers import pipeline
+
+        print(f"[yellow]\nLoading {model_name} for speech to text...")
+        self.recognizer = pipeline(
+            "automatic-speech-recognition", model=model_name, device=device
+        )
+        self.backend_name = f"whisper:{model_name}"
+        self.generate_kwargs = {}
+        is_multilingual = getattr(
+            self.recognizer.model.generation_config, "is_multilingual", None
+        )
+        if is_multilingual is None:
+            is_multilingual = not model_name.endswith(".en")
+        # the English only ".en" models reject a task or language
+        if is_multilingual:
+            self.generate_kwargs["task"] = "transcribe"
+            if language:
+                self.generate_kwargs["language"] = language
+        elif language and language.lower() not in ("en", "english"):
+            print(
+                f"[yellow]\n{model_name} only understands English, ignoring the language {language}."
+            )
+        self.chunk_samples = int(min(chunk_seconds, MAX_CHUNK_SECONDS) * SAMPLE_RATE)
+        self.overlap_samples = int(overlap_seconds * SAMPLE_RATE)
+        self.partial_interval_seconds = partial_interval_seconds
+        # room for a whole chunk even if the worker falls behind
+        self.ring_buffer = AudioRingBuffer(3 * MAX_CHUNK_SECONDS)
+
+        self.pyaudio = pyaudio.PyAudio()
+        self.stream = None
+        self.worker = None
+        self.stop_event = threading.Event()
+        self.commander_gpt = None
+        self.on_transcript = None
+        # the words of the finished chunks, and where the current chunk starts in the ring buffer
+        self.transcript_words = []
+        self.chunk_start = 0
+
+    def start_speechtotext_from_mic(self, commander_gpt=None, on_transcript=None):
+        """Starts recording from the mic and transcribing it on a worker thread, returning once it is running.
+
+        Call stop_speechtotext_from_mic() to stop recording and get the result.
+
+        Args:
+            commander_gpt (CommanderGPTApp, optional): The app to show in-progress subtitles as you talk.
+            on_transcript (callable, optional): Called from the worker thread with everything transcribed so far, each time it's updated.
+        """
+        self.commander_gpt = commander_gpt
+        self.on_transcript = on_transcript
+        self.transcript_words = []
+        self.chunk_start = self.ring_buffer.written
+        self.stop_event.clear()
+        self.stream = self.pyaudio.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=SAMPLE_RATE,
+            input=True,
+            frames_per_buffer=FRAMES_PER_BUFFER,
+            stream_callback=self.record,
+        )
+        self.worker = threading.Thread(
+            target=self.transcribe_while_recording, name="speech_to_text", daemon=True
+        )
+        self.worker.start()
+        print("Local speech recognition is now running, say something.")
+
+    def stop_speechtotext_from_mic(self) -> str:
+        """Stops recording started by start_speechtotext_from_mic() and returns what was recognized.
+
+        Returns:
+            str: The recognized speech as a single string, or None if nothing was recognized.
+        """
+        print("\nEnding local speech recognition\n")
+        if self.stream is None:
+            # not recording, EG: starting it failed
+            return None
+        self.stop_event.set()
+        try:
+            self.worker.join()
+            self.stream.stop_stream()
+            self.stream.close()
+            # the end of the last chunk was recorded after the worker's last pass
+            try:
+                self.transcript_words.extend(
+                    merge_overlap(self.transcript_words, self.transcribe_chunk())
+                )
+            except Exception as e:
+                # keep the words transcribed before it rather than lose the whole prompt
+                print(f"[red]\nFailed to transcribe the end of the mic recording: {e}")
+        finally:
+            self.stream = None
+            self.worker = None
+        if len(self.transcript_words) <= 0:
+            return None
+
+        final_result = " ".join(self.transcript_words)
+        print(f"[green]\nHere’s the result we got!\n> {final_result}\n")
+        return final_result
+
+    def record(self, in_data: bytes, frame_count: int, time_info: dict, status: int):
+        """PyAudio's callback with each buffer recorded from the mic, called on PyAudio's thread."""
+        samples = np.frombuffer(in_data, dtype=np.int16).astype(np.float32) / 32768
+        self.ring_buffer.write(samples)
+        return None, pyaudio.paContinue
+
+    def transcribe_while_recording(self):
+        """Transcribes the current chunk every partial_interval_seconds until stopped, starting the next chunk whenever it's full."""
+        while not self.stop_event.wait(self.partial_interval_seconds):
+            chunk_end = self.ring_buffer.written
+            try:
+                chunk_words = self.transcribe_chunk(chunk_end)
+            except Exception as e:
+                # try again with the next pass rather than stop transcribing
+                print(f"[red]\nFailed to transcribe the mic: {e}")
+                continue
+            new_words = merge_overlap(self.transcript_words, chunk_words)
+            if chunk_end - self.chunk_start >= self.chunk_samples:
+                self.transcript_words.extend(new_words)
+                new_words = []
+                self.chunk_start = chunk_end - self.overlap_samples
+            self.publish(" ".join([*self.transcript_words, *new_words]))
+
+    def transcribe_chunk(self, chunk_end: int = None) -> list[str]:
+        """Transcribes the audio from the start of the current chunk.
+
+        Args:
+            chunk_end (int, optional): Where the chunk ends in the ring buffer. Defaults to everything recorded.
+
+        Returns:
+            list[str]: The words heard.
+        """
+        samples = self.ring_buffer.read(self.chunk_start, chunk_end)
+        if len(samples) == 0 or np.abs(samples).max() < SILENCE_PEAK:
+            return []
+        start_time = time.monotonic()
+        result = self.recognizer(
+            {"raw": samples, "sampling_rate": SAMPLE_RATE},
+            generate_kwargs=self.generate_kwargs,
+        )
+        if self.commander_gpt is not None:
+            self.commander_gpt.metrics.observe(
+                "stt_chunk_seconds",
+                time.monotonic() - start_time,
+                backend=self.backend_name,
+            )
+        return result["text"].split()
+
+    def publish(self, transcript: str):
+        """Shows the in-progress transcript, the same as AzureConnectionsManager's recognizing_cb.
+
+        Args:
+            transcript (str): Everything transcribed so far.
+        """
+        if self.commander_gpt:
+            # tell it to show your in-progress message
+            self.commander_gpt.state_handoff.post(
+                self.commander_gpt, subtitles=transcript
+            )
+        if self.on_transcript:
+            self.on_transcript(transcript)
+
+
+def create_speech_to_text(speech_to_text_config: dict, azure_connections_manager):
+    """Creates the speech to text backend for the configured backend.
+
+    Args:
+        speech_to_text_config (dict): The speech_to_text block of system_config.json.
+        azure_connections_manager (AzureConnectionsManager): Used for the "azure" backend.
+
+    Returns:
+        The backend, with start_speechtotext_from_mic(commander_gpt, on_transcript) and stop_speechtotext_from_mic() methods, and its backend_name.
+
+    Raises:
+        ValueError: If the backend isn't "azure" or "whisper".
+    """
+    backend = speech_to_text_config.get("backend", "azure")
+    if backend == "azure":
+        return azure_connections_manager
+    if backend == "whisper":
+        return LocalWhisperSpeechToText(
+            model_name=speech_to_text_config.get(
+                "whisper_model_name", "openai/whisper-base.en"
+            ),
+            language=speech_to_text_config.get("language", None),
+            device=speech_to_text_config.get("device", "cpu"),
+            chunk_seconds=speech_to_text_config.get("chunk_seconds", 8.0),
+            overlap_seconds=speech_to_text_config.get("overlap_seconds", 1.0),
+            partial_interval_seconds=speech_to_text_config.get(
+                "partial_interval_seconds", 0.5
+            ),
+        )
+    raise ValueError(
+        f"Unknown speech to text backend {backend}, expected azure or whisper"
+    )
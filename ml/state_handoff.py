@@ -0,0 +1,53 @@
+import queue
+
+
+class StateHandoff:
+    """Thread-safe handoff of state changes from the dialogue logic to whatever draws it.
+
+    The logic posts changes from any thread, and the drawing thread applies them all at once before drawing a frame,
+    so a frame never sees a half-applied change.
+    """
+
+    def __init__(self):
+        """Initializes an empty handoff."""
+        self.pending = queue.SimpleQueue()
+
+    def post(self, target, **changes):
+        """Queues attribute changes to be applied to the target.
+
+        Args:
+            target (object): The object to change, EG: an AICharacter or the CommanderGPTApp.
+            **changes: The attribute names and their new values.
+        """
+        self.pending.put((target, changes))
+
+    def post_call(self, callback, *args):
+        """Queues a function to be called from the drawing thread, EG: to create something only that thread may, like a Tk font or image.
+
+        Args:
+            callback (callable): The function to call.
+            *args: Arguments to call it with.
+        """
+        self.pending.put((None, (callback, args)))
+
+    def apply_pending(self) -> list[tuple]:
+        """Applies every queued change in the order they were posted.
+
+        Should be called from the thread that reads the state, EG: before drawing each frame.
+
+        Returns:
+            list[tuple]: The (target, changes) that were applied, target is None for calls.
+        """
+        applied = []
+        while True:
+            try:
+                target, changes = self.pending.get_nowait()
+            except queue.Empty:
+                return applied
+            if target is None:
+                callback, args = changes
+                callback(*args)
+            else:
+                for name, value in changes.items():
+                    setattr(target, name, value)
+            applied.append((target, changes))
@@ -0,0 +1,68 @@
+class SubtitleAlignment:
+    """When each character of the spoken text starts and ends, in seconds from the start of the audio."""
+
+    __slots__ = (
+        "characters",
+        "character_start_times_seconds",
+        "character_end_times_seconds",
+    )
+
+    def __init__(
+        self,
+        characters: list[str],
+        character_start_times_seconds: list[float],
+        character_end_times_seconds: list[float],
+    ):
+        self.characters = characters
+        self.character_start_times_seconds = character_start_times_seconds
+        self.character_end_times_seconds = character_end_times_seconds
+
+
+class SubtitleTimeline:
+    """Timing of spoken text for subtitles, in the same shape as 11labs' AudioWithTimestampsResponseModel so both are shown the same way."""
+
+    def __init__(self, alignment: SubtitleAlignment):
+        """Initializes the timeline.
+
+        Args:
+            alignment (SubtitleAlignment): When each character is spoken.
+        """
+        self.alignment = alignment
+
+    @classmethod
+    def from_word_boundaries(
+        cls, text: str, word_boundaries: list[tuple], audio_seconds: float
+    ) -> "SubtitleTimeline":
+        """Creates a timeline from the word boundaries reported while synthesizing speech.
+
+        Each character is shown once the word it belongs to (or the word before it, for spaces and punctuation) starts being spoken.
+
+        Args:
+            text (str): The text that was spoken.
+            word_boundaries (list[tuple]): (offset of the word in the text, length of the word, start in seconds, duration in seconds) for each word, in order.
+            audio_seconds (float): The length of the audio.
+
+        Returns:
+            SubtitleTimeline: The timeline.
+        """
+        start_times = [0.0] * len(text)
+        end_times = [audio_seconds] * len(text)
+        # characters from a word's offset onwards start with it, until the next word starts
+        previous_offset = len(text)
+        for text_offset, word_length, start_seconds, duration_seconds in reversed(
+            word_boundaries
+        ):
+            if text_offset < 0 or text_offset >= previous_offset:
+                continue
+            for index in range(text_offset, previous_offset):
+                start_times[index] = start_seconds
+            for index in range(text_offset, min(text_offset + word_length, len(text))):
+                end_times[index] = start_seconds + duration_seconds
+            previous_offset = text_offset
+        return cls(
+            SubtitleAlignment(
+                characters=list(text),
+                character_start_times_seconds=start_times,
+                character_end_times_seconds=end_times,
+            )
+        )
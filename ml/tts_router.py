@@ -0,0 +1,227 @@
+from collections import deque
+import statistics
+import time
+
+
+class ProviderHealth:
+    """How quickly, and how reliably, one TTS provider and voice has been returning audio recently."""
+
+    def __init__(self, window_size: int):
+        """Initializes the health without any syntheses.
+
+        Args:
+            window_size (int): How many of the most recent syntheses are tracked.
+        """
+        # seconds until each recent synthesis returned its audio
+        self.recent_seconds = deque(maxlen=window_size)
+        self.consecutive_failures = 0
+        # when the characters stopped using it, from the router's clock, or None while it's in use
+        self.failed_over_at: float = None
+
+    def median_seconds(self) -> float:
+        """Returns the median time to first audio of the recent syntheses, or None if there were none."""
+        if not self.recent_seconds:
+            return None
+        return statistics.median(self.recent_seconds)
+
+
+class TtsRouteChange:
+    """The characters using a voice switching which TTS provider speaks their lines."""
+
+    __slots__ = ("character_name", "voice", "from_provider", "to_provider", "reason")
+
+    def __init__(
+        self,
+        character_name: str,
+        voice: str,
+        from_provider: str,
+        to_provider: str,
+        reason: str,
+    ):
+        # the character whose line decided it
+        self.character_name = character_name
+        # the character's voice with their configured provider
+        self.voice = voice
+        self.from_provider = from_provider
+        self.to_provider = to_provider
+        # EG: "slow", "errors", or "recovered"
+        self.reason = reason
+
+    def to_dict(self) -> dict:
+        """Returns the change as a record for the metrics' spans file."""
+        return {
+            "type": "tts_route",
+            "character": self.character_name,
+            "voice": self.voice,
+            "from": self.from_provider,
+            "to": self.to_provider,
+            "reason": self.reason,
+        }
+
+
+class TtsRouter:
+    """Decides which TTS provider speaks each line, failing over from 11labs to the character's Azure voice while 11labs is slow or erroring.
+
+    The time to first audio of each provider and voice is tracked over the last window_size syntheses.
+    Once the primary's median is over the latency budget, or it fails max_consecutive_failures times in a row, the fallback speaks instead.
+    Every recovery_seconds one line is tried with the primary again, and if it's within budget the primary is used from then on.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        latency_budget_seconds: float = 2.0,
+        window_size: int = 5,
+        max_consecutive_failures: int = 2,
+        recovery_seconds: float = 60,
+        attempt_timeout_seconds: float = 6.0,
+        clock=time.monotonic,
+    ):
+        """Initializes the router, with every provider healthy.
+
+        Args:
+            enabled (bool, optional): Whether to fail over at all, if not each character always uses their configured provider. Defaults to False.
+            latency_budget_seconds (float, optional): The most the median time to first audio can be before failing over. Defaults to 2.
+            window_size (int, optional): How many of the most recent syntheses the median is taken over. Defaults to 5.
+            max_consecutive_failures (int, optional): How many syntheses in a row can fail before failing over. Defaults to 2.
+            recovery_seconds (float, optional): How long to wait before trying the primary again. Defaults to 60.
+            attempt_timeout_seconds (float, optional): How long to wait on the primary before using the fallback for the line instead. Defaults to 6.
+            clock (callable, optional): Returns the current time in seconds. Defaults to time.monotonic.
+        """
+        self.enabled = enabled
+        self.latency_budget_seconds = latency_budget_seconds
+        self.window_size = window_size
+        self.max_consecutive_failures = max_consecutive_failures
+        self.recovery_seconds = recovery_seconds
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.clock = clock
+        # (provider, voice) -> ProviderHealth
+        self.health = {}
+
+    def provider_health(self, provider: str, voice: str) -> ProviderHealth:
+        """Returns the health of a provider and voice, tracking it from now if it's new."""
+        key = (provider, voice)
+        health = self.health.get(key, None)
+        if health is None:
+            health = ProviderHealth(self.window_size)
+            self.health[key] = health
+        elif health.recent_seconds.maxlen != self.window_size:
+            # the window was resized by an edited config
+            health.recent_seconds = deque(
+                health.recent_seconds, maxlen=self.window_size
+            )
+        return health
+
+    def providers_to_try(self, ai_character, fallback_available: bool) -> list[str]:
+        """Returns the providers to try for the character's next line, in order, the later ones only if the earlier fail.
+
+        Args:
+            ai_character (AICharacter): The character speaking.
+            fallback_available (bool): Whether Azure TTS can be used, EG: False for a server session without an Azure key.
+
+        Returns:
+            list[str]: "elevenlabs" and/or "azure".
+        """
+        primary = "elevenlabs" if ai_character.use_elevenlabs_voice else "azure"
+        if not self.enabled or primary == "azure" or not fallback_available:
+            return [primary]
+        health = self.provider_health(primary, ai_character.elevenlabs_voice)
+        if (
+            health.failed_over_at is not None
+            and self.clock() - health.failed_over_at < self.recovery_seconds
+        ):
+            return ["azure"]
+        # the primary is healthy, or it's time to see if it has recovered
+        return ["elevenlabs", "azure"]
+
+    def record_success(
+        self, ai_character, provider: str, seconds: float
+    ) -> TtsRouteChange:
+        """Records how long a synthesis took to return its audio.
+
+        Args:
+            ai_character (AICharacter): The character who spoke.
+            provider (str): "elevenlabs" or "azure".
+            seconds (float): The time to first audio.
+
+        Returns:
+            TtsRouteChange: If the character switched providers because of it, otherwise None.
+        """
+        health = self.provider_health(provider, self.voice(ai_character, provider))
+        health.consecutive_failures = 0
+        if health.failed_over_at is not None:
+            # trying the primary again
+            if seconds <= self.latency_budget_seconds:
+                health.failed_over_at = None
+                # the slow syntheses from before no longer count against it
+                health.recent_seconds.clear()
+                health.recent_seconds.append(seconds)
+                return TtsRouteChange(
+                    ai_character.name,
+                    ai_character.elevenlabs_voice,
+                    "azure",
+                    provider,
+                    "recovered",
+                )
+            health.failed_over_at = self.clock()
+            return None
+        health.recent_seconds.append(seconds)
+        median_seconds = health.median_seconds()
+        if (
+            self.is_primary(ai_character, provider)
+            and len(health.recent_seconds) >= min(3, self.window_size)
+            and median_seconds > self.latency_budget_seconds
+        ):
+            health.failed_over_at = self.clock()
+            return TtsRouteChange(
+                ai_character.name,
+                ai_character.elevenlabs_voice,
+                provider,
+                "azure",
+                "slow",
+            )
+        return None
+
+    def record_failure(self, ai_character, provider: str) -> TtsRouteChange:
+        """Records a synthesis failing or timing out.
+
+        Args:
+            ai_character (AICharacter): The character who was speaking.
+            provider (str): "elevenlabs" or "azure".
+
+        Returns:
+            TtsRouteChange: If the character switched providers because of it, otherwise None.
+        """
+        health = self.provider_health(provider, self.voice(ai_character, provider))
+        health.consecutive_failures += 1
+        if health.failed_over_at is not None:
+            # it hasn't recovered yet
+            health.failed_over_at = self.clock()
+            return None
+        if (
+            self.is_primary(ai_character, provider)
+            and health.consecutive_failures >= self.max_consecutive_failures
+        ):
+            health.failed_over_at = self.clock()
+            return TtsRouteChange(
+                ai_character.name,
+                ai_character.elevenlabs_voice,
+                provider,
+                "azure",
+                "errors",
+            )
+        return None
+
+    def is_primary(self, ai_character, provider: str) -> bool:
+        """Whether the provider is the one the character is configured to use, and can fail over from."""
+        return (
+            self.enabled
+            and provider == "elevenlabs"
+            and ai_character.use_elevenlabs_voice
+        )
+
+    def voice(self, ai_character, provider: str) -> str:
+        """Returns the character's voice with the provider."""
+        if provider == "elevenlabs":
+            return ai_character.elevenlabs_voice
+        return ai_character.azure_voice_name
@@ -1,7 +1,8 @@
 from twitchio.ext import commands
 from twitchio import Message
 from .ai_character import AICharacter
-import random
+from .chat_intake import ChatIntake, normalize_chat_message
+from rich import print
 
 
 class TwitchBot(commands.Bot):
@@ -12,6 +13,12 @@ class TwitchBot(commands.Bot):
         twitch_channel_name: str = None,
         twitch_access_token: str = None,
         chat_history_length: int = 50,
+        character_names: list[str] = None,
+        user_cooldown_seconds: float = 5.0,
+        duplicate_window_seconds: float = 30.0,
+        first_time_chatter_bonus_seconds: float = 30.0,
+        mention_bonus_seconds: float = 60.0,
+        loop=None,
     ):
         """Initializes the TwitchBot for the given channel.
 
@@ -19,6 +26,12 @@ class TwitchBot(commands.Bot):
             twitch_channel_name (str): The name of the twitch channel which should be stored in system_config.json
             twitch_access_token (str): The access token for the bot account, which should be stored in token_config.json and created in the dev.twitch.tv interface.
             chat_history_length (int): How many chat messages should the bot remember.
+            character_names (list[str]): The names of the characters chat may mention, mentioned characters prefer those messages.
+            user_cooldown_seconds (float): Messages from a chatter sent sooner than this after their last one are ignored.
+            duplicate_window_seconds (float): Messages nearly identical to one sent within this many seconds are ignored.
+            first_time_chatter_bonus_seconds (float): How much newer a first time chatter's message is treated as when picking.
+            mention_bonus_seconds (float): How much newer a message mentioning the character is treated as when picking.
+            loop (asyncio.AbstractEventLoop): The event loop the bot will run on.
         """
         if not twitch_channel_name:
             error_message = "Twitch channel name not defined in system_config.json"
@@ -32,47 +45,108 @@ class TwitchBot(commands.Bot):
             token=twitch_access_token,
             prefix="!",
             initial_channels=[twitch_channel_name],
+            loop=loop,
         )
-        #
+        # recent chat messages waiting to be answered
         self.chat_history_length = chat_history_length
-        self.chat_history = []
+        self.chat_intake = ChatIntake(
+            capacity=chat_history_length,
+            character_names=character_names,
+            user_cooldown_seconds=user_cooldown_seconds,
+            duplicate_window_seconds=duplicate_window_seconds,
+            first_time_chatter_bonus_seconds=first_time_chatter_bonus_seconds,
+            mention_bonus_seconds=mention_bonus_seconds,
+        )
+        # how many chat messages were answered, and how many responses it took
+        self.messages_answered = 0
+        self.responses_requested = 0
 
     # We use a listener in our Component to display the messages received.
     async def event_message(self, message: Message) -> None:
         # print(f"{message.author.display_name}: {message.content}")
-        self.chat_history.append(message)
-        if len(self.chat_history) > self.chat_history_length:
-            # remove the oldest chat history
-            self.chat_history.pop(0)
+        # messages sent by the bot itself have no author
+        if message.echo or message.author is None:
+            return
+        self.chat_intake.add(
+            author=message.author.display_name,
+            content=message.content,
+            first=message.first,
+        )
 
         # we don't actually have any commands right now but in the future this needs to be called
         await self.handle_commands(message)
 
-    def pick_random_message(
-        self, ai_character: AICharacter, remove_after: bool = True
-    ) -> str:
-        """Picks a random message from the stored history and returns it.
+    def pick_message(self, ai_character: AICharacter, remove_after: bool = True) -> str:
+        """Picks the best message to answer from the stored history and returns it.
+        Recent messages, messages from first time chatters, and messages mentioning the character are preferred.
         Optionally removes the message from history so it cannot be picked a second time.
 
         Arguments:
-            remove_after (bool): Remove the randomly selected message from the chat history. Defaults to True.
+            ai_character (AICharacter): The character that will answer the message.
+            remove_after (bool): Remove the selected message from the chat history. Defaults to True.
 
         Returns:
             str: A message from twitch chat.
         """
-        if len(self.chat_history) <= 0:
+        picked_message = self.chat_intake.pick(
+            character_name=ai_character.name, remove=remove_after
+        )
+        if picked_message is None:
             return None
-        # [inclusive, exclusive) random number
-        random_message_index = random.randrange(0, len(self.chat_history))
-        random_message: Message = self.chat_history[random_message_index]
         extra_info = ""
-        if random_message.first:
+        if picked_message.first:
             extra_info = "[First Time Chatter]"
         # tell the ai character who is talking
-        ai_character.users_name = random_message.author.display_name
-        random_message_formatted_string = f"{extra_info}\n{random_message.content}"
+        ai_character.users_name = picked_message.author
         if remove_after:
-            # remove the message from history so it can't be picked again
-            self.chat_history.pop(random_message_index)
+            self.record_answered(1)
+        return f"{extra_info}\n{picked_message.content}"
+
+    def pick_digest(self, ai_character: AICharacter, max_messages: int = 10) -> str:
+        """Collects the chat messages that arrived since the last response into a single prompt so they can be answered together.
+        Each message is tagged with its author, and nearly identical messages are only included once.
+
+        Arguments:
+            ai_character (AICharacter): The character that will answer the messages.
+            max_messages (int): The most messages to include, the best ones are picked first. Defaults to 10.
+
+        Returns:
+            str: The digest of twitch chat messages, or None if there are none.
+        """
+        picked_messages = self.chat_intake.drain(
+            character_name=ai_character.name, max_messages=max_messages
+        )
+        lines = []
+        seen_messages = set()
+        for picked_message in picked_messages:
+            normalized = normalize_chat_message(picked_message.content)
+            if normalized in seen_messages:
+                continue
+            seen_messages.add(normalized)
+            extra_info = ""
+            if picked_message.first:
+                extra_info = " [First Time Chatter]"
+            lines.append(
+                f"[{picked_message.author}]{extra_info}: {picked_message.content}"
+            )
+        if len(lines) <= 0:
+            return None
+
+        # the messages come from many chatters, so don't attribute them to any one of them
+        ai_character.users_name = "Twitch Chat"
+        self.record_answered(len(lines))
+        header = f"{len(lines)} messages from twitch chat, answer as many as you can in one response and address the chatters by name:"
+        return "\n".join([header] + lines)
 
-        return random_message_formatted_string
+    def record_answered(self, message_count: int):
+        """Records that a single response will answer the given number of chat messages, and prints the throughput so far.
+
+        Arguments:
+            message_count (int): How many chat messages the response answers.
+        """
+        self.messages_answered += message_count
+        self.responses_requested += 1
+        print(
+            f"[yellow]\nTwitch chat: {self.messages_answered} messages answered in {self.responses_requested} responses "
+            f"({self.messages_answered / self.responses_requested:.2f} messages per response)."
+        )
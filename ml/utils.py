@@ -1,5 +1,6 @@
 import json
 import base64
+import math
 from mss import mss
 from pynput import keyboard
 from pynput.keyboard import KeyCode
@@ -55,16 +56,26 @@ def button_released(key: KeyCode, to_match_key: str = "7") -> bool:
     if to_match_key is None:
         return False
 
-    key_string = f"{KeyCode.from_char(key)}".replace("'", "").replace('"', "")
-    to_match_key_string = f"{KeyCode.from_char(to_match_key)}".replace("'", "").replace(
-        '"', ""
-    )
+    key_string = key_to_string(KeyCode.from_char(key))
+    to_match_key_string = key_to_string(KeyCode.from_char(to_match_key))
 
     if key_string == to_match_key_string:
         return False
     return True
 
 
+def key_to_string(key: KeyCode) -> str:
+    """Converts a key to a string that can be compared to the keys defined in the configs.
+
+    Args:
+        key (KeyCode): The key to convert.
+
+    Returns:
+        str: The key as a string without any quotes, EG: "Key.home" or "a".
+    """
+    return f"{key}".replace("'", "").replace('"', "")
+
+
 def wait_until_key(key_to_match: str = "7") -> None:
     """Waits until a specified key is released.
 
@@ -102,3 +113,20 @@ def screenshot_encode_monitor(monitor: int = 1) -> str:
         data = f.read()
     base64_image = base64.b64encode(data).decode("utf-8")
     return base64_image
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of the values.
+
+    Args:
+        values (list[float]): The values, in any order.
+        fraction (float): The percentile as a fraction, EG: 0.95.
+
+    Returns:
+        float: The percentile, or None if there are no values.
+    """
+    if len(values) <= 0:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
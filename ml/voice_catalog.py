@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import time
+
+from elevenlabs import VoiceSettings
+from elevenlabs.client import ElevenLabs
+from rich import print
+
+
+class VoiceCatalog:
+    """The 11labs voice names, ids, and settings, cached on disk so startup and a voice's first line don't wait on the API.
+
+    A cache older than its time to live is still used, but refreshed on a background thread.
+    """
+
+    def __init__(
+        self,
+        client: ElevenLabs,
+        cache_filepath: str = "cache/elevenlabs_voices.json",
+        ttl_seconds: float = 24 * 60 * 60,
+    ):
+        """Initializes the catalog from the disk cache, without calling the API.
+
+        Args:
+            client (ElevenLabs): The client used to fetch voices and settings.
+            cache_filepath (str, optional): Where the catalog is cached, not cached if None. Defaults to "cache/elevenlabs_voices.json".
+            ttl_seconds (float, optional): How long the cache is fresh for. Defaults to a day.
+        """
+        self.client = client
+        self.cache_filepath = cache_filepath
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+
+        # voice name -> voice id
+        self.voice_to_id = {}
+        # voice id -> VoiceSettings
+        self.settings_by_id = {}
+        self.fetched_at = 0.0
+        self.load()
+
+    def load(self):
+        """Loads the catalog from the disk cache, if there is one."""
+        if not self.cache_filepath or not os.path.exists(self.cache_filepath):
+            return
+        try:
+            with open(self.cache_filepath) as f:
+                cached = json.load(f)
+            self.voice_to_id = cached.get("voice_to_id", {})
+            self.settings_by_id = {
+                voice_id: None if settings is None else VoiceSettings(**settings)
+                for voice_id, settings in cached.get("settings_by_id", {}).items()
+            }
+            self.fetched_at = cached.get("fetched_at", 0.0)
+        except Exception as e:
+            print(f"[red]\nIgnoring the unreadable 11labs voice cache: {e}")
+            self.voice_to_id = {}
+            self.settings_by_id = {}
+            self.fetched_at = 0.0
+
+    def save(self):
+        """Writes the catalog to the disk cache."""
+        if not self.cache_filepath:
+            return
+        with self.lock:
+            cached = {
+                "fetched_at": self.fetched_at,
+                "voice_to_id": dict(self.voice_to_id),
+                "settings_by_id": {
+                    voice_id: None if settings is None else settings.dict()
+                    for voice_id, settings in self.settings_by_id.items()
+                },
+            }
+        directory = os.path.dirname(self.cache_filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # write then rename so a crash never leaves a half written cache
+        temporary_filepath = f"{self.cache_filepath}.tmp"
+        with open(temporary_filepath, "w") as f:
+            json.dump(cached, f, indent=4)
+        os.replace(temporary_filepath, self.cache_filepath)
+
+    def is_stale(self) -> bool:
+        """Returns whether the catalog is older than its time to live."""
+        return time.time() - self.fetched_at > self.ttl_seconds
+
+    def resolve(self, voice_names: list[str]):
+        """Makes sure the ids and settings of the given voices are known, fetching them only if they aren't cached.
+
+        The settings of each voice are fetched in parallel. A stale cache is refreshed on a background thread.
+
+        Args:
+            voice_names (list[str]): The voices the characters use.
+        """
+        voice_names = list(dict.fromkeys(voice_names))
+        if all(self.is_cached(voice_name) for voice_name in voice_names):
+            if self.is_stale():
+                self.refresh_in_background(voice_names)
+            return
+        self.refresh(voice_names)
+
+    def is_cached(self, voice_name: str) -> bool:
+        """Returns whether both the id and settings of the voice are known."""
+        with self.lock:
+            voice_id = self.voice_to_id.get(voice_name, None)
+            return voice_id is not None and voice_id in self.settings_by_id
+
+    def refresh(self, voice_names: list[str]):
+        """Fetches the list of voices, then the settings of the given voices in parallel, and caches them.
+
+        Args:
+            voice_names (list[str]): The voices whose settings to fetch.
+        """
+        voices = self.client.voices.get_all().voices
+        voice_to_id = {voice.name: voice.voice_id for voice in voices}
+        missing_voice_names = [
+            voice_name for voice_name in voice_names if voice_name not in voice_to_id
+        ]
+        if missing_voice_names:
+            print(
+                f"[red]\n11labs voices {missing_voice_names} were not found, the available voices are: {sorted(voice_to_id)}"
+            )
+        voice_ids = [
+            voice_to_id[voice_name]
+            for voice_name in voice_names
+            if voice_name in voice_to_id
+        ]
+        settings_by_id = {}
+        if voice_ids:
+            with ThreadPoolExecutor(max_workers=len(voice_ids)) as executor:
+                settings_by_id = dict(
+                    zip(
+                        voice_ids,
+                        executor.map(self.client.voices.get_settings, voice_ids),
+                    )
+                )
+        with self.lock:
+            self.voice_to_id = voice_to_id
+            self.settings_by_id.update(settings_by_id)
+            self.fetched_at = time.time()
+        self.save()
+
+    def refresh_in_background(self, voice_names: list[str]):
+        """Refreshes the catalog on a background thread, unless a refresh is already running.
+
+        Args:
+            voice_names (list[str]): The voices whose settings to fetch.
+        """
+        if self.refresh_thread is not None and self.refresh_thread.is_alive():
+            return
+
+        def refresh():
+            try:
+                self.refresh(voice_names)
+            except Exception as e:
+                print(f"[red]\nFailed to refresh the 11labs voices: {e}")
+
+        self.refresh_thread = threading.Thread(target=refresh, daemon=True)
+        self.refresh_thread.start()
+
+    def voice_id(self, voice_name: str) -> str:
+        """Returns the id of the voice, refreshing the catalog if the voice isn't in it.
+
+        Args:
+            voice_name (str): The name of the voice.
+
+        Returns:
+            str: The voice's id.
+
+        Raises:
+            KeyError: If there is no voice with that name.
+        """
+        if voice_name not in self.voice_to_id:
+            self.refresh([voice_name])
+        return self.voice_to_id[voice_name]
+
+    def voice_settings(self, voice_name: str) -> VoiceSettings:
+        """Returns the settings of the voice, fetching and caching them if they aren't known yet.
+
+        Args:
+            voice_name (str): The name of the voice.
+
+        Returns:
+            VoiceSettings: The voice's settings.
+        """
+        voice_id = self.voice_id(voice_name)
+        with self.lock:
+            if voice_id in self.settings_by_id:
+                return self.settings_by_id[voice_id]
+        settings = self.client.voices.get_settings(voice_id)
+        with self.lock:
+            self.settings_by_id[voice_id] = settings
+        self.save()
+        return settings